@@ -12,12 +12,14 @@ Comparison:
 - each Directory object contains a list of all files contained in the dir
   and its subdirs, ordered alphabetically
   (if equal, two subdirs are equal)
-- add md5 digest for more efficient comparison
+- add md5 digest for more efficient comparison (or another --hash backend)
 - option to use dircmd
 - another option to use filecmd to compare contents of each file
-
-Future enhancements:
-- flag to  find directories where is an extended duplicate (e.g. contains additional files)??
+- --similar finds directories that are near duplicates or extended
+  duplicates (e.g. contain additional files) with MinHash signatures of
+  file names and sizes
+- --export writes a snapshot of a scan, --merge finds duplicates across
+  snapshots of several machines
 
 
 Reference:
@@ -30,5 +32,21 @@ Reference:
 - `argparse <http://docs.python.org/library/argparse.html>`_
 
 
-TODO-beb: tests
+Library:
+--------
+``dupdirs.scan(roots, **options)`` yields the duplicate sets without the
+command line (see api). Nothing is imported before the first call, so
+importing dupdirs is cheap.
+
+
+Tests:
+------
+In dupdirs/tests, run from src with
+``python -m unittest discover -s dupdirs/tests -t .``
 """
+
+
+def scan(roots, **options):
+    """Yield DuplicateSets of duplicate directories below roots, see api.scan()."""
+    from api import scan as _scan
+    return _scan(roots, **options)
@@ -1,39 +1,89 @@
 
 from __future__ import print_function
 
-from collections import defaultdict
-from functools import wraps
-import hashlib
+from datetime import timedelta
+import heapq
+import os
+import signal
 import sys
 
 import cli.app
 
-from duplicate_set import DuplicateSet, ShallowDuplicateSet
-from dirtree import DirTree, Factory
-from datetime import datetime
-
-
-def timed(f):
-    """Time execution, print results."""
-    @wraps(f)
-    def wrapper(*args, **kwds):
-        start_time = datetime.now()
-
-        res = f(*args, **kwds)
-        delta = datetime.now() - start_time
-        print('time elapsed', delta)
-        return res
-    return wrapper
+# only what a plain scan and the parameters need, the modules of other
+# modes (--input, --dircmp, --filecmp, --files, --export, --merge,
+# --progress, --format jsonl) are imported where they are used
+from api import build_index, group
+from duplicate_set import (ShallowDuplicateSet, eliminate_nested, group_duplicates, human_readable,
+                           split_hardlinked)
+from filters import EXCLUDE, INCLUDE, FilterError
+from hashing import DEFAULT_HASH, HASHES
+from dirtree import DIGEST_MODES, SymlinkError, scan
+from resultformat import FORMATS
+from stats import Stats, peak_rss
+from verify import DEFAULT_READER, READERS
+from walker import DEFAULT_WALKER, WALKERS
 
 
 class FindDuplicatesDirs(cli.app.CommandLineApp):
 
-    @timed
     def main(self):
-        if self.params.input:
-            self.interactive()
-        else:
-            self.find_duplicates()
+        self.stats = Stats()
+        progress = None
+        if self.params.progress or self.params.eta_from:
+            from progress import ProgressError
+            try:
+                progress = self._start_progress()
+            except ProgressError as e:
+                self.error('ERROR:', e)
+                return 1
+        profiler = self._start_profile()
+        try:
+            with self.stats.timer('total'):
+                if self.params.input:
+                    return self.interactive()
+                else:
+                    return self.find_duplicates()
+        finally:
+            if progress is not None:
+                progress.stop()
+            self._stop_profile(profiler)
+            self.info('time elapsed', timedelta(seconds=self.stats.timers['total']))
+            if self.params.stats:
+                self.info('\n'.join(self.stats.report()))
+            if self.params.stats_file:
+                self.stats.write(self.params.stats_file)
+
+    def _start_progress(self):
+        """Start the --progress line, with an ETA from the --eta-from totals."""
+        from progress import Progress, read_totals
+        totals = read_totals(self.params.eta_from) if self.params.eta_from else None
+        return Progress(self.stats, totals).start()
+
+    def _start_profile(self):
+        if not self.params.profile:
+            return None
+        import cProfile
+        try:
+            import tracemalloc
+            tracemalloc.start()
+        except ImportError:
+            pass
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profile(self, profiler):
+        """Write cProfile data to --profile, add top allocations to stats."""
+        if profiler is None:
+            return
+        profiler.disable()
+        profiler.dump_stats(self.params.profile)
+        tracemalloc = sys.modules.get('tracemalloc')
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.stats.set('profile', 'top allocations',
+                           [str(stat) for stat in snapshot.statistics('lineno')[:10]])
 
 
     def interactive(self):
@@ -42,33 +92,56 @@ class FindDuplicatesDirs(cli.app.CommandLineApp):
             self.error("ERROR: don't use paths in interactive mode.")
             return
 
+        from resultformat import ResultFormatError
         with open(self.params.input) as f:
-            self._process_duplicates_from_file(f)
+            try:
+                self._process_duplicates_from_file(f)
+            except ResultFormatError as e:
+                self.error('ERROR:', e)
+                return 1
 
     def _process_duplicates_from_file(self, f):
+        """Process text or jsonl results (see resultformat.read_events)."""
+        from deletion import DeletionEngine, Journal
+        from resultformat import read_events
+        journal = Journal(self.params.journal) if self.params.journal else None
+        engine = DeletionEngine(self.params.commit, self.params.jobs, journal, self.stats,
+                                self.params.hash, self.params.reader)
         current_ds = None
 
-        for line in f:
-            line = line.strip()
-            line_type, params = ShallowDuplicateSet.parse_line(line)
-            if line_type == 'SET_START':
-                print()
-                print(line)
+        with self.stats.timer('delete'):
+            try:
+                for line_type, params, line in read_events(f):
+                    if line_type == 'SET_START':
+                        if current_ds:
+                            print('\n'.join(current_ds.log))
+                        new_ds = ShallowDuplicateSet(params['num_duplicates'], params['num_files'], params['digest'],
+                                                     params['size'], params['kind'])
+                        new_ds.log.extend(['', line])
+                        if current_ds:
+                            new_ds.log.append('-->error: did not terminate last set properly')
+                        current_ds = new_ds
+                    elif current_ds is None:
+                        # e.g. a similarity set, nothing to process
+                        continue
+                    elif line_type == 'SET_END':
+                        if current_ds.digest != params['digest']:
+                            current_ds.log.append('-->digest mismatch, ignoring')
+                            continue
+                        engine.submit(current_ds)
+                        # clear
+                        current_ds = None
+                    elif line_type == 'ERROR':
+                        current_ds.add_error(params)
+                    elif line_type == 'DUPLICATE':
+                        current_ds.log.append(line)
+                        current_ds.add(params['cmd'], params['path'])
                 if current_ds:
-                    print('-->error: did not terminate last set properly')
-                current_ds = ShallowDuplicateSet(params['num_duplicates'], params['num_files'], params['digest'], params['size'])
-            elif line_type == 'SET_END':
-                if current_ds.digest != params['digest']:
-                    print('-->digest mismatch, ignoring')
-                    continue
-                current_ds.process(self.params.commit)
-                # clear
-                current_ds = None
-            elif line_type == 'ERROR':
-                current_ds.add_error(params)
-            elif line_type == 'DUPLICATE':
-                print(line)
-                current_ds.add(params['cmd'], params['path'])
+                    print('\n'.join(current_ds.log))
+            finally:
+                # sets already submitted are finished and the journal is closed, even
+                # if reading the input fails
+                self.info(engine.close())
 
 
     def find_duplicates(self):
@@ -78,68 +151,280 @@ class FindDuplicatesDirs(cli.app.CommandLineApp):
         if not len(self.params.root):
             self.error("ERROR: please supply a path")
             return
-
-        duplicates = self._build_duplicate_set()
-
+        if self.params.memory_limit and self.params.similar:
+            self.error("ERROR: --similar is not supported with --memory-limit")
+            return 1
+        if self.params.merge and (self.params.similar or self.params.dircmp or
+                                  self.params.filecmp or self.params.export):
+            self.error("ERROR: --similar, --dircmp, --filecmp and --export need a scan, not --merge")
+            return 1
+        if self.params.watch and (self.params.compact or self.params.memory_limit or
+                                  self.params.merge or self.params.export or self.params.cache or
+                                  self.params.similar or self.params.dircmp or self.params.filecmp):
+            self.error("ERROR: --watch keeps all DirTrees, it can't be combined with --compact, --memory-limit, "
+                       "--merge, --export, --cache, --similar, --dircmp or --filecmp")
+            return 1
+        if self.params.files and (self.params.merge or self.params.export or self.params.watch or
+                                  self.params.similar or self.params.dircmp):
+            self.error("ERROR: --files can't be combined with --merge, --export, --watch, --similar or --dircmp")
+            return 1
+
+        if self.params.format == 'jsonl' and not (self.params.export or self.params.watch):
+            from resultformat import header
+            print(header())
+        errors = (FilterError, IOError, OSError)
+        if self.params.merge or self.params.export:
+            from snapshot import SnapshotError
+            errors += (SnapshotError,)
+        try:
+            if self.params.merge:
+                duplicates = self._merge_snapshots()
+            else:
+                duplicates = self._build_duplicate_set()
+        except SymlinkError:
+            # exit on symlink
+            sys.exit(1)
+        except errors as e:
+            self.error('ERROR:', e)
+            return 1
+        if self.params.export:
+            return 0
+        if self.params.files:
+            return self._find_duplicate_files()
+        if self.params.watch:
+            return self._watch(duplicates)
+
+        timer = self.stats.timer
         if not self.params.no_nested_duplicates:
             self.verbose('\n\nall duplicates found:', len(duplicates))
             duplicates = self._eliminate_nested_duplicates(duplicates)
+            if not self.params.stream:
+                # with --stream this is part of the output phase
+                with timer('nested'):
+                    duplicates = list(duplicates)
 
-        if self.params.limit_results:
-            # slice the biggest few
-            start = len(duplicates) - self.params.limit_results
-            duplicates = duplicates[start:]
+        # filled as duplicates are consumed
+        hardlinked = []
+        duplicates = split_hardlinked(duplicates, hardlinked)
+        with timer('order'):
+            duplicates = self._order_duplicates(duplicates)
 
         # output results, optionally run dircmp and filecmp
         # doing this in one loop provides continous output and creates
         # an impression of progress.
+        if self.params.filecmp:
+            from verify import ContentVerifier
+            verifier = ContentVerifier(self.params.jobs, self.stats, hash_name=self.params.hash,
+                                       reader=self.params.reader)
+        if self.params.dircmp:
+            # sets are checked ahead on the pool while results are printed
+            from structure import StructureVerifier
+            structure = StructureVerifier(self.params.jobs, self.stats, self.index.filters,
+                                          self.params.one_file_system, self.factory)
+            duplicates = structure.map(duplicates, 'verify')
+        processed = 0
         for d in duplicates:
-            if self.params.dircmp:
-                d.dircmp()
+            with timer('verify'):
+                if self.params.filecmp:
+                    d.filecmp(verifier)
+
+            with timer('output'):
+                self._print_result(d)
+                # a consumer on the other end of a pipe can start right away
+                sys.stdout.flush()
+            processed += 1
+        if self.params.filecmp:
+            verifier.close()
+        if self.params.dircmp:
+            structure.close()
+        self.info('\n\nduplicates processed:', processed)
+        if hardlinked:
+            with timer('output'):
+                for hs in hardlinked:
+                    self._print_result(hs)
+            self.info('\n\nhardlinked sets (nothing to reclaim):', len(hardlinked))
+        if self.params.similar:
+            self._find_similar()
+        return 0
 
-            if self.params.filecmp:
-                d.filecmp()
+    def _find_similar(self):
+        """Print similarity sets of all scanned directories."""
+        from similarity import find_similar
+        with self.stats.timer('similar'):
+            similar = find_similar(self.factory.ordered_values(), self.params.similar,
+                                   self.params.min_size, self.stats)
+        with self.stats.timer('output'):
+            for ss in similar:
+                self._print_result(ss)
+        self.info('\n\nsimilarity sets:', len(similar))
+
+    def _find_duplicate_files(self):
+        """Print sets of identical files found in the scan, ordered by wasted space."""
+        from filedups import find_duplicate_files
+        from verify import ContentVerifier
+        timer = self.stats.timer
+        verifier = ContentVerifier(self.params.jobs, self.stats, hash_name=self.params.hash,
+                                   reader=self.params.reader)
+        try:
+            with timer('filecmp'):
+                sets = find_duplicate_files(self.factory.file_index, verifier, self.stats)
+        finally:
+            verifier.close()
+        with timer('order'):
+            sets = self._order_duplicates(sets, size=lambda fs: fs.wasted)
+        with timer('output'):
+            for fs in sets:
+                self._print_result(fs)
+        self.info('\n\nduplicate file sets: %s, %s bytes wasted' % (
+            len(sets), human_readable(sum(fs.wasted for fs in sets))))
+        return 0
 
-            print(d)
-        print('\n\nduplicates processed:', len(duplicates))
+    def _print_result(self, result, file=None):
+        """Print a DuplicateSet (or subclass) or SimilaritySet in the selected --format."""
+        if self.params.format == 'jsonl':
+            from resultformat import dumps
+            print(dumps(result.as_record()), file=file)
+        else:
+            print(result, file=file)
+
+    def _watch(self, duplicates):
+        """Rewrite the --watch report whenever the scanned trees change, until interrupted."""
+        from watch import WatchDirIndex, WatchError, Watcher
+        factory = self.factory
+
+        def rescan():
+            self.info('inotify queue overflow, scanning everything again')
+            factory.clear()
+            factory.ordered_keys = []
+            factory.dirs = WatchDirIndex()
+            self.trees = scan(self.params.root, factory, type(self.trees[0]), self.params.mtime,
+                              self.params.symlink_warning, self.params.jobs)
+            return self.trees
+
+        def on_update(factory):
+            self._write_report(group_duplicates(factory.ordered_values(), self.params.min_size))
+            if self.params.stats_file:
+                self.stats.write(self.params.stats_file)
+
+        try:
+            watcher = Watcher(factory, self.trees, rescan, self.stats)
+        except WatchError as e:
+            self.error('ERROR:', e)
+            return 1
+        self._write_report(duplicates)
+        self.info('watching %s directories, report: %s' % (
+            self.stats.get('watch', 'directories watched'), self.params.watch))
+        # stop cleanly on kill as well
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            watcher.run(on_update)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
         return 0
 
+    def _write_report(self, duplicates):
+        """Write all duplicate sets to the --watch report (replaced at once)."""
+        if not self.params.no_nested_duplicates:
+            duplicates = self._eliminate_nested_duplicates(duplicates)
+        hardlinked = []
+        duplicates = self._order_duplicates(split_hardlinked(duplicates, hardlinked))
+        tmp = self.params.watch + '.tmp'
+        with open(tmp, 'w') as f:
+            if self.params.format == 'jsonl':
+                from resultformat import header
+                print(header(), file=f)
+            for result in list(duplicates) + hardlinked:
+                self._print_result(result, f)
+        os.rename(tmp, self.params.watch)
+
+    def _order_duplicates(self, duplicates, size=lambda ds: ds.size):
+        """
+        Sort duplicates by size (unless streaming), keep only the biggest
+        few with --limit-results.
+        """
+        if self.params.stream and not self.params.limit_results:
+            return duplicates
+        # index keeps the sort stable
+        if self.params.reverse:
+            key = lambda item: (-size(item[1]), item[0])
+        else:
+            key = lambda item: (size(item[1]), item[0])
+        items = enumerate(duplicates)
+        if self.params.limit_results:
+            # the last n of the sorted list, without sorting everything
+            items = heapq.nlargest(self.params.limit_results, items, key=key)
+        return [ds for _idx, ds in sorted(items, key=key)]
+
     def _build_duplicate_set(self):
-        factory = Factory()
-        # build up all directory trees
         for root in self.params.root:
             self.verbose('looking for duplicates in', root)
-            DirTree(root, factory, self.params.mtime, self.params.symlink_warning)
+        params = self.params
+        index = build_index(params.root, walker=params.walker, filters=params.filters,
+                            min_file_size=params.min_file_size, cache=params.cache,
+                            memory_limit=params.memory_limit, compact=params.compact,
+                            digest_mode=params.digest_mode, hash_name=params.hash,
+                            use_mtime=params.mtime, symlink_warning=params.symlink_warning,
+                            one_file_system=params.one_file_system, similar=bool(params.similar),
+                            files=params.files, watch=bool(params.watch), jobs=params.jobs,
+                            stats=self.stats, on_warning=self.info)
+        self.index = index
+        self.factory = index.factory
+        self.trees = index.trees
+        if params.cache:
+            self.verbose('scan cache: %s hits, %s misses, %s files not read again' % (
+                self.stats.get('cache', 'hit'), self.stats.get('cache', 'miss'),
+                self.stats.get('cache', 'files skipped')))
+
+        if params.export:
+            self._export(index)
+            return None
+        if params.files:
+            return None
 
         # build all duplicates (may still contain nested duplicates)
-        dirs_by_digest = defaultdict(DuplicateSet)
-        for item in factory.values():
-            dirs_by_digest[item.digest].add(item)
+        duplicates = group(index, params.min_size)
+        self.verbose('peak memory: %s KB' % peak_rss())
+        return duplicates
 
-        # get all actual duplicates
-        duplicates = [item for item in dirs_by_digest.values() if len(item.items) > 1] # order duplicate sets by size
-        duplicates.sort(key=lambda ds:ds.size, reverse=self.params.reverse)
+    def _export(self, index):
+        """Write all scanned directories to the --export snapshot."""
+        from snapshot import export
+        try:
+            with self.stats.timer('export'):
+                count = export(self.params.export, index.factory.ordered_values(), self.params.root,
+                               index.digest_mode, self.params.mtime, index.filters, self.params.hash)
+        finally:
+            if self.params.memory_limit:
+                index.factory.close()
+        self.info('%s directories exported to %s' % (count, self.params.export))
+
+    def _merge_snapshots(self):
+        """Group the directories of all snapshots (given as roots) like _build_duplicate_set."""
+        from snapshot import merge
+        for path in self.params.root:
+            self.verbose('merging snapshot', path)
+        with self.stats.timer('group'):
+            duplicates = merge(self.params.root, self.params.min_size, self.stats)
+        self.stats.set('memory', 'peak rss after grouping (KB)', peak_rss())
         return duplicates
 
     def _eliminate_nested_duplicates(self, duplicates):
         """
-        This will most likely be not very effective for most data sets, so it is
-        optional.
+        Drop all sets where the parents of all items are duplicates of each
+        other (see eliminate_nested).
         """
-        # eliminate all nested duplicates
-        real_duplicates = []
-        for idx, smaller_item in enumerate(duplicates):
-            for larger_item in duplicates[idx+1:]:
-                if larger_item.contains(smaller_item):
-                    break
-            else:
-                real_duplicates.append(smaller_item)
-        return real_duplicates
+        return eliminate_nested(duplicates)
 
 
     def verbose(self, *args):
         if self.params.verbose:
-            print(*args)
+            self.info(*args)
+
+    def info(self, *args):
+        """print everything except results, not mixed with jsonl results"""
+        print(*args, file=sys.stderr if self.params.format == 'jsonl' else sys.stdout)
 
     def error(self, *args):
         """print error output"""
@@ -150,20 +435,72 @@ class FindDuplicatesDirs(cli.app.CommandLineApp):
         """Define commandline parameters and messages."""
         super(FindDuplicatesDirs, self).setup()
 
+        self.add_param("--cache",
+                                  help="scan cache (SQLite file), directories with unchanged inode and mtime are not read again. Files changed in place are not detected.",
+                                  action="store")
+
         self.add_param("-c", "--commit",
                                   help="actually do the deletions (only used with --input)",
                                   default=False, action="store_true")
 
         self.add_param("-d", "--dircmp",
-                                  help="use dircmp to verify results (after applying the limit)",
+                                  help="verify names, types and sizes of all entries of all copies against each other and the scan, report funny files (symlinks, special files) at any depth. Cheap: every directory is listed once, sets are checked in parallel with --jobs",
+                                  default=False, action="store_true")
+
+        self.add_param("--compact",
+                                  help="store scanned directories in a compact table instead of keeping all DirTrees (much less memory, implies --digest-mode merkle)",
                                   default=False, action="store_true")
 
+        self.add_param("--digest-mode",
+                                  help="flat: digest of all files in the tree, merkle: digest of own files and child digests (less memory)",
+                                  choices=sorted(DIGEST_MODES), default='flat', action="store")
+
+        self.add_param("--eta-from",
+                                  help="--stats-file of an earlier run of the same roots, its totals give percentage and ETA of the --progress line (implies --progress)",
+                                  action="store")
+
+        self.add_param("--exclude",
+                                  help="exclude files and directories matching this pattern (glob, re:regex, trailing / for directories only, a slash matches the end of the path), excluded directories are not read. Can be repeated, the first matching --exclude/--include decides.",
+                                  dest="filters", type=lambda pattern: (EXCLUDE, pattern), action="append")
+
+        self.add_param("--export",
+                                  help="scan only and write all directories to this snapshot file, snapshots of several machines can be combined with --merge",
+                                  action="store")
+
+        self.add_param("--filter-file",
+                                  help="read include (+ pattern) and exclude (- pattern) rules from this file, one per line",
+                                  dest="filters", type=lambda path: ('file', path), action="append")
+
         self.add_param("-f", "--filecmp",
-                                  help="use filecmp on duplicate sets to verify results (after applying the limit)",
+                                  help="verify the contents of every reported set: the files at the same path in all copies are compared by size, a partial hash and a full hash (each file is read in full once at most, hardlinked sets are not checked). With --limit-results only the sets that are printed are checked",
                                   default=False, action="store_true")
 
+        self.add_param("--files",
+                                  help="find duplicate files instead of directories (same scan, then partial and full hashes of files with the same size), sets are ordered by wasted space and can be processed with --input",
+                                  default=False, action="store_true")
+
+        self.add_param("--format",
+                                  help="text: human readable results, jsonl: one JSON record per set (other output goes to stderr). --input reads both.",
+                                  choices=FORMATS, default='text', action="store")
+
+        self.add_param("--include",
+                                  help="include files and directories matching this pattern, even if a later --exclude matches",
+                                  dest="filters", type=lambda pattern: (INCLUDE, pattern), action="append")
+
+        self.add_param("--hash",
+                                  help="hash for digests and --filecmp (default %s, md5 digests are written without the name of the hash)" % DEFAULT_HASH,
+                                  choices=list(HASHES), default=DEFAULT_HASH, action="store")
+
         self.add_param("-i", "--input",
-                                  help="input file for interactive deletion, contents of file are processed and deleted.",
+                                  help="input file for interactive deletion (text or jsonl), contents of file are processed and deleted. Mark folders with [delete], [hardlink] or [reflink] (replace files with links to the first kept folder), anything else is kept.",
+                                  action="store")
+
+        self.add_param("-j", "--jobs",
+                                  help="number of threads for scanning, --filecmp and processing --input (default 1)",
+                                  type=int, default=1, action="store")
+
+        self.add_param("--journal",
+                                  help="with --input: record deleted folders and finished sets in this file, a commit that was interrupted continues where it stopped when started again with the same journal",
                                   action="store")
 
         self.add_param("-l", "--limit-results",
@@ -174,10 +511,42 @@ class FindDuplicatesDirs(cli.app.CommandLineApp):
                                   help="include last modifieds time in detection of duplicates",
                                   default=False, action="store_true")
 
+        self.add_param("--memory-limit",
+                                  help="scan trees larger than memory: keep scanned directories in sorted temporary files, about n MB for the sort buffer (implies --digest-mode merkle, no --similar)",
+                                  type=int, default=0, action="store")
+
+        self.add_param("--merge",
+                                  help="the paths are snapshots written with --export, find duplicates across all of them without scanning (paths of other hosts are shown as host:path)",
+                                  default=False, action="store_true")
+
+        self.add_param("--min-file-size",
+                                  help="ignore files smaller than n bytes",
+                                  type=int, default=0, action="store")
+
+        self.add_param("--min-size",
+                                  help="ignore directories smaller than n bytes",
+                                  type=int, default=0, action="store")
+
         self.add_param("-n", "--no-nested-duplicates",
                                   help="don't detect nested duplicates",
                                   default=False, action="store_true")
 
+        self.add_param("-x", "--one-file-system",
+                                  help="don't descend into directories on other file systems",
+                                  default=False, action="store_true")
+
+        self.add_param("--profile",
+                                  help="write cProfile data to this file (and add top memory allocations to the stats if tracemalloc is available)",
+                                  action="store")
+
+        self.add_param("--progress",
+                                  help="show directories, files, bytes and throughput of the running phase on stderr (once a second on a terminal, every 10 seconds otherwise)",
+                                  default=False, action="store_true")
+
+        self.add_param("--reader",
+                                  help="how --filecmp, --files and linking with --input read files for the full hash: read: buffered reads, mmap: memory-map files of 16 MB and more (smaller files and files that can't be mapped are read). MB/s of each reader are in --stats (default %s)" % DEFAULT_READER,
+                                  choices=READERS, default=DEFAULT_READER, action="store")
+
         self.add_param("-r", "--reverse",
                                   help="reverse output of duplicates (largest duplicate first)",
                                   default=False, action="store_true")
@@ -186,10 +555,34 @@ class FindDuplicatesDirs(cli.app.CommandLineApp):
                                   help="warn when encountering symlinks (default behavoiur is exit on first symlink found)",
                                   default=False, action="store_true")
 
+        self.add_param("--similar",
+                                  help="also report pairs of directories with a similarity (or containment of the smaller one) of at least this value (0-1), e.g. copies with a few extra files",
+                                  type=float, default=0, action="store")
+
+        self.add_param("--stream",
+                                  help="output duplicates as soon as they are found, without sorting by size",
+                                  default=False, action="store_true")
+
+        self.add_param("--stats",
+                                  help="print timers and counters for each phase",
+                                  default=False, action="store_true")
+
+        self.add_param("--stats-file",
+                                  help="write timers and counters for each phase to this file (JSON)",
+                                  action="store")
+
         self.add_param("-v", "--verbose",
                                   help="more verbose output",
                                   default=False, action="store_true")
 
+        self.add_param("--watch",
+                                  help="keep running after the scan, rewrite the duplicate report in this file whenever the trees change (Linux, inotify). Counters and update latency are in --stats-file.",
+                                  action="store")
+
+        self.add_param("-w", "--walker",
+                                  help="engine for reading directories (default: %s)" % DEFAULT_WALKER,
+                                  choices=sorted(WALKERS), default=DEFAULT_WALKER, action="store")
+
         self.add_param("root", nargs='*', help="path(s) to search for duplicates")
 
 
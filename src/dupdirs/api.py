@@ -0,0 +1,158 @@
+"""
+Library API, the command line is a thin layer on top of it.
+
+    import dupdirs
+
+    for ds in dupdirs.scan(['/data', '/backup'], jobs=4):
+        print(ds.size, [item.path for item in ds.items])
+
+scan() yields the same sets as the command line without --input, in
+scan order, HardlinkedSets last. Nothing is printed: warnings (symlinks,
+directories seen under another path) go to on_warning(message), and
+on_progress(phase, stats) is called after each phase (scan, digest,
+group). A symlink raises dirtree.SymlinkError unless symlink_warning is
+set, unreadable roots raise IOError/OSError, bad filters FilterError.
+An unreadable subdirectory raises IOError/OSError as well, unless there
+is an on_error(path, exception): then the scan goes on without that
+directory, so the directories above it are compared without it.
+
+build_index() and group() are the two halves of scan(), for callers
+that need the scanned directories (export, watch, --files).
+
+Options of build_index() are the long command line options: walker,
+filters (list of (action, pattern) as in filters.make_filters),
+min_file_size, cache (path), memory_limit (MB), compact, digest_mode,
+hash_name, use_mtime, symlink_warning, one_file_system, similar, files,
+watch, jobs.
+"""
+
+from __future__ import print_function
+
+from dirtree import DIGEST_MODES, Factory, MerkleDirTree, scan as scan_trees
+from duplicate_set import eliminate_nested, group_duplicates, split_hardlinked
+from filters import make_filters
+from hashing import DEFAULT_HASH
+from nodetable import NodeTable
+from stats import Stats, peak_rss
+from walker import DEFAULT_WALKER, make_walker
+
+
+class Index(object):
+    """All directories of a scan: factory, root trees, tree_class, filters and stats."""
+
+    def __init__(self, factory, trees, tree_class, filters, stats):
+        self.factory = factory
+        self.trees = trees
+        self.tree_class = tree_class
+        self.filters = filters
+        self.stats = stats
+
+    @property
+    def digest_mode(self):
+        return [name for name, cls in DIGEST_MODES.items() if cls is self.tree_class][0]
+
+
+def _ignore(*args):
+    pass
+
+
+def build_index(roots, walker=DEFAULT_WALKER, filters=None, min_file_size=0, cache=None,
+                memory_limit=0, compact=False, digest_mode='flat', hash_name=DEFAULT_HASH,
+                use_mtime=False, symlink_warning=False, one_file_system=False, similar=False,
+                files=False, watch=False, jobs=1, stats=None, on_progress=None, on_warning=None,
+                on_error=None):
+    """Scan roots and calculate all digests, return an Index."""
+    if stats is None:
+        stats = Stats()
+    on_progress = on_progress or _ignore
+    filters = make_filters(filters, min_file_size)
+    walker = make_walker(walker, stats, filters)
+    scan_cache = None
+    if cache:
+        from scancache import CachingWalker, ScanCache
+        scan_cache = ScanCache(cache, filters)
+        walker = CachingWalker(walker, scan_cache)
+    minhash = None
+    if similar:
+        from similarity import MinHash
+        minhash = MinHash()
+    if memory_limit:
+        from extsort import ExtSortFactory
+        factory = ExtSortFactory(walker, memory_limit * 1024 * 1024)
+        tree_class = MerkleDirTree
+    elif compact:
+        factory = NodeTable(walker, minhash)
+        tree_class = MerkleDirTree
+    else:
+        factory = Factory(walker, minhash)
+        tree_class = DIGEST_MODES[digest_mode]
+    factory.one_file_system = one_file_system
+    factory.hash_name = hash_name
+    factory.warn = on_warning or _ignore
+    factory.on_error = on_error
+    if files:
+        from filedups import FileIndex
+        factory.file_index = FileIndex()
+    if watch:
+        # directories may move while watching
+        from watch import WatchDirIndex
+        factory.dirs = WatchDirIndex()
+    try:
+        with stats.timer('scan'):
+            trees = scan_trees(roots, factory, tree_class, use_mtime, symlink_warning, jobs)
+        if scan_cache:
+            stats.count('cache', 'pruned', scan_cache.prune(roots))
+        stats.set('memory', 'peak rss after scan (KB)', peak_rss())
+        on_progress('scan', stats)
+        if not memory_limit:
+            # ExtSortFactory has all digests after the scan
+            with stats.timer('digest'):
+                for item in factory.ordered_values():
+                    item.digest
+            on_progress('digest', stats)
+    finally:
+        if scan_cache:
+            scan_cache.close()
+            # file lists of Nodes and refreshes in watch mode read the disk
+            factory.walker = walker.walker
+    return Index(factory, trees, tree_class, filters, stats)
+
+
+def group(index, min_size=0, on_progress=None):
+    """
+    Return DuplicateSets of all directories of index (may still contain
+    nested duplicates), in scan order.
+    """
+    factory = index.factory
+    with index.stats.timer('group'):
+        if hasattr(factory, 'group_duplicates'):
+            # ExtSortFactory, its temporary files are not needed any more
+            try:
+                duplicates = factory.group_duplicates(min_size)
+            finally:
+                factory.close()
+        else:
+            duplicates = group_duplicates(factory.ordered_values(), min_size)
+    index.stats.set('memory', 'peak rss after grouping (KB)', peak_rss())
+    if on_progress is not None:
+        on_progress('group', index.stats)
+    return duplicates
+
+
+def scan(roots, min_size=0, nested_duplicates=False, **options):
+    """
+    Yield DuplicateSets of duplicate directories below roots, sets that
+    are nested in other sets only with nested_duplicates. Sets where all
+    copies are hardlinks of each other (HardlinkedSets) come last.
+
+    options are those of build_index().
+    """
+    index = build_index(roots, **options)
+    duplicates = group(index, min_size, options.get('on_progress'))
+    if not nested_duplicates:
+        duplicates = eliminate_nested(duplicates)
+    hardlinked = []
+    for ds in split_hardlinked(duplicates, hardlinked):
+        yield ds
+    for hs in hardlinked:
+        yield hs
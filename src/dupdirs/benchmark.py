@@ -0,0 +1,243 @@
+"""
+Benchmark for dupdirs.
+======================
+
+Generates a synthetic directory tree in a temporary directory (or uses an
+existing one) and times all phases of a run:
+
+- scan: build all DirTrees
+- digest: calculate all digests (part of scan with --compact)
+- group: group directories by digest
+- nested: eliminate nested duplicates
+- filecmp, dircmp: verify all duplicate sets
+
+Wall time, peak memory (peak RSS of the process at the end of the phase)
+and the counters of all phases (mostly syscalls) are written to a JSON file,
+--baseline compares the times against an earlier result, e.g. of a run
+without --progress to see what the progress line costs.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+
+import cli.app
+
+from dirtree import DIGEST_MODES, Factory, MerkleDirTree, scan
+from duplicate_set import eliminate_nested, group_duplicates
+from hashing import DEFAULT_HASH, HASHES
+from nodetable import NodeTable
+from progress import Progress
+from stats import Stats, peak_rss
+from structure import StructureVerifier
+from verify import DEFAULT_READER, READERS, ContentVerifier
+from walker import DEFAULT_WALKER, WALKERS, make_walker
+
+
+def generate_tree(root, depth=3, fanout=4, files=5, file_size=1024,
+                  duplicate_ratio=0.2, nesting=1, seed=0):
+    """
+    Create a synthetic tree in root (must not exist).
+
+    Each directory has files files of random size (0 - 2*file_size) and
+    fanout subdirectories down to depth levels. A subdirectory is a copy of
+    another directory of the same level with probability duplicate_ratio.
+    nesting top level directories are copied into a random leaf directory
+    to get nested duplicates.
+
+    Return (number of directories, number of files).
+    """
+    rng = random.Random(seed)
+    by_level = [[] for _level in range(depth + 1)]
+
+    def make(path, level):
+        os.mkdir(path)
+        for idx in range(files):
+            size = rng.randint(0, 2 * file_size)
+            block = hashlib.md5(repr(rng.random()).encode('ascii')).digest()
+            with open(os.path.join(path, 'file%d' % idx), 'wb') as f:
+                f.write((block * (size // len(block) + 1))[:size])
+        if level < depth:
+            for idx in range(fanout):
+                child = os.path.join(path, 'dir%d' % idx)
+                candidates = by_level[level + 1]
+                if candidates and rng.random() < duplicate_ratio:
+                    shutil.copytree(rng.choice(candidates), child)
+                else:
+                    make(child, level + 1)
+        by_level[level].append(path)
+
+    make(root, 0)
+    for idx in range(nesting):
+        if not by_level[1]:
+            break
+        source = rng.choice(by_level[1])
+        leaves = [leaf for leaf in by_level[depth]
+                  if not leaf.startswith(os.path.join(source, ''))]
+        if leaves:
+            shutil.copytree(source, os.path.join(rng.choice(leaves), 'nested%d' % idx))
+
+    num_dirs = num_files = 0
+    for _path, _dirs, filenames in os.walk(root):
+        num_dirs += 1
+        num_files += len(filenames)
+    return num_dirs, num_files
+
+
+class Benchmark(cli.app.CommandLineApp):
+
+    def main(self):
+        tree = self.params.tree
+        tmp_dir = None
+        if not tree:
+            tmp_dir = tempfile.mkdtemp(prefix='dupdirs-benchmark-')
+            tree = os.path.join(tmp_dir, 'tree')
+            print('generating tree in', tree)
+            num_dirs, num_files = generate_tree(
+                tree, self.params.depth, self.params.fanout, self.params.files,
+                self.params.file_size, self.params.duplicates, self.params.nesting,
+                self.params.seed)
+            print('directories: %s, files: %s' % (num_dirs, num_files))
+        try:
+            runs = [self.run_phases(tree) for _run in range(self.params.repeat)]
+        finally:
+            if tmp_dir and not self.params.keep:
+                shutil.rmtree(tmp_dir)
+
+        # best time of all runs for each phase, memory and counters of the first run
+        result = runs[0]
+        for phase, values in result['phases'].items():
+            values['time'] = min(run['phases'][phase]['time'] for run in runs)
+        self.report(result)
+        if self.params.output:
+            with open(self.params.output, 'w') as f:
+                json.dump(result, f, indent=2, sort_keys=True)
+        return 0
+
+    def run_phases(self, tree):
+        """Run all phases once, return result dict."""
+        stats = Stats()
+        progress = None
+        if self.params.progress:
+            progress = Progress(stats, interval=self.params.progress).start()
+        try:
+            return self._run_phases(tree, stats)
+        finally:
+            if progress is not None:
+                progress.stop()
+
+    def _run_phases(self, tree, stats):
+        params = self.params
+        phases = {}
+
+        def timed(phase, func, *args):
+            with stats.timer(phase):
+                res = func(*args)
+            phases[phase] = {'time': stats.timers[phase], 'peak_rss_kb': peak_rss()}
+            return res
+
+        walker = make_walker(params.walker, stats)
+        if params.compact:
+            factory = NodeTable(walker)
+            tree_class = MerkleDirTree
+        else:
+            factory = Factory(walker)
+            tree_class = DIGEST_MODES[params.digest_mode]
+        factory.hash_name = params.hash
+        timed('scan', scan, [tree], factory, tree_class, False, True, params.jobs)
+        timed('digest', lambda: [item.digest for item in factory.ordered_values()])
+        duplicates = timed('group', group_duplicates, factory.ordered_values())
+        duplicates = timed('nested', lambda: list(eliminate_nested(duplicates)))
+
+        def verify():
+            verifier = ContentVerifier(params.jobs, stats, hash_name=params.hash, reader=params.reader)
+            for ds in duplicates:
+                ds.filecmp(verifier)
+            verifier.close()
+        timed('filecmp', verify)
+
+        def dircmp():
+            structure = StructureVerifier(params.jobs, stats, factory=factory)
+            for _ds in structure.map(duplicates):
+                pass
+            structure.close()
+        timed('dircmp', dircmp)
+
+        return {
+            'params': dict((name, getattr(params, name)) for name in (
+                'tree', 'depth', 'fanout', 'files', 'file_size', 'duplicates', 'nesting',
+                'seed', 'jobs', 'walker', 'digest_mode', 'compact', 'hash', 'progress', 'reader')),
+            'python': platform.python_version(),
+            'phase_order': stats.timer_order,
+            'phases': phases,
+            'duplicate_sets': len(duplicates),
+            'counters': dict((phase, dict(counters)) for phase, counters in stats.counters.items()),
+        }
+
+    def report(self, result):
+        baseline = None
+        if self.params.baseline:
+            with open(self.params.baseline) as f:
+                baseline = json.load(f)
+        print('duplicate sets:', result['duplicate_sets'])
+        for phase in result['phase_order']:
+            values = result['phases'][phase]
+            line = '%-8s %10.3fs %10s KB' % (phase, values['time'], values['peak_rss_kb'])
+            if baseline and phase in baseline['phases']:
+                before = baseline['phases'][phase]['time']
+                if before:
+                    line += '   %5.2fx baseline' % (values['time'] / before)
+            print(line)
+        for phase in sorted(result['counters']):
+            for name, value in sorted(result['counters'][phase].items()):
+                print('%s.%s: %s' % (phase, name, value))
+
+    def setup(self):
+        """Define commandline parameters and messages."""
+        super(Benchmark, self).setup()
+
+        self.add_param("--baseline", help="JSON result of an earlier run to compare with",
+                       action="store")
+        self.add_param("--compact", help="use NodeTable", default=False, action="store_true")
+        self.add_param("--depth", help="levels of the generated tree (default 3)",
+                       type=int, default=3, action="store")
+        self.add_param("--digest-mode", choices=sorted(DIGEST_MODES), default='flat',
+                       action="store")
+        self.add_param("--duplicates", help="ratio of duplicated directories (default 0.2)",
+                       type=float, default=0.2, action="store")
+        self.add_param("--fanout", help="subdirectories per directory (default 4)",
+                       type=int, default=4, action="store")
+        self.add_param("--file-size", help="average file size (default 1024)",
+                       type=int, default=1024, action="store")
+        self.add_param("--files", help="files per directory (default 5)",
+                       type=int, default=5, action="store")
+        self.add_param("--hash", choices=list(HASHES), default=DEFAULT_HASH, action="store")
+        self.add_param("-j", "--jobs", help="number of threads (default 1)",
+                       type=int, default=1, action="store")
+        self.add_param("--keep", help="don't delete the generated tree",
+                       default=False, action="store_true")
+        self.add_param("--nesting", help="top level directories copied deeper into the tree (default 1)",
+                       type=int, default=1, action="store")
+        self.add_param("-o", "--output", help="write results to this JSON file", action="store")
+        self.add_param("--progress", help="render the progress line every n seconds during the runs",
+                       type=float, default=0, action="store")
+        self.add_param("--reader", choices=READERS, default=DEFAULT_READER, action="store")
+        self.add_param("--repeat", help="number of runs, the best time is reported (default 1)",
+                       type=int, default=1, action="store")
+        self.add_param("--seed", help="random seed (default 0)", type=int, default=0, action="store")
+        self.add_param("--tree", help="use this tree instead of generating one", action="store")
+        self.add_param("-w", "--walker", choices=sorted(WALKERS), default=DEFAULT_WALKER,
+                       action="store")
+
+
+def main():
+    Benchmark().run()
+
+if __name__ == '__main__':
+    main()
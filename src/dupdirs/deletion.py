@@ -0,0 +1,209 @@
+"""
+Deletion engine for interactive mode (--input).
+
+Sets are checked and processed (ShallowDuplicateSet.process) by a pool of
+worker threads, at most a few sets per worker are in flight, so memory
+does not grow with the size of the input. Output of each set is printed
+in input order once it is done. Sets with overlapping folders (one inside
+the other, e.g. nested sets) never run at the same time: a set waits for
+all earlier sets it overlaps with, so every set sees the folders it keeps
+as the earlier sets left them, like in a serial run.
+
+With a journal every deleted folder and every processed set is appended
+to a file. When an interrupted commit is started again with the same
+journal, finished sets are skipped, folders deleted before the
+interruption don't make their set fail the "all folders exist" check.
+A set counts as finished only with the same digest, folders and commands
+(see set_key), a set that was changed in the input is processed again.
+"""
+
+from __future__ import print_function
+
+from collections import deque
+from timeit import default_timer
+import binascii
+import hashlib
+import json
+import os
+import threading
+
+from duplicate_set import is_inside
+from hashing import DEFAULT_HASH
+from stats import Stats
+from verify import DEFAULT_READER, ContentVerifier
+
+#: sets in flight per worker
+QUEUE_FACTOR = 4
+#: status of a set after DeletionEngine._process
+SKIPPED = 'skipped'
+IGNORED = 'ignored'
+FAILED = 'failed'
+PROCESSED = 'processed'
+
+
+def _overlap(ds, other):
+    """Return True if a folder of set ds is inside a folder of set other or the other way round."""
+    return any(is_inside(a, b) or is_inside(b, a)
+               for _cmd, a in ds.items for _other_cmd, b in other.items)
+
+
+def _hex(path):
+    if not isinstance(path, bytes):
+        path = os.fsencode(path)
+    return binascii.hexlify(path).decode('ascii')
+
+
+def set_key(ds):
+    """Return the journal key of set ds: its digest and all (command, folder) items."""
+    m = hashlib.sha1()
+    for cmd, path in sorted(ds.items):
+        m.update(('%s %s\n' % (cmd, _hex(path))).encode('ascii'))
+    return '%s %s' % (ds.digest, m.hexdigest())
+
+
+class Journal(object):
+    """Append-only log of deleted folders and finished sets (JSON lines)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._done = set()
+        self._deleted = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line of an interrupted write
+                        continue
+                    if 'done' in entry:
+                        self._done.add(entry['done'])
+                    elif 'deleted' in entry:
+                        self._deleted.add(entry['deleted'])
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def _write(self, entry):
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    def is_done(self, key):
+        """Return True if the set with key (see set_key) was done."""
+        return key in self._done
+
+    def was_deleted(self, path):
+        return _hex(path) in self._deleted
+
+    def deleted(self, path):
+        self._deleted.add(_hex(path))
+        self._write({'deleted': _hex(path)})
+
+    def done(self, key):
+        self._done.add(key)
+        self._write({'done': key})
+
+    def close(self):
+        self._file.close()
+
+
+class DeletionEngine(object):
+    """
+    Process ShallowDuplicateSets with jobs threads, counts in stats
+    (phase 'delete').
+    """
+
+    def __init__(self, commit=False, jobs=1, journal=None, stats=None, hash_name=DEFAULT_HASH,
+                 reader=DEFAULT_READER):
+        if stats is None:
+            stats = Stats()
+        self.commit = commit
+        self.journal = journal
+        self.stats = stats
+        #: for hardlink and reflink commands, shared for its cache
+        self.verifier = ContentVerifier(stats=stats, hash_name=hash_name, reader=reader)
+        self.pool = None
+        if jobs > 1:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(jobs)
+        self.max_pending = jobs * QUEUE_FACTOR
+        self._pending = deque()
+        self._start = default_timer()
+
+    def _process(self, ds):
+        """
+        Process one set, return (set, status, list of (command, folder)
+        done), status is one of SKIPPED, IGNORED, FAILED and PROCESSED.
+        Only processed sets are marked as done in the journal, the next
+        run tries all others again.
+        """
+        if self.journal is not None and self.journal.is_done(set_key(ds)):
+            ds.log.append('already processed (journal): [%s]' % ds.digest)
+            return ds, SKIPPED, []
+        try:
+            done = ds.process(self.commit, self.journal, self.verifier)
+        except (IOError, OSError) as e:
+            ds.log.append('-->error: %s' % e)
+            self.stats.count('delete', 'errors')
+            return ds, FAILED, []
+        if done is None:
+            return ds, IGNORED, []
+        if self.commit and self.journal is not None:
+            self.journal.done(set_key(ds))
+        return ds, PROCESSED, done
+
+    def _finish(self, result):
+        ds, status, done = result
+        print('\n'.join(ds.log))
+        count = self.stats.count
+        if status == SKIPPED:
+            count('delete', 'sets skipped (journal)')
+            return
+        if status == IGNORED:
+            count('delete', 'sets ignored')
+            return
+        if status == FAILED:
+            return
+        count('delete', 'sets')
+        kind = 'files' if ds.kind == 'file' else 'folders'
+        for cmd, _folder in done:
+            count('delete', '%s deleted' % kind if cmd == 'delete' else '%s %sed' % (kind, cmd))
+            count('delete', 'bytes freed', ds.size_bytes)
+
+    def submit(self, ds):
+        """Process ds, print output of all sets that are done in input order."""
+        if self.pool is None:
+            self._finish(self._process(ds))
+            return
+        # finish everything up to the last set in flight that overlaps with ds
+        overlapping = [idx for idx, (other, _result) in enumerate(self._pending) if _overlap(ds, other)]
+        if overlapping:
+            self.stats.count('delete', 'sets waiting for an overlapping set')
+            for _idx in range(overlapping[-1] + 1):
+                self._finish(self._pending.popleft()[1].get())
+        self._pending.append((ds, self.pool.apply_async(self._process, (ds,))))
+        while self._pending and (len(self._pending) >= self.max_pending or
+                                 self._pending[0][1].ready()):
+            self._finish(self._pending.popleft()[1].get())
+
+    def close(self):
+        """Wait for all sets, return a summary line."""
+        while self._pending:
+            self._finish(self._pending.popleft()[1].get())
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.journal is not None:
+            self.journal.close()
+        self.verifier.close()
+        elapsed = max(default_timer() - self._start, 1e-6)
+        get = self.stats.get
+        return ('%s sets, %s ignored, %s folders deleted, %s files deleted, %s hardlinked, %s reflinked, '
+                '%s bytes freed in %.1fs (%.1f sets/s, %.1f MB/s)') % (
+            get('delete', 'sets'), get('delete', 'sets ignored'),
+            get('delete', 'folders deleted'), get('delete', 'files deleted'),
+            get('delete', 'folders hardlinked') + get('delete', 'files hardlinked'),
+            get('delete', 'folders reflinked') + get('delete', 'files reflinked'),
+            get('delete', 'bytes freed'), elapsed, get('delete', 'sets') / elapsed,
+            get('delete', 'bytes freed') / elapsed / 1e6)
@@ -1,75 +1,239 @@
 
 from __future__ import print_function
 
-import hashlib
 import os
-import sys
+import threading
+
+from hashing import DEFAULT_HASH, hexdigest, new as new_hash
+from walker import FILE, SYMLINK, make_walker
+
+#: levels of a tree that are read in the calling thread in parallel scans,
+#: the subtrees below are built by the worker threads
+SPLIT_DEPTH = 2
+#: inode sums are kept below this, so they fit into a signed 64 bit int
+INODE_SUM_MASK = (1 << 62) - 1
+
+
+class SymlinkError(Exception):
+    """Raised when a symlink is found and symlink_warning is not set."""
 
 
 class DirTree(object):
     """
     Representation of a directory.
+
+    With split_depth > 0 the directory is only read, subtrees on level
+    split_depth are built in factory.pool and the results are added
+    later by resolve().
+
+    dev is the device of the directory (for factory.one_file_system), mtime
+its modification time when it was read (see Factory.scanned_names).
+    inode_sum is a sum of the hashes of (device, inode) of all files, copies
+    that are hardlinks of each other have the same inode_sum.
     """
-    def __init__(self, path, factory, use_mtime, symlink_warning):
+    def __init__(self, path, factory, use_mtime, symlink_warning, split_depth=0, dev=None,
+                 mtime=None):
         self.path = path
+        self.dev = dev
+        self.mtime = mtime
         self.factory = factory
         self.use_mtime = use_mtime
         self.symlink_warning = symlink_warning
         self.factory.register(self)
         # list of child nodes
         self.children = []
+        self.num_files = 0
+        self.size = 0
+        self._init_contents()
+        self._create(split_depth)
+
+    def _init_contents(self):
         #: list of all files in this node and all children, enhanced with size
         # and an optional modified date
         self.contents = []
         self.files = []
-        self.num_files = 0
-        self.size = 0
-        self._create()
 
-    def _create(self):
+    def _create(self, split_depth=0):
         """
         load all files and subfolders, create all
         DirTrees from subfolders
         """
-        # sort entries so self.contents is always sorted
-        for name in sorted(os.listdir(self.path)):
-            fp = os.path.join(self.path, name)
-            if os.path.islink(fp):
-                print("WARNING, symbolic links not supported, anything might happen")
-                print("symlink found:", fp)
+        args = (self.factory, self.use_mtime, self.symlink_warning)
+        #: names of the symlinks, files and subfolders that were read
+        #: (completed by resolve), see Factory.scanned_names
+        self.names = []
+        #: files and subfolders in the order of the entries
+        self._pending = []
+        num_files = num_bytes = num_symlinks = 0
+        # entries are sorted so self.contents is always sorted
+        for entry in self.factory.walker.entries(self.path):
+            fp = os.path.join(self.path, entry.name)
+            if entry.kind == SYMLINK:
+                self.factory.warn("WARNING, symbolic links not supported, anything might happen\n"
+                                  "symlink found: %s" % fp)
                 if not self.symlink_warning:
-                    # exit on symlink
-                    sys.exit(1)
-            elif os.path.isfile(fp):
-                stat = os.stat(fp)
-                self.files.append(name)
-                if self.use_mtime:
-                    self.contents.append('%s (%s@%s)' % (name, stat.st_size, stat.st_mtime))
-                else:
-                    self.contents.append('%s (%s)' % (name, stat.st_size))
-                self.num_files += 1
-                self.size += stat.st_size
+                    raise SymlinkError(fp)
+                self.names.append(entry.name)
+                num_symlinks += 1
+            elif entry.kind == FILE:
+                self._pending.append((entry, None))
+                num_files += 1
+                num_bytes += entry.size
+            elif not self._enter(entry, fp):
+                continue
+            elif split_depth == 1:
+                # directory, built by a worker
+                result = self.factory.pool.apply_async(self.__class__, (fp,) + args,
+                                                       {'dev': entry.dev, 'mtime': entry.mtime})
+                self._pending.append((entry, result))
             else:
                 # directory
-                dt = DirTree(fp, self.factory, self.use_mtime, self.symlink_warning)
-                self.num_files += dt.num_files
-                self.size += dt.size
-                for entry in dt.contents:
-                    self.contents.append(os.path.join(name, entry))
-                for f in dt.files:
-                    self.files.append(os.path.join(name, f))
+                try:
+                    dt = self.__class__(fp, *args, split_depth=max(split_depth - 1, 0),
+                                        dev=entry.dev, mtime=entry.mtime)
+                except (IOError, OSError) as e:
+                    if not self._unreadable(fp, e):
+                        raise
+                    continue
+                self._pending.append((entry, dt))
+        # count once per directory, counting is locked
+        count = self.factory.walker.stats.count
+        count('scan', 'directories')
+        count('scan', 'files', num_files)
+        count('scan', 'bytes', num_bytes)
+        if num_symlinks:
+            count('scan', 'symlinks skipped', num_symlinks)
+        if not split_depth:
+            self.resolve()
 
+    def refresh(self):
+        """
+        Read the directory again after a change (watch mode). DirTrees of
+        subdirectories that are still there are kept as they are, new
+        subdirectories are built. Nothing changes if reading fails.
+        """
+        children = dict((os.path.basename(child.path), child) for child in self.children)
+        args = (self.factory, self.use_mtime, self.symlink_warning)
+        pending = []
+        symlinks = []
+        for entry in self.factory.walker.entries(self.path):
+            fp = os.path.join(self.path, entry.name)
+            if entry.kind == SYMLINK:
+                if not self.symlink_warning:
+                    raise SymlinkError(fp)
+                symlinks.append(entry.name)
+            elif entry.kind == FILE:
+                pending.append((entry, None))
+            elif entry.name in children:
+                pending.append((entry, children[entry.name]))
+            elif self._enter(entry, fp):
+                pending.append((entry, self.__class__(fp, *args, dev=entry.dev, mtime=entry.mtime)))
+        self.children = []
+        self.num_files = 0
+        self.size = 0
+        self._init_contents()
+        self.__dict__.pop('_digest', None)
+        self.names = symlinks
+        # unknown after the change, dircmp lists the directory again
+        self.mtime = None
+        self._pending = pending
+        self.resolve()
+
+    def _enter(self, entry, fp):
+        """Return True if subdirectory entry (path fp) should be read."""
+        count = self.factory.walker.stats.count
+        if self.factory.one_file_system and self.dev is not None and entry.dev != self.dev:
+            count('scan', 'directories skipped (other device)')
+            return False
+        if not self.factory.dirs.visit(entry.dev, entry.ino, fp):
+            # bind mount or hardlinked directory
+            self.factory.warn("WARNING, directory already read under another path, skipped: %s" % fp)
+            count('scan', 'directories skipped (seen)')
+            return False
+        return True
+
+    def _unreadable(self, fp, error):
+        """
+        Pass error of subdirectory fp to factory.on_error, return False if
+        there is none (the caller raises). Errors below fp were already
+        handled by fp itself.
+        """
+        on_error = self.factory.on_error
+        if on_error is None:
+            return False
+        self.factory.walker.stats.count('scan', 'directories unreadable')
+        on_error(fp, error)
+        return True
+
+    def resolve(self):
+        """Add all files and subfolders read by _create (once)."""
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        inode_sum = 0
+        file_index = self.factory.file_index
+        for entry, dt in pending:
+            if entry.kind == FILE:
+                self._add_file(entry)
+                if entry.ino:
+                    inode_sum += hash((entry.dev, entry.ino))
+                if file_index is not None:
+                    file_index.add(os.path.join(self.path, entry.name), entry)
+                self.names.append(entry.name)
+                continue
+            if isinstance(dt, DirTree):
+                dt.resolve()
+            else:
+                try:
+                    dt = dt.get()
+                except (IOError, OSError) as e:
+                    if not self._unreadable(os.path.join(self.path, entry.name), e):
+                        raise
+                    continue
+            self._add_child(entry.name, dt)
+            self.names.append(entry.name)
+            inode_sum += dt.inode_sum
+        self.inode_sum = inode_sum & INODE_SUM_MASK
+        minhash = self.factory.minhash
+        if minhash is not None:
+            self.signature = minhash.signature(
+                [(entry.name, entry.size) for entry, _dt in pending if entry.kind == FILE],
+                [child.signature for child in self.children])
+        self.factory.finalize(self)
+
+    def _describe(self, entry):
+        """Return the contents entry of a file."""
+        if self.use_mtime:
+            return '%s (%s@%s)' % (entry.name, entry.size, entry.mtime)
+        else:
+            return '%s (%s)' % (entry.name, entry.size)
+
+    def _add_file(self, entry):
+        self.files.append(entry.name)
+        self.contents.append(self._describe(entry))
+        self.num_files += 1
+        self.size += entry.size
+
+    def _add_child(self, name, dt):
+        self.children.append(dt)
+        self.num_files += dt.num_files
+        self.size += dt.size
+        for item in dt.contents:
+            self.contents.append(os.path.join(name, item))
+        for f in dt.files:
+            self.files.append(os.path.join(name, f))
 
     @property
     def digest(self):
-        """Return or calculate md5 digest of the contents"""
+        """Return or calculate digest of the contents"""
         try:
             return self._digest
         except AttributeError:
-            m = hashlib.md5()
-            for item in self.contents:
-                m.update(item)
-            d = m.hexdigest()
+            hash_name = self.factory.hash_name
+            m = new_hash(hash_name)
+            # one update per directory, the result is the same as one per item
+            m.update(''.join(self.contents))
+            d = hexdigest(hash_name, m)
             self._digest = d
             return d
 
@@ -77,16 +241,288 @@ class DirTree(object):
         return 'size: %s\t files: %s \t%s' % (self.size, self.num_files, self.path)
 
 
+class MerkleDirTree(DirTree):
+    """
+    DirTree that only stores its own files and its children.
+
+    The digest is calculated from the own files and the digests, sizes and
+    number of files of all children, so memory per directory does not grow
+    with the depth of the tree. Children without files are ignored, just like
+    in the flat contents of DirTree.
+
+    contents and files are rebuilt on each access, so only use them for
+    the few directories that are actually compared.
+    """
+
+    def _init_contents(self):
+        #: (name, contents entry) of files directly in this directory
+        self.own_files = []
+
+    def _add_file(self, entry):
+        self.own_files.append((entry.name, self._describe(entry)))
+        self.num_files += 1
+        self.size += entry.size
+
+    def _add_child(self, name, dt):
+        self.children.append(dt)
+        self.num_files += dt.num_files
+        self.size += dt.size
+
+    def _items(self):
+        """Return (name, contents entry or child) for all entries, sorted by name."""
+        items = list(self.own_files)
+        items.extend((os.path.basename(child.path), child) for child in self.children)
+        items.sort(key=lambda item: item[0])
+        return items
+
+    def release(self):
+        """Drop own files, children and names, only digest and counts are kept."""
+        self.digest
+        self.own_files = []
+        self.children = []
+        self.names = None
+
+    def _iter_files(self):
+        """Yield (relative path, contents entry) of all files in contents order."""
+        for name, item in self._items():
+            if isinstance(item, DirTree):
+                for path, description in item._iter_files():
+                    yield os.path.join(name, path), os.path.join(name, description)
+            else:
+                yield name, item
+
+    @property
+    def contents(self):
+        return [description for _path, description in self._iter_files()]
+
+    @property
+    def files(self):
+        return [path for path, _description in self._iter_files()]
+
+    @property
+    def digest(self):
+        """Return or calculate digest of own files and child digests."""
+        try:
+            return self._digest
+        except AttributeError:
+            parts = []
+            for name, item in self._items():
+                if isinstance(item, DirTree):
+                    if item.num_files:
+                        parts.append('%s/[%s %s %s]' % (name, item.digest, item.size, item.num_files))
+                else:
+                    parts.append(item)
+            hash_name = self.factory.hash_name
+            m = new_hash(hash_name)
+            m.update(''.join(parts))
+            d = hexdigest(hash_name, m)
+            self._digest = d
+            return d
+
+
+#: DirTree classes by digest mode
+DIGEST_MODES = {
+    'flat': DirTree,
+    'merkle': MerkleDirTree,
+}
+
+
+class DirIndex(object):
+    """
+    (device, inode) of all directories that were read, so a directory that
+    shows up under another path (bind mount, hardlinked directory) is only
+    read once. May be called from several threads. In parallel scans the
+    path that is visited first may not be the one a serial scan reads, the
+    other paths are recorded so ordered() can tell.
+    """
+
+    def __init__(self):
+        self._paths = {}
+        # (dev, ino) -> paths skipped because of _paths[dev, ino]
+        self._skipped = {}
+        self._lock = threading.Lock()
+
+    def visit(self, dev, ino, path):
+        """Return False if the directory was already visited under another path."""
+        if not ino:
+            # no inodes on this platform
+            return True
+        with self._lock:
+            seen = self._paths.setdefault((dev, ino), path)
+            # the same path may be read twice (nested roots)
+            if seen == path:
+                return True
+            self._skipped.setdefault((dev, ino), []).append(path)
+            return False
+
+    def read_under(self, dev, ino, path):
+        """Return False if the directory was read under another path than path."""
+        if not ino:
+            return True
+        with self._lock:
+            return self._paths.get((dev, ino), path) == path
+
+    def ordered(self, roots):
+        """
+        Return True if every directory seen under several paths was read
+        under the path that comes first in a serial scan of roots. Then the
+        scan read the same directories as a serial scan.
+        """
+        from extsort import order_key
+        with self._lock:
+            return all(order_key(self._paths[key], roots) < min(order_key(path, roots) for path in paths)
+                       for key, paths in self._skipped.items())
+
 
 class Factory(dict):
     """
     Factory stores all DirTrees by path for easy access, keeps order of keys.
+
+    The walker used to read directories (and the pool for parallel scans)
+    is shared by all DirTrees. register() may be called from several threads.
+    With a minhash (see similarity.MinHash) all DirTrees get a signature.
+    With one_file_system, directories on other devices are not read.
+    Digests are calculated with the backend hash_name (see hashing).
+    With a file_index (see filedups.FileIndex) all files are added to it.
+    Warnings of the scan go to warn(message), they are printed by default.
+    A subdirectory that can't be read stops the scan, unless on_error is
+    set: then on_error(path, exception) is called and the directory is
+    left out (its parents are compared without it).
     """
 
-    def __init__(self):
+    def __init__(self, walker=None, minhash=None):
+        self.ordered_keys = []
+        if walker is None:
+            walker = make_walker()
+        self.walker = walker
+        self.minhash = minhash
+        self.one_file_system = False
+        self.hash_name = DEFAULT_HASH
+        self.file_index = None
+        self.warn = print
+        self.on_error = None
+        self.dirs = DirIndex()
+        self.pool = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forget all DirTrees (and visited directories and files) to scan again."""
+        self.clear()
         self.ordered_keys = []
+        self.dirs = type(self.dirs)()
+        if self.file_index is not None:
+            self.file_index = type(self.file_index)()
 
     def register(self, item):
-        self.ordered_keys.append(item.path)
-        self[item.path] = item
+        with self._lock:
+            self.ordered_keys.append(item.path)
+            self[item.path] = item
+
+    def finalize(self, item):
+        """Called when item and all its children are complete."""
+
+    def scanned_names(self, path):
+        """
+        Return (mtime, names of the entries) of directory path when the
+        scan read it, None if it was not read.
+        """
+        tree = self.get(path)
+        if tree is None or tree.names is None:
+            return None
+        return tree.mtime, tree.names
+
+    def ordered_values(self):
+        """Yield all DirTrees in the order of ordered_keys (each path once)."""
+        seen = set()
+        for key in self.ordered_keys:
+            if key not in seen:
+                seen.add(key)
+                yield self[key]
+
+    def reorder(self, trees):
+        """
+        Register all nodes of trees again in the order of a serial scan,
+        so order of keys and values does not depend on the order in which
+        parallel workers finished.
+        """
+        self.clear()
+        self.ordered_keys = []
+        for tree in trees:
+            stack = [tree]
+            while stack:
+                item = stack.pop()
+                self.ordered_keys.append(item.path)
+                self[item.path] = item
+                stack.extend(reversed(item.children))
+
+
+def list_files(path, factory, dev=None):
+    """
+    Return paths of all files below path (relative to path), like
+    DirTree.files of the scan with factory: read with its walker (and
+    filters), without the directories the scan skipped (other devices with
+    one_file_system, read under another path). dev is the device of path.
+    """
+    if dev is None:
+        dev = os.stat(path).st_dev
+    files = []
+    for entry in factory.walker.entries(path):
+        if entry.kind == FILE:
+            files.append(entry.name)
+        elif entry.kind != SYMLINK:
+            fp = os.path.join(path, entry.name)
+            if factory.one_file_system and entry.dev != dev:
+                continue
+            if not factory.dirs.read_under(entry.dev, entry.ino, fp):
+                continue
+            for f in list_files(fp, factory, entry.dev):
+                files.append(os.path.join(entry.name, f))
+    return files
+
 
+def _scan(roots, factory, tree_class, use_mtime, symlink_warning, split_depth):
+    trees = []
+    for root in roots:
+        st = os.stat(root)
+        factory.dirs.visit(st.st_dev, st.st_ino, root)
+        trees.append(tree_class(root, factory, use_mtime, symlink_warning,
+                                split_depth=split_depth, dev=st.st_dev, mtime=st.st_mtime))
+    for tree in trees:
+        tree.resolve()
+    return trees
+
+
+def scan(roots, factory, tree_class, use_mtime, symlink_warning, jobs=1):
+    """
+    Build trees for all roots, return the list of root nodes.
+
+    With jobs > 1 the top levels of all roots are read first, then the
+    subtrees below are built by a pool of jobs threads. If that read a
+    directory that was seen under several paths (bind mount, hardlinked
+    directory) under another path than a serial scan would, everything is
+    scanned again serially, the result does not depend on timing. The
+    warnings of the parallel scan are only passed on if it is kept.
+    """
+    if jobs <= 1:
+        trees = _scan(roots, factory, tree_class, use_mtime, symlink_warning, 0)
+        factory.reorder(trees)
+        return trees
+    from multiprocessing.pool import ThreadPool
+    factory.pool = ThreadPool(jobs)
+    warn, warnings = factory.warn, []
+    factory.warn = warnings.append
+    try:
+        trees = _scan(roots, factory, tree_class, use_mtime, symlink_warning, SPLIT_DEPTH)
+    finally:
+        factory.warn = warn
+        factory.pool.terminate()
+        factory.pool = None
+    if factory.dirs.ordered(roots):
+        for message in warnings:
+            warn(message)
+    else:
+        factory.walker.stats.count('scan', 'serial rescans')
+        factory.reset()
+        trees = _scan(roots, factory, tree_class, use_mtime, symlink_warning, 0)
+    factory.reorder(trees)
+    return trees
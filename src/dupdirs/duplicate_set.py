@@ -1,7 +1,80 @@
-import filecmp
 import os
 import re
-import shutil
+
+from hashing import DIGEST_PATTERN
+from linking import LINK_METHODS
+
+#: commands of a duplicate in interactive mode, all others mean keep
+ACTIONS = ('delete',) + LINK_METHODS
+
+def is_inside(path, folder):
+    """Return True if path is folder or inside folder (/a/foobar is not inside /a/foo)."""
+    path = os.path.normpath(path)
+    folder = os.path.normpath(folder)
+    return path == folder or path.startswith(os.path.join(folder, ''))
+
+
+def human_readable(number):
+    """Insert dots into numbers at every three digits."""
+    res = ''
+    for i,c in enumerate(reversed(str(number))):
+        if i and not i % 3:
+            res = '.' + res
+        res = c + res
+    return res
+
+
+def group_duplicates(dirs, min_size=0):
+    """
+    Group dirs by digest, return a list of DuplicateSets with more than one
+    item, ordered by the first item of each set.
+
+    Dirs smaller than min_size are dropped before grouping. Only one dir
+    per digest is kept until a second one shows up, so there is no
+    DuplicateSet for unique dirs.
+    """
+    first = {}
+    sets = {}
+    for idx, item in enumerate(dirs):
+        if item.size < min_size:
+            continue
+        digest = item.digest
+        if digest in sets:
+            sets[digest][1].add(item)
+        elif digest in first:
+            first_idx, first_item = first.pop(digest)
+            ds = DuplicateSet()
+            ds.add(first_item)
+            ds.add(item)
+            sets[digest] = (first_idx, ds)
+        else:
+            first[digest] = (idx, item)
+    return [ds for _idx, ds in sorted(sets.values(), key=lambda value: value[0])]
+
+
+def eliminate_nested(duplicates):
+    """
+    Yield all sets of duplicates that are not nested in another set,
+    order is kept.
+
+    A set is nested if the parent folders of all its items are items of one
+    single other set. Identical folders have identical subfolders, so
+    looking at the parent is enough, no need to look at all ancestors.
+    Runs in linear time. duplicates may be an iterator, it is read once.
+    """
+    duplicates = list(duplicates)
+    set_by_path = {}
+    for idx, ds in enumerate(duplicates):
+        for item in ds.items:
+            set_by_path[os.path.normpath(item.path)] = idx
+    for ds in duplicates:
+        parent_sets = set(set_by_path.get(os.path.dirname(os.path.normpath(item.path)))
+                          for item in ds.items)
+        if len(parent_sets) == 1 and None not in parent_sets:
+            # nested
+            continue
+        yield ds
+
 
 class DuplicateSet(object):
     """
@@ -14,6 +87,11 @@ class DuplicateSet(object):
     class NotReallyADuplicateError(Exception):
         """Raised if duplicates added to a set are not duplicates"""
 
+    #: name of the set in the output
+    label = 'duplicate set'
+    #: command for all items in the output
+    command = 'delete'
+
     def __init__(self):
         self.items = []
         self.size = None
@@ -37,27 +115,36 @@ class DuplicateSet(object):
         Output a duplicate set in human readable format that can also
         be processed when using -i.
         """
-        def human_readable(number):
-            """Insert dots into numbers at every three digits."""
-            res = ''
-            for i,c in enumerate(reversed(str(number))):
-                if i and not i % 3:
-                    res = '.' + res
-                res = c + res
-            return res
         if self.num_files:
             digest = self.items[0].digest
         else:
             digest = 'empty folders'
 
-        s = ['', '#duplicate set [%s] %s duplicates %s bytes %s files' % (digest, len(self.items), human_readable(self.size), self.num_files)]
+        s = ['', '#%s [%s] %s duplicates %s bytes %s files' % (self.label, digest, len(self.items), human_readable(self.size), self.num_files)]
 
         for d in self.items:
-            s.append('[delete]("%s")' % d.path)
+            s.append('[%s]("%s")' % (self.command, d.path))
         s.extend(self.messages)
-        s.append('#/duplicate set [%s]' % digest)
+        s.append('#/%s [%s]' % (self.label, digest))
         return '\n'.join(s)
 
+    def as_record(self):
+        """Return the set as a dict for the jsonl format (see resultformat)."""
+        return {
+            'type': self.label,
+            'digest': self.items[0].digest if self.num_files else 'empty folders',
+            'num_duplicates': len(self.items),
+            'size': self.size,
+            'num_files': self.num_files,
+            'items': [{'cmd': self.command, 'path': d.path} for d in self.items],
+            'messages': list(self.messages),
+        }
+
+    @property
+    def hardlinked(self):
+        """True if all items are hardlinks of the same files, nothing to reclaim."""
+        return bool(self.num_files) and len(set(d.inode_sum for d in self.items)) == 1
+
     def contains(self, other):
         """
         Return True if this DuplicateSet contains the other set, e.g. if all
@@ -71,26 +158,33 @@ class DuplicateSet(object):
             return False
         for other_item in other.items:
             for item in self.items:
-                if item.path.startswith(other_item.path):
+                if is_inside(other_item.path, item.path):
                     # match found
                     break
             else:
                 return False
         return True
 
-    def dircmp(self):
-        """Use dircmp to detect funny files in the duplicate sets"""
+    def dircmp(self, verifier=None):
+        """
+        Use a StructureVerifier to compare names, types and sizes of all
+        entries of all items and to detect funny files, recursively.
+
+        Return True if identical, False otherwise
+        """
         if len(self.items) < 2:
             self.messages.append('-->only one item in this duplicate set, nothing to compare')
-        else:
-            for idx in range(len(self.items)-1):
-                dc = filecmp.dircmp(self.items[idx].path, self.items[idx+1].path)
-                if dc.funny_files:
-                    self.messages.append('-->funny files: %s' % dc.funny_files)
+            return False
+        if verifier is None:
+            from structure import StructureVerifier
+            verifier = StructureVerifier()
+        messages = verifier.check(self.items)
+        self.messages.extend(messages)
+        return not messages
 
-    def filecmp(self):
+    def filecmp(self, verifier=None):
         """
-        Use filecmp to realy check for identity of duplicate sets.
+        Use a ContentVerifier to realy check for identity of duplicate sets.
 
         Return True if identical, False otherwise
         """
@@ -98,50 +192,112 @@ class DuplicateSet(object):
             self.messages.append('-->only one item in this duplicate set, nothing to compare')
             return False
         else:
-            all_good = True
-            for item_idx in range(len(self.items)-1):
-                for file_idx in range(len(self.items[item_idx].files)):
-                    left = self.items[item_idx]
-                    right = self.items[item_idx+1]
-                    a = os.path.join(left.path, left.files[file_idx])
-                    b = os.path.join(right.path, right.files[file_idx])
-
-                    if not filecmp.cmp(a, b, shallow=False):
-                        self.messages.append('-->file mismatch: %s %s' % (a, b))
-                        all_good = False
-            if all_good:
+            if verifier is None:
+                from verify import ContentVerifier
+                verifier = ContentVerifier()
+            # files may be rebuilt on each access, so get them once per item
+            files = [set(item.files) for item in self.items]
+            first = self.items[0]
+            different = False
+            for item, names in zip(self.items[1:], files[1:]):
+                if names != files[0]:
+                    different = True
+                    self.messages.append('-->different files: %s (%s files) %s (%s files), %s only in one of them' % (
+                        first.path, len(files[0]), item.path, len(names), len(files[0] ^ names)))
+            # files of the same name in all copies
+            common = sorted(set.intersection(*files))
+            mismatches = verifier.compare([os.path.join(item.path, f) for item in self.items]
+                                          for f in common)
+            for a, b in mismatches:
+                self.messages.append('-->file mismatch: %s %s' % (a, b))
+            if not (mismatches or different):
                 self.messages.append('SUCCESS: identical duplicates verified')
             else:
                 self.messages.append('-->WARNING: differences detected!!')
-            return all_good
+            return not (mismatches or different)
+
+
+class HardlinkedSet(DuplicateSet):
+    """
+    DuplicateSet where all items are hardlinks of the same files. Reported
+    separately, all items are kept in interactive mode.
+    """
+    label = 'hardlinked set'
+    command = 'keep'
+
+    @classmethod
+    def from_set(cls, ds):
+        hs = cls()
+        hs.items, hs.size, hs.num_files, hs.messages = ds.items, ds.size, ds.num_files, ds.messages
+        return hs
+
+
+class FileDuplicateSet(DuplicateSet):
+    """
+    Set of identical files (--files), items have path, size, num_files (1)
+    and digest (content hash). Hardlinks are not part of a set.
+    """
+    label = 'file set'
+
+    @property
+    def wasted(self):
+        """Bytes freed by keeping only one of the files."""
+        return self.size * (len(self.items) - 1)
+
+    @property
+    def hardlinked(self):
+        return False
+
+
+def split_hardlinked(duplicates, hardlinked):
+    """
+    Yield all sets of duplicates that are not hardlinked (see
+    DuplicateSet.hardlinked), append HardlinkedSets to hardlinked.
+    """
+    for ds in duplicates:
+        if ds.hardlinked:
+            hardlinked.append(HardlinkedSet.from_set(ds))
+        else:
+            yield ds
 
 
 class ShallowDuplicateSet(object):
 
     line_types = [
-                   ('SET_START', re.compile('\#duplicate set \[(?P<digest>[\w]{32})\] (?P<num_duplicates>[\d]*) duplicates (?P<size>[\d\.]*) bytes (?P<num_files>[\d]*) files')),
-                   ('SET_END', re.compile('#/duplicate set \[(?P<digest>[\w]{32})\]')),
+                   ('SET_START', re.compile('\#(?P<kind>duplicate|file) set \[(?P<digest>%s)\] (?P<num_duplicates>[\d]*) duplicates (?P<size>[\d\.]*) bytes (?P<num_files>[\d]*) files' % DIGEST_PATTERN)),
+                   ('SET_END', re.compile('#/(?P<kind>duplicate|file) set \[(?P<digest>%s)\]' % DIGEST_PATTERN)),
                    ('DUPLICATE', re.compile('\[(?P<cmd>.*)\]\(\"(?P<path>.*)\"\)')),
                    ('ERROR', re.compile('-->(?P<message>.*)')),
     ]
+    #: line types by the first character of a line, so most lines are
+    #: matched against one regex at most
+    line_types_by_char = {
+        '#': line_types[:2],
+        '[': line_types[2:3],
+        '-': line_types[3:],
+    }
 
     @classmethod
     def parse_line(cls, line):
         """Return line_type, group_dict or None, None."""
-        for name, regex in cls.line_types:
+        for name, regex in cls.line_types_by_char.get(line[:1], ()):
             match = regex.match(line)
             if match:
                 return name, match.groupdict()
         return None, None
 
 
-    def __init__(self, num_duplicates, num_files, digest, size):
+    def __init__(self, num_duplicates, num_files, digest, size, kind='duplicate'):
         self.num_duplicates = int(num_duplicates)
+        #: duplicate (folders) or file
+        self.kind = kind
         self.num_files = num_files
         self.digest = digest
         self.size = size
         self.items = []
         self.errors = []
+        #: output lines, printed when the set is done
+        self.log = []
 
     def add(self, cmd, folder):
         self.items.append((cmd, folder))
@@ -149,32 +305,66 @@ class ShallowDuplicateSet(object):
     def add_error(self, msg):
         self.errors.append(msg)
 
-    def process(self, commit=False):
+    @property
+    def size_bytes(self):
+        return int(str(self.size).replace('.', '') or 0)
+
+    def process(self, commit=False, journal=None, verifier=None):
         """
-        Process the actual deletes, do not delete anything if errors occurred.
+        Process the actual deletes (and hardlinks/reflinks to the first kept
+        folder, see linking), do not touch anything if errors occurred.
+        Sets of kind file contain files instead of folders.
+        Return the list of (command, folder) processed, or None if the set
+        was ignored (nothing was touched), messages go to self.log.
+
+        With a journal (see deletion.Journal), folders it has recorded as
+        deleted may be missing, and each deleted folder is recorded.
 
         Err on the side of caution.
         """
-        for _cmd, folder in self.items:
+        for cmd, folder in self.items:
             if not os.path.exists(folder):
-                print('-->ignored set: a folder does not exist')
-                return
-        print('processing shallow duplicate [%s]' % self.digest)
+                if cmd == 'delete' and journal is not None and journal.was_deleted(folder):
+                    # deleted before an interruption
+                    continue
+                self.log.append('-->ignored set: a folder does not exist')
+                return None
+        self.log.append('processing shallow duplicate [%s]' % self.digest)
         if self.errors:
-            print('-->ignored set: errors')
-            return
+            self.log.append('-->ignored set: errors')
+            return None
         if self.num_duplicates != len(self.items):
-            print('--> ignored set: wrong number of items', self.num_duplicates, self.items)
-            return
-        keep = filter(lambda x: x[0] != 'delete', self.items)
-        delete = filter(lambda x: x[0] == 'delete', self.items)
+            self.log.append('--> ignored set: wrong number of items %s %s' % (self.num_duplicates, self.items))
+            return None
+        keep = [item for item in self.items if item[0] not in ACTIONS]
+        actions = [item for item in self.items if item[0] in ACTIONS]
         if not len(keep):
-            print('-->ignored set: must keep at least one of the duplicates')
-            return
-        elif delete:
-            for _cmd, folder in delete:
+            self.log.append('-->ignored set: must keep at least one of the duplicates')
+            return None
+        source = keep[0][1]
+        done = []
+        for cmd, folder in actions:
+            if cmd != 'delete':
                 if not commit:
-                    print('dry-run: deleting', folder)
+                    self.log.append('dry-run: %s %s to %s' % (cmd, folder, source))
+                    continue
+                self.log.append('%s %s to %s' % (cmd, folder, source))
+                from linking import link_file, link_folder
+                link = link_file if self.kind == 'file' else link_folder
+                linked, errors = link(source, folder, cmd, verifier)
+                self.log.extend('-->%s' % error for error in errors)
+                if not errors:
+                    done.append((cmd, folder))
+            elif not commit:
+                self.log.append('dry-run: deleting %s' % folder)
+            elif os.path.exists(folder):
+                self.log.append('deleting %s' % folder)
+                if self.kind == 'file':
+                    os.remove(folder)
                 else:
-                    print('deleting', folder)
+                    import shutil
                     shutil.rmtree(folder)
+                if journal is not None:
+                    journal.deleted(folder)
+                done.append((cmd, folder))
+        return done
@@ -0,0 +1,275 @@
+"""
+Memory bounded scan for trees that don't fit into memory.
+
+ExtSortFactory replaces Factory (like NodeTable, only with MerkleDirTree).
+Nothing is kept in memory for a finished directory:
+
+- digest, size, number of files, inode sum and path are appended to a
+  spill file
+- a fixed-width record (digest, offset in the spill file) goes into a
+  buffer, full buffers are sorted and written to run files
+
+Grouping merges all runs (external merge sort), only for digests that
+show up more than once the entries are read back from the spill file.
+
+Limitations: directories seen under another path (bind mounts) are not
+detected, MinHash signatures (--similar) are not stored.
+"""
+
+from __future__ import print_function
+
+from itertools import groupby
+import heapq
+import os
+import struct
+import sys
+import threading
+
+from dirtree import list_files
+from duplicate_set import DuplicateSet, is_inside
+from hashing import DEFAULT_HASH, DIGEST_SIZE, digest_bytes, format_digest
+from walker import make_walker
+
+#: digest, offset of the entry in the spill file
+RECORD = struct.Struct('>16sQ')
+#: digest, size, number of files, inode sum, length of the path that follows
+ENTRY = struct.Struct('>16sqqqI')
+#: estimated memory per buffered record (bytes object and list slot)
+RECORD_COST = RECORD.size + 48
+MIN_RUN_RECORDS = 1024
+#: runs merged at once, more runs are merged in several passes
+MAX_FAN_IN = 128
+BLOCK_SIZE = 64 * 1024
+
+
+def encode_path(path):
+    """Return path as bytes."""
+    if not isinstance(path, bytes):
+        path = path.encode(sys.getfilesystemencoding() or 'utf-8', 'surrogateescape')
+    return path
+
+
+def decode_path(path):
+    """Return the bytes from encode_path() as a native path."""
+    if bytes is str:
+        return path
+    return path.decode(sys.getfilesystemencoding() or 'utf-8', 'surrogateescape')
+
+
+def pack_entry(item):
+    """Return digest, size, number of files, inode sum and path of item as bytes."""
+    path = encode_path(item.path)
+    return ENTRY.pack(digest_bytes(item.digest), item.size, item.num_files,
+                      item.inode_sum, len(path)) + path
+
+
+def read_entry(f, hash_name=DEFAULT_HASH):
+    """
+    Read an entry written with pack_entry() from f, return (digest, size,
+    number of files, inode sum, path) or None at the end of f. hash_name
+    is the backend of the digests.
+    """
+    data = f.read(ENTRY.size)
+    if not data:
+        return None
+    digest, size, num_files, inode_sum, length = ENTRY.unpack(data)
+    path = decode_path(f.read(length))
+    return format_digest(hash_name, digest), size, num_files, inode_sum, path
+
+
+def order_key(path, roots):
+    """Position of path in a serial scan of roots (roots in order, pre-order by name)."""
+    for idx, root in enumerate(roots):
+        if is_inside(path, root):
+            rel = os.path.relpath(path, root)
+            return idx, () if rel == os.curdir else tuple(rel.split(os.sep))
+    return len(roots), (path,)
+
+
+class SpilledDir(object):
+    """A directory read back from the spill file, can be used instead of a DirTree."""
+    __slots__ = ('factory', 'path', 'size', 'num_files', 'inode_sum', 'digest')
+
+    def __init__(self, factory, path, size, num_files, inode_sum, digest):
+        self.factory = factory
+        self.path = path
+        self.size = size
+        self.num_files = num_files
+        self.inode_sum = inode_sum
+        self.digest = digest
+
+    @property
+    def files(self):
+        """Files are read from disk again, they are not stored."""
+        return list_files(self.path, self.factory)
+
+    def __str__(self):
+        return 'size: %s\t files: %s \t%s' % (self.size, self.num_files, self.path)
+
+
+def _read_records(f):
+    """Yield all records of an open run file."""
+    while True:
+        block = f.read(BLOCK_SIZE - BLOCK_SIZE % RECORD.size)
+        if not block:
+            return
+        for start in range(0, len(block), RECORD.size):
+            yield block[start:start + RECORD.size]
+
+
+class ExtSortFactory(object):
+    """
+    Replacement for Factory that uses about memory_limit bytes for the
+    run buffer, temporary files go to tmp_dir. close() removes them.
+    """
+
+    def __init__(self, walker=None, memory_limit=256 * 1024 * 1024, tmp_dir=None):
+        if walker is None:
+            walker = make_walker()
+        self.walker = walker
+        self.minhash = None
+        self.one_file_system = False
+        self.hash_name = DEFAULT_HASH
+        self.file_index = None
+        self.warn = print
+        self.on_error = None
+        self.dirs = _NoDirIndex()
+        self.pool = None
+        self._lock = threading.Lock()
+        self.max_records = max(memory_limit // RECORD_COST, MIN_RUN_RECORDS)
+        import tempfile
+        self._tmp_dir = tempfile.mkdtemp(prefix='dupdirs-', dir=tmp_dir)
+        self._spill = open(os.path.join(self._tmp_dir, 'spill'), 'w+b')
+        self._offset = 0
+        self._count = 0
+        self._buffer = []
+        self._runs = []
+        self._roots = []
+
+    def __len__(self):
+        return self._count
+
+    def register(self, item):
+        pass
+
+    def finalize(self, item):
+        """Spill item, release its files and children."""
+        entry = pack_entry(item)
+        item.release()
+        with self._lock:
+            self._buffer.append(RECORD.pack(entry[:DIGEST_SIZE], self._offset))
+            self._spill.write(entry)
+            self._offset += len(entry)
+            self._count += 1
+            if len(self._buffer) >= self.max_records:
+                self._write_run()
+
+    def _new_run(self):
+        path = os.path.join(self._tmp_dir, 'run%d' % len(self._runs))
+        self._runs.append(path)
+        return path
+
+    def _write_run(self):
+        """Sort the buffer and write it to a new run file."""
+        if not self._buffer:
+            return
+        self._buffer.sort()
+        with open(self._new_run(), 'wb') as f:
+            f.write(b''.join(self._buffer))
+        self._buffer = []
+        self.walker.stats.count('extsort', 'runs')
+
+    def reorder(self, trees):
+        """Called at the end of the scan, write the last run."""
+        self._roots = [tree.path for tree in trees]
+        with self._lock:
+            self._write_run()
+        self._spill.flush()
+
+    def _read_entry(self, offset):
+        self._spill.seek(offset)
+        digest, size, num_files, inode_sum, path = read_entry(self._spill, self.hash_name)
+        return SpilledDir(self, path, size, num_files, inode_sum, digest)
+
+    def scanned_names(self, path):
+        """Names are not kept."""
+        return None
+
+    def ordered_values(self):
+        """Yield all directories in the order they were finished (children first)."""
+        offset = 0
+        while offset < self._offset:
+            item = self._read_entry(offset)
+            offset = self._spill.tell()
+            yield item
+
+    def _merge(self, runs):
+        """Return an iterator over the records of all runs, sorted."""
+        files = [open(run, 'rb') for run in runs]
+        try:
+            for record in heapq.merge(*[_read_records(f) for f in files]):
+                yield record
+        finally:
+            for f in files:
+                f.close()
+
+    def _merged(self):
+        """Merge runs until at most MAX_FAN_IN are left, return an iterator over all records."""
+        runs = list(self._runs)
+        while len(runs) > MAX_FAN_IN:
+            merged = []
+            for start in range(0, len(runs), MAX_FAN_IN):
+                path = self._new_run()
+                with open(path, 'wb') as f:
+                    for record in self._merge(runs[start:start + MAX_FAN_IN]):
+                        f.write(record)
+                for run in runs[start:start + MAX_FAN_IN]:
+                    os.remove(run)
+                merged.append(path)
+                self.walker.stats.count('extsort', 'merge passes')
+            runs = merged
+        return self._merge(runs)
+
+    def _order_key(self, item):
+        return order_key(item.path, self._roots)
+
+    def group_duplicates(self, min_size=0):
+        """Like duplicate_set.group_duplicates for all spilled directories."""
+        sets = []
+        for _digest, records in groupby(self._merged(), key=lambda record: record[:DIGEST_SIZE]):
+            offsets = [RECORD.unpack(record)[1] for record in records]
+            if len(offsets) < 2:
+                continue
+            items = {}
+            for offset in offsets:
+                item = self._read_entry(offset)
+                if item.size < min_size:
+                    break
+                # nested roots are scanned twice
+                items.setdefault(item.path, item)
+            if len(items) < 2:
+                continue
+            ds = DuplicateSet()
+            for item in sorted(items.values(), key=self._order_key):
+                ds.add(item)
+            sets.append(ds)
+        sets.sort(key=lambda ds: self._order_key(ds.items[0]))
+        return sets
+
+    def close(self):
+        import shutil
+        self._spill.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+class _NoDirIndex(object):
+    """Directories are not remembered, memory would grow with the tree."""
+
+    def visit(self, dev, ino, path):
+        return True
+
+    def read_under(self, dev, ino, path):
+        return True
+
+    def ordered(self, roots):
+        return True
@@ -0,0 +1,79 @@
+"""
+Duplicate files (--files), found with the directory scan.
+
+During the scan every file is added to a FileIndex (factory.file_index),
+so no second walk is needed. Files of the same size are candidates, they
+go through the stages of ContentVerifier.partition(): partial hash, then
+full hash for files larger than what the partial hash read, on the pool
+of the verifier.
+
+Empty files are ignored, they are all identical.
+"""
+
+from __future__ import print_function
+
+import threading
+
+from duplicate_set import FileDuplicateSet
+
+
+class FileItem(object):
+    """A file in a FileDuplicateSet."""
+    __slots__ = ('path', 'size', 'digest')
+    num_files = 1
+
+    def __init__(self, path, size, digest):
+        self.path = path
+        self.size = size
+        self.digest = digest
+
+
+class FileIndex(object):
+    """
+    Paths of all files by size, add() may be called from several threads.
+
+    Only the first file of each size is kept as a single path, a list is
+    created when a second file of that size shows up.
+    """
+
+    def __init__(self):
+        self._first = {}
+        self._candidates = {}
+        self._lock = threading.Lock()
+
+    def add(self, path, entry):
+        size = entry.size
+        if not size:
+            return
+        with self._lock:
+            if size in self._candidates:
+                self._candidates[size].append(path)
+            elif size in self._first:
+                self._candidates[size] = [self._first.pop(size), path]
+            else:
+                self._first[size] = path
+
+    def candidates(self):
+        """
+        Return (size, paths) for all sizes with more than one file, largest
+        first, paths sorted (parallel scans add them in any order).
+        """
+        return [(size, sorted(paths)) for size, paths in
+                sorted(self._candidates.items(), key=lambda item: -item[0])]
+
+
+def find_duplicate_files(index, verifier, stats=None):
+    """Return FileDuplicateSets of all identical files in index (largest files first)."""
+    candidates = index.candidates()
+    if stats is not None:
+        stats.count('files', 'candidates', sum(len(paths) for _size, paths in candidates))
+    sets = []
+    for size, digest, paths in verifier.partition([paths for _size, paths in candidates]):
+        fs = FileDuplicateSet()
+        for path in paths:
+            fs.add(FileItem(path, size, digest))
+        sets.append(fs)
+        if stats is not None:
+            stats.count('files', 'sets')
+            stats.count('files', 'bytes wasted', fs.wasted)
+    return sets
@@ -0,0 +1,125 @@
+"""
+Include/exclude filters for the walker.
+
+Rules work like rsync filter rules, the first matching rule decides, an
+entry that matches no rule is included:
+
+    - .git/             exclude directories named .git
+    - *.tmp             exclude files and directories matching *.tmp
+    - */cache/thumbs    patterns with a slash match the end of the path
+    - /data/scratch     ... or the whole path if they start with a slash
+    + *.jpg             include (only useful before a broader exclude)
+    - re:\\.v\\d+$        regular expression, searched in the whole path
+
+A trailing slash restricts a rule to directories. Excluded directories
+are not read at all, excluded files are not stat'ed if the walker knows
+the type of an entry without it. Files smaller than min_file_size are
+excluded as well.
+
+A filter file has one rule per line, empty lines and lines starting
+with # are ignored.
+"""
+
+from __future__ import print_function
+
+import fnmatch
+import re
+
+INCLUDE = '+'
+EXCLUDE = '-'
+
+
+class FilterError(Exception):
+    """Raised for rules that can not be parsed."""
+
+
+class Rule(object):
+
+    def __init__(self, action, pattern):
+        if action not in (INCLUDE, EXCLUDE):
+            raise FilterError('unknown filter action %r in %r' % (action, pattern))
+        self.action = action
+        self.pattern = pattern
+        self.dir_only = pattern.endswith('/') and not pattern.startswith('re:')
+        pattern = pattern.rstrip('/') if self.dir_only else pattern
+        if pattern.startswith('re:'):
+            self.on_path = True
+            regex = pattern[3:]
+        elif '/' in pattern:
+            self.on_path = True
+            if not pattern.startswith('/'):
+                pattern = '*/' + pattern
+            regex = fnmatch.translate(pattern)
+        else:
+            self.on_path = False
+            regex = fnmatch.translate(pattern)
+        try:
+            self.regex = re.compile(regex)
+        except re.error as e:
+            raise FilterError('invalid pattern %r: %s' % (self.pattern, e))
+        self.match = self.regex.search if self.pattern.startswith('re:') else self.regex.match
+
+    def __str__(self):
+        return '%s %s' % (self.action, self.pattern)
+
+
+class Filters(object):
+    """Ordered list of rules, min_file_size, skip counters go to stats (phase 'filter')."""
+
+    def __init__(self, rules=(), min_file_size=0):
+        self.rules = list(rules)
+        self.min_file_size = min_file_size
+
+    @classmethod
+    def parse(cls, line):
+        """Return the Rule for a line like '- *.tmp'."""
+        action, _sep, pattern = line.strip().partition(' ')
+        pattern = pattern.strip()
+        if not pattern:
+            raise FilterError('missing pattern in %r' % line)
+        return Rule(action, pattern)
+
+    def add(self, action, pattern):
+        self.rules.append(Rule(action, pattern))
+
+    def read_file(self, path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    self.rules.append(self.parse(line))
+
+    def __bool__(self):
+        return bool(self.rules or self.min_file_size)
+    __nonzero__ = __bool__
+
+    def accept(self, path, name, is_dir):
+        """Return False if the entry name (full path path) is excluded."""
+        for rule in self.rules:
+            if rule.dir_only and not is_dir:
+                continue
+            if rule.match(path if rule.on_path else name):
+                return rule.action == INCLUDE
+        return True
+
+    def accept_size(self, size):
+        return size >= self.min_file_size
+
+    def fingerprint(self):
+        """Text that changes whenever the filters select other entries."""
+        return '\n'.join(['min_file_size %s' % self.min_file_size] +
+                         [str(rule) for rule in self.rules])
+
+
+def make_filters(options, min_file_size=0):
+    """
+    Return Filters for options, a list of (action, argument) in command
+    line order: (INCLUDE, pattern), (EXCLUDE, pattern) or ('file', path).
+    """
+    filters = Filters(min_file_size=min_file_size)
+    for action, argument in options or ():
+        if action == 'file':
+            filters.read_file(argument)
+        else:
+            filters.add(action, argument)
+    return filters
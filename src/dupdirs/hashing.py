@@ -0,0 +1,72 @@
+"""
+Hash backends for directory digests and content verification (--hash).
+
+- md5: the default, digests are the same as in older versions
+- sha1: first 128 bits
+- blake2b: 128 bit digest (python 3.6+ or the pyblake2 module)
+- xxhash: xxh3 128 bit (xxhash module), not cryptographic but by far the
+  fastest
+
+All backends produce 128 bit digests, so digests of every backend fit
+the fixed-width records of NodeTable, extsort and snapshots.
+
+md5 digests are written as plain hex, like older results; all other
+digests are written as name:hex. DIGEST_PATTERN matches both, so results
+of any backend can be read in interactive mode.
+"""
+
+from __future__ import print_function
+
+from collections import OrderedDict
+import binascii
+import functools
+import hashlib
+
+DEFAULT_HASH = 'md5'
+DIGEST_SIZE = 16
+#: regular expression for a digest in the text format
+DIGEST_PATTERN = r'(?:[a-z0-9]+:)?[0-9a-f]{%d}' % (2 * DIGEST_SIZE)
+
+#: hash constructors by name, only the ones available here
+HASHES = OrderedDict([
+    ('md5', hashlib.md5),
+    ('sha1', hashlib.sha1),
+])
+
+try:
+    HASHES['blake2b'] = functools.partial(hashlib.blake2b, digest_size=DIGEST_SIZE)
+except AttributeError:
+    try:
+        import pyblake2
+        HASHES['blake2b'] = functools.partial(pyblake2.blake2b, digest_size=DIGEST_SIZE)
+    except ImportError:
+        pass
+
+try:
+    import xxhash
+    HASHES['xxhash'] = getattr(xxhash, 'xxh3_128', None) or xxhash.xxh128
+except (ImportError, AttributeError):
+    pass
+
+
+def new(name=DEFAULT_HASH):
+    """Return a new hash object of backend name."""
+    return HASHES[name]()
+
+
+def format_digest(name, raw):
+    """Return the text form of raw digest bytes of backend name."""
+    digest = binascii.hexlify(raw[:DIGEST_SIZE])
+    if not isinstance(digest, str):
+        digest = digest.decode('ascii')
+    return digest if name == DEFAULT_HASH else '%s:%s' % (name, digest)
+
+
+def hexdigest(name, m):
+    """Return the text form of the digest of hash object m of backend name."""
+    return format_digest(name, m.digest())
+
+
+def digest_bytes(digest):
+    """Return the raw bytes of a digest in text form (with or without name)."""
+    return binascii.unhexlify(digest.rpartition(':')[2])
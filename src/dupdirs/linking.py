@@ -0,0 +1,152 @@
+"""
+Replace the files of a duplicate folder (or a duplicate file) with links
+to the kept copy.
+
+hardlink: os.link, all paths stay, the copies share one inode (and mode,
+owner and mtime).
+
+reflink: copy-on-write clone (FICLONE ioctl, Linux on btrfs, xfs, ...),
+the files stay independent, only the data blocks are shared. The clone
+gets owner, group, mode and times of the file it replaces, and its
+extended attributes (including POSIX ACLs) where python can read them
+(os.listxattr, python 3.3+ on Linux). Attributes the user may not set
+(e.g. trusted.*) are skipped, an owner that can't be set is an error.
+
+Each file is verified (ContentVerifier) before it is linked. The link is
+created next to the file and renamed over it, so a file is never missing.
+"""
+
+from __future__ import print_function
+
+import errno
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from verify import ContentVerifier
+
+LINK_METHODS = ('hardlink', 'reflink')
+#: from linux/fs.h
+FICLONE = 0x40049409
+TMP_SUFFIX = '.dupdirs-link'
+
+
+def _files(folder):
+    """Return relative paths of all files below folder (no symlinks), sorted."""
+    files = []
+    for path, _dirs, names in os.walk(folder):
+        for name in names:
+            full = os.path.join(path, name)
+            if not os.path.islink(full):
+                files.append(os.path.relpath(full, folder))
+    files.sort()
+    return files
+
+
+def reflink(source, target):
+    """Create target as a copy-on-write clone of source."""
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(source, 'rb') as src:
+        with open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _copy_xattrs(source, target):
+    """Copy extended attributes of file source to target, if supported."""
+    if not hasattr(os, 'listxattr'):
+        return
+    try:
+        names = os.listxattr(source)
+    except OSError as e:
+        if e.errno in (errno.ENOTSUP, errno.ENODATA):
+            return
+        raise
+    for name in names:
+        try:
+            os.setxattr(target, name, os.getxattr(source, name))
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.ENODATA, errno.EINVAL):
+                raise
+
+
+def _copy_metadata(source, target):
+    """Give file target owner, group, xattrs, mode and times of file source."""
+    import shutil
+    st = os.lstat(source)
+    if (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+        # before the mode, chown clears setuid/setgid bits
+        os.chown(target, st.st_uid, st.st_gid)
+    _copy_xattrs(source, target)
+    shutil.copystat(source, target)
+
+
+def _replace(source, target, method):
+    tmp = target + TMP_SUFFIX
+    try:
+        if method == 'hardlink':
+            os.link(source, tmp)
+        else:
+            reflink(source, tmp)
+            _copy_metadata(target, tmp)
+        os.rename(tmp, target)
+    except (IOError, OSError):
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def link_folder(source, target, method, verifier=None):
+    """
+    Replace all files in target by links (method: hardlink or reflink) to
+    the same files in source.
+
+    Return (number of files linked, list of error messages). Nothing is
+    linked if the folders don't have the same files, files that differ
+    are left alone, the first error from the filesystem stops.
+    """
+    if verifier is None:
+        verifier = ContentVerifier()
+    files = _files(source)
+    if files != _files(target):
+        return 0, ['folders do not contain the same files: %s %s' % (source, target)]
+    pairs = [(os.path.join(source, f), os.path.join(target, f)) for f in files]
+    mismatches = verifier.compare(pairs)
+    errors = ['file mismatch, not linked: %s %s' % mismatch for mismatch in mismatches]
+    different = set(b for _a, b in mismatches)
+    linked = 0
+    for a, b in pairs:
+        if b in different:
+            continue
+        if method == 'hardlink' and os.path.samefile(a, b):
+            continue
+        try:
+            _replace(a, b, method)
+        except (IOError, OSError) as e:
+            errors.append('%s failed for %s: %s' % (method, b, e))
+            break
+        linked += 1
+    return linked, errors
+
+
+def link_file(source, target, method, verifier=None):
+    """
+    Replace file target by a link (method: hardlink or reflink) to file
+    source, like link_folder() for single files.
+
+    Return (number of files linked, list of error messages).
+    """
+    if verifier is None:
+        verifier = ContentVerifier()
+    if verifier.compare([(source, target)]):
+        return 0, ['file mismatch, not linked: %s %s' % (source, target)]
+    if method == 'hardlink' and os.path.samefile(source, target):
+        return 0, []
+    try:
+        _replace(source, target, method)
+    except (IOError, OSError) as e:
+        return 0, ['%s failed for %s: %s' % (method, target, e)]
+    return 1, []
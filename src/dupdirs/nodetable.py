@@ -0,0 +1,206 @@
+"""
+Compact storage for scanned directories.
+
+Factory keeps every DirTree alive, for millions of directories the object
+overhead is much larger than the actual data. NodeTable replaces Factory
+and stores each directory as one row in a few parallel arrays (parent,
+name, size, number of files, inode sum, digest) as soon as its digest is
+known, the DirTree is dropped afterwards. Name segments are interned. MinHash
+signatures (--similar) are stored in one more array.
+
+Only works with MerkleDirTree (a flat DirTree still needs the contents of
+its children after they are complete).
+"""
+
+from __future__ import print_function
+
+from array import array
+import os
+import threading
+
+from dirtree import DirIndex, list_files
+from duplicate_set import is_inside
+from hashing import DEFAULT_HASH, DIGEST_SIZE, digest_bytes, format_digest
+from walker import make_walker
+
+try:
+    array('q')
+    LONG = 'q'
+except ValueError:
+    # python 2
+    LONG = 'l'
+
+
+class Node(object):
+    """One row of a NodeTable, can be used instead of a DirTree."""
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def path(self):
+        table = self.table
+        segments = []
+        index = self.index
+        while index >= 0:
+            segments.append(table.names[table.name[index]])
+            index = table.parent[index]
+        return os.path.join(*reversed(segments))
+
+    @property
+    def size(self):
+        return self.table.size[self.index]
+
+    @property
+    def num_files(self):
+        return self.table.num_files[self.index]
+
+    @property
+    def inode_sum(self):
+        return self.table.inode_sum[self.index]
+
+    @property
+    def digest(self):
+        start = self.index * DIGEST_SIZE
+        return format_digest(self.table.hash_name, bytes(self.table.digests[start:start + DIGEST_SIZE]))
+
+    @property
+    def signature(self):
+        num_perm = self.table.minhash.num_perm
+        start = self.index * num_perm
+        return self.table.signatures[start:start + num_perm]
+
+    @property
+    def files(self):
+        """Files are read from disk again, they are not stored."""
+        return list_files(self.path, self.table)
+
+    def __str__(self):
+        return 'size: %s\t files: %s \t%s' % (self.size, self.num_files, self.path)
+
+
+class NodeTable(object):
+    """
+    Replacement for Factory, ordered_values() returns Nodes in the same
+    order as Factory.ordered_values() for the same scan.
+    """
+
+    def __init__(self, walker=None, minhash=None):
+        if walker is None:
+            walker = make_walker()
+        self.walker = walker
+        self.minhash = minhash
+        self.one_file_system = False
+        self.hash_name = DEFAULT_HASH
+        self.file_index = None
+        self.warn = print
+        self.on_error = None
+        self.dirs = DirIndex()
+        self.pool = None
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        #: index of the parent row, -1 for roots
+        self.parent = array(LONG)
+        #: index into names
+        self.name = array(LONG)
+        self.size = array(LONG)
+        self.num_files = array(LONG)
+        self.inode_sum = array(LONG)
+        self.digests = bytearray()
+        #: minhash signatures, if there is a minhash
+        self.signatures = array('I')
+        self.names = []
+        self._name_ids = {}
+        #: row indexes in the order of a serial scan
+        self.order = array(LONG)
+
+    def __len__(self):
+        return len(self.order)
+
+    def _intern(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def reset(self):
+        """Forget all rows (and visited directories and files) to scan again."""
+        self._clear()
+        self.dirs = type(self.dirs)()
+        if self.file_index is not None:
+            self.file_index = type(self.file_index)()
+
+    def register(self, item):
+        pass
+
+    def finalize(self, item):
+        """Store item in a new row, release its files and children."""
+        digest = digest_bytes(item.digest)
+        children = [child.index for child in item.children]
+        item.release()
+        with self._lock:
+            index = len(self.size)
+            self.parent.append(-1)
+            self.name.append(self._intern(os.path.basename(item.path)))
+            self.size.append(item.size)
+            self.num_files.append(item.num_files)
+            self.inode_sum.append(item.inode_sum)
+            self.digests.extend(digest)
+            if self.minhash is not None:
+                self.signatures.extend(item.signature)
+            for child in children:
+                self.parent[child] = index
+        item.index = index
+
+    def reorder(self, trees):
+        """
+        Set the order of ordered_values() to the order of a serial scan.
+        Trees that are inside other trees are left out.
+        """
+        for tree in trees:
+            self.name[tree.index] = self._intern(tree.path)
+        num_rows = len(self.parent)
+        # children of each row, sorted by name, children of row i are
+        # children[offsets[i]:offsets[i+1]]
+        offsets = array(LONG, [0]) * (num_rows + 1)
+        for parent in self.parent:
+            if parent >= 0:
+                offsets[parent + 1] += 1
+        for index in range(num_rows):
+            offsets[index + 1] += offsets[index]
+        children = array(LONG, [0]) * num_rows
+        fill = array(LONG, offsets)
+        for index, parent in enumerate(self.parent):
+            if parent >= 0:
+                children[fill[parent]] = index
+                fill[parent] += 1
+        del fill
+        for index in range(num_rows):
+            start, end = offsets[index], offsets[index + 1]
+            if end - start > 1:
+                children[start:end] = array(LONG, sorted(
+                    children[start:end], key=lambda child: self.names[self.name[child]]))
+
+        self.order = array(LONG)
+        for idx, tree in enumerate(trees):
+            if any(is_inside(tree.path, other.path) and (other_idx < idx or tree.path != other.path)
+                   for other_idx, other in enumerate(trees) if other_idx != idx):
+                continue
+            stack = [tree.index]
+            while stack:
+                index = stack.pop()
+                self.order.append(index)
+                stack.extend(reversed(children[offsets[index]:offsets[index + 1]]))
+
+    def scanned_names(self, path):
+        """Names are not kept."""
+        return None
+
+    def ordered_values(self):
+        for index in self.order:
+            yield Node(self, index)
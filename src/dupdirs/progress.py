@@ -0,0 +1,140 @@
+"""
+Progress line on stderr (--progress), sampled from the Stats counters.
+
+The scan counts directories, files and bytes once per directory, the
+verifier counts the bytes it hashed once per file, so the hot paths
+don't do anything extra for progress: a background thread reads the
+counters of the running phase every interval seconds and rewrites one
+line with counts, throughput and, with the totals of an earlier run (its
+--stats-file), percentage and ETA.
+
+On a terminal the line is rewritten in place, otherwise a new line is
+written every LOG_INTERVAL seconds. Phases that print results (verify,
+delete) are skipped when the results go to the same terminal.
+"""
+
+from __future__ import print_function
+
+from datetime import timedelta
+import json
+import sys
+import threading
+
+from duplicate_set import human_readable
+
+#: timer phase: (counter phase, bytes counter for throughput and ETA,
+#: other counters shown, phase prints results)
+PHASES = {
+    'scan': ('scan', 'bytes', ('directories', 'files'), False),
+    'digest': (None, None, (), False),
+    'group': (None, None, (), False),
+    'nested': (None, None, (), False),
+    'filecmp': ('filecmp', 'bytes hashed', ('partial hash', 'full hash'), False),
+    'export': (None, None, (), False),
+    'verify': ('filecmp', 'bytes hashed', (), True),
+    'delete': ('delete', 'bytes freed', ('sets',), True),
+}
+TTY_INTERVAL = 1.0
+LOG_INTERVAL = 10.0
+MB = 1024.0 * 1024
+
+
+class ProgressError(Exception):
+    """Raised when the totals of an earlier run can't be read."""
+
+
+def read_totals(path):
+    """Return the counters of a --stats-file written by an earlier run."""
+    try:
+        with open(path) as f:
+            return json.load(f)['counters']
+    except (IOError, OSError) as e:
+        raise ProgressError('can\'t read %s: %s' % (path, e))
+    except (ValueError, KeyError, TypeError):
+        raise ProgressError('%s is not a --stats-file' % path)
+
+
+class Progress(object):
+    """
+    Render the progress of the phases of stats to file until stop().
+    totals are the counters of an earlier run (see read_totals), they give
+    percentage and ETA of phases with a bytes counter.
+    """
+
+    def __init__(self, stats, totals=None, file=None, interval=None):
+        self.stats = stats
+        self.totals = totals or {}
+        self.file = file or sys.stderr
+        self.tty = _isatty(self.file)
+        self.interval = interval or (TTY_INTERVAL if self.tty else LOG_INTERVAL)
+        # results on the same terminal would be mixed with the line
+        self.skip_output = self.tty and _isatty(sys.stdout)
+        self._width = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='progress')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._show('')
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._show(self.line())
+
+    def line(self):
+        """Return the progress line of the running phase ('' if nothing to show)."""
+        running = self.stats.running()
+        if running is None or running[0] not in PHASES:
+            return ''
+        phase, elapsed = running
+        counter_phase, bytes_counter, shown, prints = PHASES[phase]
+        if prints and self.skip_output:
+            return ''
+        parts = ['%s %s' % (phase, timedelta(seconds=int(elapsed)))]
+        if counter_phase is None:
+            return parts[0]
+        counters = self.stats.values(counter_phase)
+        for name in shown:
+            parts.append('%s %s' % (human_readable(counters.get(name, 0)), name))
+        done = counters.get(bytes_counter, 0)
+        parts.append('%.1f MB (%.1f MB/s)' % (done / MB, done / MB / max(elapsed, 1e-6)))
+        total = self.totals.get(counter_phase, {}).get(bytes_counter)
+        if total and done:
+            if done < total:
+                eta = (total - done) * elapsed / done
+                parts.append('%d%%, ETA %s' % (100 * done // total, timedelta(seconds=int(eta))))
+            else:
+                parts.append('more than the earlier run')
+        return ', '.join(parts)
+
+    def _show(self, line):
+        if self.tty:
+            # pad to overwrite the rest of a longer line
+            self.file.write('\r%s\r' % line.ljust(self._width))
+            self._width = len(line)
+        elif line:
+            self.file.write(line + '\n')
+        self.file.flush()
+
+
+def _isatty(f):
+    try:
+        return f.isatty()
+    except (AttributeError, ValueError):
+        return False
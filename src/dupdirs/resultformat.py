@@ -0,0 +1,137 @@
+"""
+Result formats.
+
+text: the human readable output of DuplicateSet.__str__, one line per
+item, parsed back with regular expressions.
+
+jsonl: JSON Lines, a header line {"format": "dupdirs", "version": 1}
+followed by one record per set:
+
+    {"type": "duplicate set", "digest": ..., "num_duplicates": 2,
+     "size": 1024, "num_files": 3, "messages": [...],
+     "items": [{"cmd": "delete", "path": ...}, ...]}
+    {"type": "file set", ...}  (--files, same fields, items are files)
+    {"type": "similarity set", "kind": "similar", "score": 0.9,
+     "items": [{"cmd": "keep", "path": ..., "size": ..., "num_files": ...}]}
+
+Paths may contain any character. Paths that are not valid UTF-8 (python
+2 only) are written as "path_hex" instead of "path".
+
+read_events() accepts both formats and yields the same events for both,
+so interactive mode does not care which format it gets.
+"""
+
+from __future__ import print_function
+
+from itertools import chain
+import binascii
+import json
+
+from duplicate_set import ShallowDuplicateSet, human_readable
+
+FORMAT = 'dupdirs'
+FORMAT_VERSION = 1
+FORMATS = ('text', 'jsonl')
+
+#: python 2, paths are bytes
+_BYTES_PATHS = bytes is str
+
+
+class ResultFormatError(Exception):
+    """Raised for result files that can not be read."""
+
+
+def header():
+    """Return the first line of a jsonl result."""
+    return json.dumps({'format': FORMAT, 'version': FORMAT_VERSION}, sort_keys=True)
+
+
+def dumps(record):
+    """Return record (see as_record() of the sets) as one line of JSON."""
+    for item in record['items']:
+        path = item['path']
+        if _BYTES_PATHS and isinstance(path, bytes):
+            try:
+                path.decode('utf-8')
+            except UnicodeDecodeError:
+                item['path_hex'] = binascii.hexlify(item.pop('path'))
+    return json.dumps(record, sort_keys=True)
+
+
+def _native(text):
+    """Return text from JSON as str (python 2: bytes, to mix it with paths)."""
+    if _BYTES_PATHS and not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return text
+
+
+def _load_path(item):
+    if 'path_hex' in item:
+        return binascii.unhexlify(item['path_hex'])
+    return _native(item['path'])
+
+
+def _record_events(record):
+    """Yield the events of the text format for a duplicate set record."""
+    if record.get('type') not in ('duplicate set', 'file set') or not record['num_files']:
+        # like the text format: nothing to process for similarity sets
+        # and empty folders
+        return
+    digest = _native(record['digest'])
+    kind = _native(record['type'].split()[0])
+    params = {
+        'kind': kind,
+        'digest': digest,
+        'num_duplicates': str(record['num_duplicates']),
+        'size': human_readable(record['size']),
+        'num_files': str(record['num_files']),
+    }
+    yield 'SET_START', params, '#%s set [%s] %s duplicates %s bytes %s files' % (
+        kind, digest, params['num_duplicates'], params['size'], params['num_files'])
+    for item in record['items']:
+        cmd, path = _native(item['cmd']), _load_path(item)
+        yield 'DUPLICATE', {'cmd': cmd, 'path': path}, '[%s]("%s")' % (cmd, path)
+    for message in map(_native, record['messages']):
+        if message.startswith('-->'):
+            yield 'ERROR', {'message': message[3:]}, message
+    yield 'SET_END', {'kind': kind, 'digest': digest}, '#/%s set [%s]' % (kind, digest)
+
+
+def _read_jsonl(f):
+    # the header was line 1
+    for number, line in enumerate(f, 2):
+        if not line.startswith('{'):
+            # e.g. warnings in the output
+            continue
+        try:
+            events = list(_record_events(json.loads(line)))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise ResultFormatError('line %s is not a valid record (truncated file?)' % number)
+        for event in events:
+            yield event
+
+
+def _read_text(lines):
+    for line in lines:
+        line = line.strip()
+        line_type, params = ShallowDuplicateSet.parse_line(line)
+        yield line_type, params, line
+
+
+def read_events(f):
+    """
+    Yield (line type, params, text line) for all lines of f (text) or
+    all records of f (jsonl), line types as in ShallowDuplicateSet.parse_line().
+    """
+    first = f.readline()
+    if first.startswith('{'):
+        try:
+            head = json.loads(first)
+        except ValueError:
+            head = {}
+        if head.get('format') != FORMAT:
+            raise ResultFormatError('not a dupdirs result file')
+        if head.get('version', 0) > FORMAT_VERSION:
+            raise ResultFormatError('unsupported result format version %s' % head['version'])
+        return _read_jsonl(f)
+    return _read_text(chain([first], f))
@@ -0,0 +1,143 @@
+"""
+Persistent scan cache.
+
+The entries of every directory are stored together with device, inode and
+mtime of the directory. On the next run, the entries of a directory that
+did not change are taken from the cache: a single stat of the directory
+replaces reading it and stat'ing all files in it.
+
+Caveat: the mtime of a directory only changes when entries are added,
+removed or renamed. If a file is changed in place, the cached size
+(and mtime) of that file is used until its directory changes.
+
+Rows of directories below the scanned roots that the scan did not visit
+(removed, renamed, now skipped) are deleted after the scan, see prune().
+
+Entries are stored after filtering, a cache is dropped when it is used
+with other filters.
+"""
+
+from __future__ import print_function
+
+import marshal
+import os
+import sqlite3
+import sys
+import threading
+
+from walker import FILE, Entry, Walker
+
+SCHEMA_VERSION = 4
+
+
+def _encode(path):
+    """Return path as bytes, paths are not necessarily valid text."""
+    if not isinstance(path, bytes):
+        path = path.encode(sys.getfilesystemencoding() or 'utf-8', 'surrogateescape')
+    return path
+
+
+def _key(path):
+    return sqlite3.Binary(_encode(path))
+
+
+class ScanCache(object):
+    """
+    SQLite database with one row per directory, may be used from several
+    threads.
+    """
+
+    def __init__(self, path, filters=None):
+        self.path = path
+        self.filters = filters
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # paths of all directories looked up by this run
+        self._visited = set()
+        self._setup()
+
+    def _fingerprint(self):
+        """Everything that invalidates all cached entries when it changes."""
+        # marshal format depends on the python version
+        fingerprint = '%s python%s.%s' % (SCHEMA_VERSION, sys.version_info[0], sys.version_info[1])
+        if self.filters:
+            fingerprint += '\n' + self.filters.fingerprint()
+        return fingerprint
+
+    def _setup(self):
+        db = self.db
+        db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = db.execute("SELECT value FROM meta WHERE key='fingerprint'").fetchone()
+        if row is None or row[0] != self._fingerprint():
+            db.execute('DROP TABLE IF EXISTS dirs')
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (self._fingerprint(),))
+        db.execute('CREATE TABLE IF NOT EXISTS dirs ('
+                   'path BLOB PRIMARY KEY, dev INTEGER, ino INTEGER, mtime REAL, '
+                   'entries BLOB)')
+        db.commit()
+
+    def lookup(self, path, st):
+        """Return cached entries of path if the directory (stat st) did not change, or None."""
+        path = _encode(path)
+        with self._lock:
+            self._visited.add(path)
+            row = self.db.execute('SELECT dev, ino, mtime, entries FROM dirs WHERE path=?',
+                                  (sqlite3.Binary(path),)).fetchone()
+        if row is None or tuple(row[:3]) != (st.st_dev, st.st_ino, st.st_mtime):
+            return None
+        return [Entry(*item) for item in marshal.loads(bytes(row[3]))]
+
+    def store(self, path, st, entries):
+        data = sqlite3.Binary(marshal.dumps([tuple(entry) for entry in entries]))
+        with self._lock:
+            self.db.execute('INSERT OR REPLACE INTO dirs (path, dev, ino, mtime, entries) '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (_key(path), st.st_dev, st.st_ino, st.st_mtime, data))
+
+    def prune(self, roots):
+        """
+        Delete the rows of directories below roots that were not visited
+        since the cache was opened, return the number of deleted rows.
+        Call it after a complete scan of roots only.
+        """
+        roots = [_encode(root) for root in roots]
+        prefixes = tuple(_encode(os.path.join(root, '')) for root in roots)
+        with self._lock:
+            gone = [row[0] for row in self.db.execute('SELECT path FROM dirs')
+                    if bytes(row[0]) not in self._visited
+                    and (bytes(row[0]) in roots or bytes(row[0]).startswith(prefixes))]
+            self.db.executemany('DELETE FROM dirs WHERE path=?', ((path,) for path in gone))
+        return len(gone)
+
+    def close(self):
+        with self._lock:
+            self.db.commit()
+            self.db.close()
+
+
+class CachingWalker(Walker):
+    """
+    Take entries from the cache if a directory did not change, read them
+    with walker otherwise. Counts hits and misses in stats (phase 'cache').
+    """
+    name = 'cache'
+
+    def __init__(self, walker, cache):
+        super(CachingWalker, self).__init__(walker.stats)
+        self.walker = walker
+        self.cache = cache
+
+    def entries(self, path):
+        count = self.stats.count
+        count('scan', 'stat')
+        # stat before reading, a change while reading results in a miss next time
+        st = os.stat(path)
+        entries = self.cache.lookup(path, st)
+        if entries is None:
+            count('cache', 'miss')
+            entries = self.walker.entries(path)
+            self.cache.store(path, st, entries)
+        else:
+            count('cache', 'hit')
+            count('cache', 'files skipped', sum(1 for entry in entries if entry.kind == FILE))
+        return entries
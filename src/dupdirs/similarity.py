@@ -0,0 +1,236 @@
+"""
+Near-duplicate and superset directories.
+
+Each directory gets a MinHash signature over the set of (basename, size)
+of all files below it. The signature of a directory is the elementwise
+minimum of the hashes of its own files and the signatures of its
+children, so it is built bottom-up during the scan like the merkle digest
+and does not need the flat file list.
+
+Candidate pairs are found with locality-sensitive hashing: the signature
+is cut into bands, directories that agree in all rows of one band end up
+in the same bucket. Only candidates are compared, the Jaccard similarity
+and the containment of the smaller directory in the larger one are
+estimated from the signatures and the number of files.
+
+Directories with the same digest are exact duplicates, only the first of
+them takes part. A directory that has all its files in a single child
+stands for that child. Pairs where one directory is inside the other,
+and pairs whose parents are a similar pair already, are not reported.
+"""
+
+from __future__ import print_function
+
+from array import array
+import os
+import random
+import zlib
+
+from duplicate_set import is_inside
+from stats import Stats
+
+NUM_PERM = 64
+#: hashes are (a * x + b) % PRIME, small enough to stay plain ints
+PRIME = (1 << 31) - 1
+MAX_HASH = PRIME
+#: hashes of so many (name, size) are kept, copies share most of them
+CACHE_SIZE = 1 << 16
+#: buckets with more directories are skipped (quadratic number of pairs)
+MAX_BUCKET = 100
+#: supersets are looked for up to this ratio of the numbers of files
+SUPERSET_RATIO = 1.5
+
+
+def _bytes(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8', 'surrogateescape')
+    return text
+
+
+class MinHash(object):
+    """Build signatures (arrays of num_perm 31 bit values)."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.perms = [(rng.randint(1, PRIME - 1), rng.randint(0, PRIME - 1))
+                      for _idx in range(num_perm)]
+        self._cache = {}
+
+    def _hashes(self, name, size):
+        hashes = self._cache.get((name, size))
+        if hashes is None:
+            x = zlib.crc32(_bytes('%s\0%s' % (name, size))) % PRIME
+            hashes = [(a * x + b) % PRIME for a, b in self.perms]
+            if len(self._cache) >= CACHE_SIZE:
+                self._cache.clear()
+            self._cache[name, size] = hashes
+        return hashes
+
+    def signature(self, files, children):
+        """
+        Return the signature of a directory with files (list of (name, size))
+        and children (list of signatures).
+        """
+        vectors = [self._hashes(name, size) for name, size in files]
+        vectors.extend(children)
+        if not vectors:
+            return array('I', [MAX_HASH]) * self.num_perm
+        if len(vectors) == 1:
+            return array('I', vectors[0])
+        return array('I', map(min, *vectors))
+
+
+def lsh_bands(num_perm, threshold):
+    """
+    Return (bands, rows) for a signature of num_perm values (the last
+    num_perm % rows values are not used for buckets).
+
+    The probability that a pair with similarity s becomes a candidate is
+    1 - (1 - s**rows)**bands, the steepest point of that curve is at about
+    (1 / bands)**(1 / rows). Take the highest one that is not above
+    threshold, missing pairs is worse than a few more candidates.
+    """
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1)]
+    below = [option for option in options
+             if (1.0 / option[0]) ** (1.0 / option[1]) <= threshold]
+    return max(below or options[:1], key=lambda option: (1.0 / option[0]) ** (1.0 / option[1]))
+
+
+def estimate(sig_a, sig_b, num_files_a, num_files_b):
+    """
+    Return (jaccard similarity, containment of the smaller directory in the
+    larger one), estimated from signatures and the number of files.
+    """
+    jaccard = sum(1 for x, y in zip(sig_a, sig_b) if x == y) / float(len(sig_a))
+    smaller = min(num_files_a, num_files_b)
+    # |A n B| = J * (|A| + |B|) / (1 + J)
+    common = jaccard * (num_files_a + num_files_b) / (1 + jaccard)
+    return jaccard, min(common / smaller, 1.0)
+
+
+def find_similar(dirs, threshold, min_size=0, stats=None, max_bucket=MAX_BUCKET):
+    """
+    Return SimilaritySets for all pairs of dirs with a jaccard similarity or
+    containment of at least threshold, most similar first.
+
+    dirs need path, size, num_files, digest and signature.
+    """
+    if stats is None:
+        stats = Stats()
+    count = stats.count
+    # one representative per digest, digest of each path for the parent check
+    reps = []
+    seen = set()
+    digest_by_path = {}
+    num_files_by_path = {}
+    for item in dirs:
+        if not item.num_files or item.size < min_size:
+            continue
+        path = os.path.normpath(item.path)
+        digest = item.digest
+        digest_by_path[path] = digest
+        num_files_by_path[path] = item.num_files
+        if num_files_by_path.get(os.path.dirname(path)) == item.num_files:
+            # all files of the parent are in here, the parent stands for both
+            continue
+        if digest not in seen:
+            seen.add(digest)
+            reps.append(item)
+    del seen, num_files_by_path
+    count('similar', 'directories', len(reps))
+    if not reps:
+        return []
+
+    num_perm = len(reps[0].signature)
+    # jaccard similarity of a superset with SUPERSET_RATIO times the files
+    # of a directory it contains threshold of
+    bands, rows = lsh_bands(num_perm, threshold / (1 + SUPERSET_RATIO - threshold))
+    candidates = set()
+    # one band at a time, so only one set of buckets is in memory
+    for band in range(bands):
+        start = band * rows
+        buckets = {}
+        for idx, item in enumerate(reps):
+            key = hash(tuple(item.signature[start:start + rows]))
+            buckets.setdefault(key, []).append(idx)
+        for bucket in buckets.values():
+            if len(bucket) < 2:
+                continue
+            if len(bucket) > max_bucket:
+                count('similar', 'large buckets skipped')
+                continue
+            for pos, a in enumerate(bucket):
+                for b in bucket[pos + 1:]:
+                    candidates.add((a, b))
+        del buckets
+    count('similar', 'candidates', len(candidates))
+
+    found = {}
+    for a, b in candidates:
+        item_a, item_b = reps[a], reps[b]
+        if is_inside(item_a.path, item_b.path) or is_inside(item_b.path, item_a.path):
+            continue
+        jaccard, containment = estimate(item_a.signature, item_b.signature,
+                                        item_a.num_files, item_b.num_files)
+        if jaccard >= threshold:
+            kind, score = 'similar', jaccard
+        elif containment >= threshold and item_a.num_files != item_b.num_files:
+            kind, score = 'superset', containment
+        else:
+            continue
+        # larger directory first
+        if (item_b.num_files, item_b.size) > (item_a.num_files, item_a.size):
+            item_a, item_b = item_b, item_a
+        found[frozenset((item_a.digest, item_b.digest))] = SimilaritySet(
+            kind, score, [item_a, item_b])
+
+    def parent_digest(item):
+        return digest_by_path.get(os.path.dirname(os.path.normpath(item.path)))
+
+    result = []
+    for ss in found.values():
+        parents = frozenset(parent_digest(item) for item in ss.items)
+        if len(parents) == 2 and parents in found:
+            # nested in a similar pair
+            continue
+        result.append(ss)
+    count('similar', 'sets', len(result))
+    result.sort(key=lambda ss: (-ss.score, -ss.items[0].size, ss.items[0].path))
+    return result
+
+
+class SimilaritySet(object):
+    """
+    Two directories that are similar, or where the first one contains
+    most of the second one (kind 'superset').
+
+    Output looks like a DuplicateSet, but all items are marked [keep]:
+    similar directories are never deleted in interactive mode.
+    """
+
+    def __init__(self, kind, score, items):
+        self.kind = kind
+        self.score = score
+        self.items = items
+
+    def __str__(self):
+        label = '%s %.2f' % (self.kind, self.score)
+        s = ['', '#similarity set [%s] %s directories %s bytes %s files' % (
+            label, len(self.items),
+            ' / '.join(str(item.size) for item in self.items),
+            ' / '.join(str(item.num_files) for item in self.items))]
+        for item in self.items:
+            s.append('[keep]("%s")' % item.path)
+        s.append('#/similarity set [%s]' % label)
+        return '\n'.join(s)
+
+    def as_record(self):
+        """Return the set as a dict for the jsonl format (see resultformat)."""
+        return {
+            'type': 'similarity set',
+            'kind': self.kind,
+            'score': round(self.score, 4),
+            'items': [{'cmd': 'keep', 'path': item.path, 'size': item.size,
+                       'num_files': item.num_files} for item in self.items],
+        }
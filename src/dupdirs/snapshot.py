@@ -0,0 +1,147 @@
+"""
+Scan snapshots, to find duplicates across machines.
+
+Each machine scans its own disks and exports a snapshot (--export), the
+snapshots are merged on one machine (--merge) without scanning again.
+
+A snapshot is a gzip file: one line of JSON with the host and all
+settings that change digests, followed by one binary entry per directory
+(see extsort.pack_entry):
+
+    {"format": "dupdirs snapshot", "version": 1, "host": "fileserver1",
+     "roots": [hex encoded paths], "digest_mode": "flat", "hash": "md5",
+     "mtime": false, "filters": "..."}
+
+Only snapshots with the same settings can be merged. Paths from other
+hosts are shown as host:path.
+"""
+
+from __future__ import print_function
+
+import binascii
+import json
+
+from duplicate_set import group_duplicates
+from extsort import decode_path, encode_path, order_key, pack_entry, read_entry
+from hashing import DEFAULT_HASH
+
+FORMAT = 'dupdirs snapshot'
+FORMAT_VERSION = 1
+#: header fields that must be the same in all merged snapshots
+SETTINGS = ('digest_mode', 'hash', 'mtime', 'filters')
+
+
+class SnapshotError(Exception):
+    """Raised for snapshots that can not be read or merged."""
+
+
+class SnapshotDir(object):
+    """A directory read from a snapshot, used instead of a DirTree."""
+    __slots__ = ('source', 'local_path', 'path', 'size', 'num_files', 'inode_sum', 'digest')
+
+    def __init__(self, source, host, local_path, path, size, num_files, inode_sum, digest):
+        #: (index of the snapshot, its roots)
+        self.source = source
+        #: path on host
+        self.local_path = local_path
+        self.path = path
+        self.size = size
+        self.num_files = num_files
+        # inode numbers of different hosts have nothing in common
+        self.inode_sum = (host, inode_sum)
+        self.digest = digest
+
+    def order_key(self):
+        """Position in a serial scan of all snapshots."""
+        return (self.source[0],) + order_key(self.local_path, self.source[1])
+
+    def __str__(self):
+        return 'size: %s\t files: %s \t%s' % (self.size, self.num_files, self.path)
+
+
+def export(path, dirs, roots, digest_mode, mtime, filters=None, hash_name=DEFAULT_HASH):
+    """Write all dirs (in scan order) to a snapshot, return the number of dirs."""
+    import gzip
+    import socket
+    head = {
+        'format': FORMAT,
+        'version': FORMAT_VERSION,
+        'host': socket.gethostname(),
+        'roots': [binascii.hexlify(encode_path(root)).decode('ascii') for root in roots],
+        'digest_mode': digest_mode,
+        'hash': hash_name,
+        'mtime': mtime,
+        'filters': filters.fingerprint() if filters else '',
+    }
+    count = 0
+    with gzip.open(path, 'wb') as f:
+        f.write(json.dumps(head, sort_keys=True).encode('utf-8') + b'\n')
+        for item in dirs:
+            f.write(pack_entry(item))
+            count += 1
+    return count
+
+
+def _read_header(f, path):
+    try:
+        head = json.loads(f.readline().decode('utf-8'))
+    except (IOError, ValueError):
+        raise SnapshotError('not a dupdirs snapshot: %s' % path)
+    if not isinstance(head, dict) or head.get('format') != FORMAT:
+        raise SnapshotError('not a dupdirs snapshot: %s' % path)
+    if head.get('version', 0) > FORMAT_VERSION:
+        raise SnapshotError('unsupported snapshot version %s: %s' % (head['version'], path))
+    # str, digests are mixed with paths
+    head['hash'] = str(head.get('hash', DEFAULT_HASH))
+    return head
+
+
+def read_snapshot(path, index=0):
+    """Return the header of a snapshot and a generator of its SnapshotDirs."""
+    import gzip
+    import socket
+    f = gzip.open(path, 'rb')
+    head = _read_header(f, path)
+    host = head['host']
+    source = (index, [decode_path(binascii.unhexlify(root)) for root in head['roots']])
+    prefix = '' if host == socket.gethostname() else host + ':'
+
+    def dirs():
+        with f:
+            while True:
+                entry = read_entry(f, head['hash'])
+                if entry is None:
+                    return
+                digest, size, num_files, inode_sum, dir_path = entry
+                yield SnapshotDir(source, host, dir_path, prefix + dir_path if prefix else dir_path,
+                                  size, num_files, inode_sum, digest)
+    return head, dirs()
+
+
+def merge(paths, min_size=0, stats=None):
+    """
+    Return the DuplicateSets of all directories in the snapshots paths,
+    like group_duplicates() after scanning all roots of all snapshots.
+    """
+    snapshots = [read_snapshot(path, idx) for idx, path in enumerate(paths)]
+    first = snapshots[0][0] if snapshots else {}
+    for path, (head, _dirs) in zip(paths, snapshots):
+        for setting in SETTINGS:
+            if head.get(setting) != first.get(setting):
+                raise SnapshotError('%s: %s differs from %s, snapshots can not be merged'
+                                    % (path, setting, paths[0]))
+
+    def all_dirs():
+        for head, dirs in snapshots:
+            for item in dirs:
+                if stats is not None:
+                    stats.count('merge', 'directories')
+                yield item
+            if stats is not None:
+                stats.count('merge', 'snapshots')
+    # snapshots written with --memory-limit are not in scan order
+    sets = group_duplicates(all_dirs(), min_size)
+    for ds in sets:
+        ds.items.sort(key=SnapshotDir.order_key)
+    sets.sort(key=lambda ds: ds.items[0].order_key())
+    return sets
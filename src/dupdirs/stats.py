@@ -0,0 +1,123 @@
+
+from __future__ import print_function
+
+from collections import defaultdict
+from contextlib import contextmanager
+from timeit import default_timer
+import json
+import sys
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """Return peak resident set size of this process in KB (or None if unknown)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes instead of KB
+        rss //= 1024
+    return rss
+
+
+class Stats(object):
+    """
+    Timers and counters for the different phases of a run (scan, filecmp, ...).
+
+    Counters are used for syscalls and amounts of work, e.g.
+    stats.count('scan', 'stat'), counting is thread safe. Timers add up
+    the wall time spent in a phase:
+
+        with stats.timer('scan'):
+            ...
+
+    running() and values() may be called from other threads while the
+    phases run (see progress).
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(lambda: defaultdict(int))
+        #: seconds per phase
+        self.timers = {}
+        #: phases of timers in order of first use
+        self.timer_order = []
+        #: (phase, start) of running timers, innermost last
+        self._running = []
+        self._lock = threading.Lock()
+
+    def count(self, phase, name, n=1):
+        with self._lock:
+            self.counters[phase][name] += n
+
+    def set(self, phase, name, value):
+        """Set a value that is not a counter (e.g. memory usage)."""
+        with self._lock:
+            self.counters[phase][name] = value
+
+    def get(self, phase, name):
+        """Return counter name of phase, 0 if it was never counted (adds nothing)."""
+        with self._lock:
+            return self.counters.get(phase, {}).get(name, 0)
+
+    def values(self, phase):
+        """Return a copy of the counters of phase."""
+        with self._lock:
+            return dict(self.counters.get(phase, {}))
+
+    def running(self):
+        """
+        Return (phase, seconds) of the innermost running timer or None,
+        seconds of a phase timed in several parts (e.g. once per set) add
+        up all parts so far.
+        """
+        with self._lock:
+            if not self._running:
+                return None
+            phase, start = self._running[-1]
+            return phase, self.timers.get(phase, 0.0) + default_timer() - start
+
+    @contextmanager
+    def timer(self, phase):
+        start = default_timer()
+        with self._lock:
+            self._running.append((phase, start))
+        try:
+            yield
+        finally:
+            elapsed = default_timer() - start
+            with self._lock:
+                self._running.remove((phase, start))
+                if phase not in self.timers:
+                    self.timers[phase] = 0.0
+                    self.timer_order.append(phase)
+                self.timers[phase] += elapsed
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'timers': dict(self.timers),
+                'timer_order': list(self.timer_order),
+                'counters': dict((phase, dict(counters)) for phase, counters in self.counters.items()),
+            }
+
+    def write(self, path):
+        """Write timers and counters to path as JSON."""
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+
+    def report(self):
+        """Return timers and counters as a list of lines, counters sorted by phase and name."""
+        data = self.as_dict()
+        lines = []
+        for phase in data['timer_order']:
+            lines.append('time %s: %.3fs' % (phase, data['timers'][phase]))
+        for phase, counters in sorted(data['counters'].items()):
+            lines.append('%s:' % phase)
+            for name in sorted(counters):
+                lines.append('    %s: %s' % (name, counters[name]))
+        return lines
@@ -0,0 +1,255 @@
+"""
+Structural verification of duplicate sets (--dircmp).
+
+filecmp.dircmp lists both folders of every pair again and only reports
+funny files on the top level. StructureVerifier compares all copies of a
+set at once, recursively:
+
+- paths and sizes of all files (directories without files are ignored,
+  like in the digests)
+- funny entries: symlinks, special files and entries that can't be read
+- number of files and bytes against the scan data of each copy, so
+  copies that changed since the scan are reported as well
+
+With the factory of the scan, every directory is checked against the
+entries the scan read there (Factory.scanned_names) with one lstat per
+entry. Directories without scanned entries (--compact, --memory-limit keep
+none) and directories whose mtime changed since the scan (entries added,
+removed or renamed) are listed again. Like in the scan, entries excluded
+by its filters are ignored, and so are directories on other devices with
+one_file_system and directories the scan read under another path.
+
+The listings are cached and shared by all sets (nested sets and copies
+that are checked again cost nothing), up to MAX_CACHED_ENTRIES entries,
+the least recently used listings are dropped first.
+
+Sets are checked in parallel on a thread pool with map(), in the order
+of the sets. Counters go to stats (phase 'dircmp').
+"""
+
+from __future__ import print_function
+
+from collections import OrderedDict, namedtuple
+import os
+import stat
+import threading
+
+from stats import Stats
+
+FILE = 'file'
+#: differences reported per set and kind, the rest is counted
+MAX_REPORTED = 10
+#: entries of all cached listings (a few 10 MB)
+MAX_CACHED_ENTRIES = 250000
+
+#: entries of one directory: files (name -> size), dirs (name -> (device,
+#: mtime)), funny (name -> reason), device of the directory
+Listing = namedtuple('Listing', 'files dirs funny dev')
+
+
+def _funny_reason(mode):
+    if stat.S_ISLNK(mode):
+        return 'symlink'
+    if stat.S_ISFIFO(mode):
+        return 'fifo'
+    if stat.S_ISSOCK(mode):
+        return 'socket'
+    if stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+        return 'device'
+    return 'special file'
+
+
+def _num_entries(listing):
+    return len(listing.files) + len(listing.dirs) + len(listing.funny) + 1
+
+
+def _shorten(paths):
+    """Return the first MAX_REPORTED of paths, with a note about the rest."""
+    paths = sorted(paths)
+    if len(paths) > MAX_REPORTED:
+        return '%s ... (%s more)' % (', '.join(paths[:MAX_REPORTED]), len(paths) - MAX_REPORTED)
+    return ', '.join(paths)
+
+
+class StructureVerifier(object):
+    """
+    Verify the structure of DuplicateSets (see DuplicateSet.dircmp),
+    filters and one_file_system as in the scan, against the entries read
+    by the scan with its factory (without, everything is listed).
+    """
+
+    def __init__(self, jobs=1, stats=None, filters=None, one_file_system=False, factory=None):
+        if stats is None:
+            stats = Stats()
+        self.stats = stats
+        self.filters = filters or None
+        self.one_file_system = one_file_system
+        self.factory = factory
+        self.pool = None
+        if jobs > 1:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(jobs)
+        # path -> Listing, least recently used first
+        self._listings = OrderedDict()
+        self._cached_entries = 0
+        self._lock = threading.Lock()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def map(self, sets, phase=None):
+        """
+        Run dircmp() with this verifier on all sets, yield the sets in
+        their order. With a pool, sets are checked ahead of the consumer.
+        With phase, the time until each set is ready goes to that timer.
+        """
+        if self.pool is None:
+            results = (self._check_set(ds) for ds in sets)
+        else:
+            results = self.pool.imap(self._check_set, sets)
+        while True:
+            if phase is None:
+                ds = next(results, None)
+            else:
+                with self.stats.timer(phase):
+                    ds = next(results, None)
+            if ds is None:
+                return
+            yield ds
+
+    def _check_set(self, ds):
+        ds.dircmp(self)
+        return ds
+
+    def _list(self, path, dev=None, mtime=None):
+        """
+        Return the Listing of directory path (on device dev with mtime, if
+        known from the listing of its parent), raise OSError if it can't
+        be read.
+        """
+        with self._lock:
+            listing = self._listings.pop(path, None)
+            if listing is not None:
+                self._listings[path] = listing
+        count = self.stats.count
+        if listing is not None:
+            count('dircmp', 'cache hits')
+            return listing
+        if dev is None:
+            count('dircmp', 'lstat')
+            st = os.lstat(path)
+            dev, mtime = st.st_dev, st.st_mtime
+        scanned = None if self.factory is None else self.factory.scanned_names(path)
+        if scanned is not None and scanned[0] == mtime:
+            count('dircmp', 'directories from the scan')
+            names = scanned[1]
+        else:
+            # not scanned, or entries were added, removed or renamed since
+            count('dircmp', 'listdir')
+            names = os.listdir(path)
+        files, dirs, funny = {}, {}, {}
+        filters = self.filters
+        for name in names:
+            fp = os.path.join(path, name)
+            count('dircmp', 'lstat')
+            try:
+                st = os.lstat(fp)
+            except OSError as e:
+                funny[name] = e.strerror
+                continue
+            is_dir = stat.S_ISDIR(st.st_mode)
+            if filters and not filters.accept(fp, name, is_dir):
+                continue
+            if stat.S_ISREG(st.st_mode):
+                if filters and not filters.accept_size(st.st_size):
+                    continue
+                files[name] = st.st_size
+            elif is_dir:
+                if self.factory is not None and not self.factory.dirs.read_under(st.st_dev, st.st_ino, fp):
+                    # bind mount or hardlinked directory, skipped by the scan
+                    continue
+                dirs[name] = (st.st_dev, st.st_mtime)
+            else:
+                funny[name] = _funny_reason(st.st_mode)
+        listing = Listing(files, dirs, funny, dev)
+        self._cache(path, listing)
+        return listing
+
+    def _cache(self, path, listing):
+        with self._lock:
+            # another thread may have listed path as well
+            old = self._listings.pop(path, None)
+            if old is not None:
+                self._cached_entries -= _num_entries(old)
+            self._listings[path] = listing
+            self._cached_entries += _num_entries(listing)
+            while self._cached_entries > MAX_CACHED_ENTRIES and len(self._listings) > 1:
+                _path, old = self._listings.popitem(last=False)
+                self._cached_entries -= _num_entries(old)
+                self.stats.count('dircmp', 'cache evictions')
+
+    def entries(self, path):
+        """
+        Return {relative path: (type, size)} of all files and funny entries
+        below path, type is FILE or the reason why the entry is funny.
+        """
+        result = {}
+        stack = [('', self._list(path))]
+        while stack:
+            prefix, listing = stack.pop()
+            for name, size in listing.files.items():
+                result[prefix + name] = (FILE, size)
+            for name, reason in listing.funny.items():
+                result[prefix + name] = (reason, None)
+            for name, (dev, mtime) in listing.dirs.items():
+                rel = prefix + name
+                if self.one_file_system and dev != listing.dev:
+                    continue
+                try:
+                    stack.append((rel + os.sep, self._list(os.path.join(path, rel), dev, mtime)))
+                except OSError as e:
+                    result[rel] = (e.strerror, None)
+        return result
+
+    def check(self, items):
+        """Return a list of messages for the copies items (empty if they are identical)."""
+        count = self.stats.count
+        count('dircmp', 'sets')
+        messages = []
+        listings = []
+        for item in items:
+            try:
+                entries = self.entries(item.path)
+            except OSError as e:
+                messages.append('-->can\'t read %s: %s' % (item.path, e.strerror))
+                continue
+            listings.append((item, entries))
+            funny = [rel for rel, (kind, _size) in entries.items() if kind != FILE]
+            if funny:
+                count('dircmp', 'funny files', len(funny))
+                messages.append('-->funny files in %s: %s' % (item.path, _shorten(
+                    '%s (%s)' % (rel, entries[rel][0]) for rel in funny)))
+            sizes = [size for kind, size in entries.values() if kind == FILE]
+            if (len(sizes), sum(sizes)) != (item.num_files, item.size):
+                count('dircmp', 'changed since scan')
+                messages.append('-->changed since the scan: %s (%s files, %s bytes, scanned: %s files, %s bytes)'
+                                % (item.path, len(sizes), sum(sizes), item.num_files, item.size))
+        if listings:
+            first, expected = listings[0]
+            for item, entries in listings[1:]:
+                missing = set(expected) - set(entries)
+                extra = set(entries) - set(expected)
+                different = [rel for rel in set(expected) & set(entries) if expected[rel] != entries[rel]]
+                if missing:
+                    messages.append('-->missing in %s: %s' % (item.path, _shorten(missing)))
+                if extra:
+                    messages.append('-->only in %s: %s' % (item.path, _shorten(extra)))
+                if different:
+                    messages.append('-->type or size differs: %s %s: %s' % (
+                        first.path, item.path, _shorten(different)))
+                if missing or extra or different:
+                    count('dircmp', 'copies different')
+        return messages
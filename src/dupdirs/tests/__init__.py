@@ -0,0 +1,39 @@
+"""
+Tests of dupdirs, run from src with:
+
+    python -m unittest discover -s dupdirs/tests -t .
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TempDirTestCase(unittest.TestCase):
+    """TestCase with a temporary directory self.tmp, removed after each test."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='dupdirs-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def path(self, *names):
+        return os.path.join(self.tmp, *names)
+
+    def make_file(self, rel, data):
+        """Create file rel (below self.tmp) with data, return its path."""
+        path = self.path(rel)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def make_folder(self, rel, files):
+        """Create folder rel with files {relative path: data}, return its path."""
+        for name, data in files.items():
+            self.make_file(os.path.join(rel, name), data)
+        return self.path(rel)
@@ -0,0 +1,37 @@
+from dupdirs.api import scan
+from dupdirs.tests import TempDirTestCase
+
+
+def results(roots, **options):
+    """Return (size, paths) of all sets scan() yields, in order."""
+    return [(ds.size, [item.path for item in ds.items]) for ds in scan(roots, **options)]
+
+
+class JobsTest(TempDirTestCase):
+
+    def setUp(self):
+        super(JobsTest, self).setUp()
+        # eight sets (sizes differ), the roots are not duplicates
+        for root in ('r1', 'r2'):
+            for idx in range(8):
+                files = {'f': b'x' * (idx % 3 + 1), 'sub%s/g' % (idx % 2): b'y' * (idx + 1)}
+                self.make_folder('%s/d%s' % (root, idx), files)
+        self.make_file('r2/extra', b'z')
+
+    def check_jobs(self, **options):
+        roots = [self.path('r1'), self.path('r2')]
+        expected = results(roots, **options)
+        # scan order
+        self.assertEqual([paths for _size, paths in expected],
+                         [[self.path(root, 'd%s' % idx) for root in ('r1', 'r2')] for idx in range(8)])
+        for jobs in (2, 4):
+            self.assertEqual(results(roots, jobs=jobs, **options), expected)
+
+    def test_jobs_give_the_same_order(self):
+        self.check_jobs()
+
+    def test_jobs_give_the_same_order_compact(self):
+        self.check_jobs(compact=True)
+
+    def test_jobs_give_the_same_order_merkle(self):
+        self.check_jobs(digest_mode='merkle')
@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from dupdirs.deletion import DeletionEngine, Journal, set_key
+from dupdirs.duplicate_set import ShallowDuplicateSet
+from dupdirs.tests import TempDirTestCase
+
+FILES = {'a.txt': b'alpha', 'sub/b.txt': b'beta'}
+
+
+def make_set(items, digest='d1', kind='duplicate'):
+    """Return a ShallowDuplicateSet of (command, path) items."""
+    ds = ShallowDuplicateSet(len(items), 2, digest, '9', kind)
+    for cmd, path in items:
+        ds.add(cmd, path)
+    return ds
+
+
+class SlowSet(ShallowDuplicateSet):
+    """Set that waits after its checks, so sets running at the same time overtake it."""
+
+    def process(self, commit=False, journal=None, verifier=None):
+        time.sleep(0.2)
+        return super(SlowSet, self).process(commit, journal, verifier)
+
+
+class ProcessTest(TempDirTestCase):
+
+    def test_dry_run(self):
+        keep = self.make_folder('keep', FILES)
+        copy = self.make_folder('copy', FILES)
+        ds = make_set([('keep', keep), ('delete', copy)])
+        self.assertEqual(ds.process(), [])
+        self.assertTrue(os.path.isdir(copy))
+        self.assertIn('dry-run: deleting %s' % copy, ds.log)
+
+    def test_commit_delete(self):
+        keep = self.make_folder('keep', FILES)
+        copy = self.make_folder('copy', FILES)
+        ds = make_set([('keep', keep), ('delete', copy)])
+        self.assertEqual(ds.process(commit=True), [('delete', copy)])
+        self.assertFalse(os.path.exists(copy))
+        self.assertTrue(os.path.isfile(os.path.join(keep, 'sub', 'b.txt')))
+
+    def test_commit_hardlink(self):
+        keep = self.make_folder('keep', FILES)
+        copy = self.make_folder('copy', FILES)
+        ds = make_set([('keep', keep), ('hardlink', copy)])
+        self.assertEqual(ds.process(commit=True), [('hardlink', copy)])
+        self.assertTrue(os.path.samefile(os.path.join(keep, 'a.txt'), os.path.join(copy, 'a.txt')))
+
+    def test_missing_folder_ignores_set(self):
+        keep = self.make_folder('keep', FILES)
+        copy = self.make_folder('copy', FILES)
+        ds = make_set([('keep', keep), ('delete', copy), ('delete', self.path('gone'))])
+        self.assertIsNone(ds.process(commit=True))
+        self.assertTrue(os.path.isdir(copy))
+
+    def test_must_keep_one(self):
+        copy1 = self.make_folder('copy1', FILES)
+        copy2 = self.make_folder('copy2', FILES)
+        ds = make_set([('delete', copy1), ('delete', copy2)])
+        self.assertIsNone(ds.process(commit=True))
+        self.assertTrue(os.path.isdir(copy1))
+        self.assertTrue(os.path.isdir(copy2))
+
+    def test_errors_ignore_set(self):
+        keep = self.make_folder('keep', FILES)
+        copy = self.make_folder('copy', FILES)
+        ds = make_set([('keep', keep), ('delete', copy)])
+        ds.add_error('folders differ')
+        self.assertIsNone(ds.process(commit=True))
+        self.assertTrue(os.path.isdir(copy))
+
+    def test_delete_file(self):
+        keep = self.make_file('keep.txt', b'data')
+        copy = self.make_file('dir/copy.txt', b'data')
+        ds = make_set([('keep', keep), ('delete', copy)], kind='file')
+        self.assertEqual(ds.process(commit=True), [('delete', copy)])
+        self.assertFalse(os.path.exists(copy))
+        self.assertTrue(os.path.isdir(self.path('dir')))
+        self.assertTrue(os.path.isfile(keep))
+
+
+class DeletionEngineTest(TempDirTestCase):
+
+    def setUp(self):
+        super(DeletionEngineTest, self).setUp()
+        # the engine prints the log of every set
+        self._stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        sys.stdout = self._stdout
+        super(DeletionEngineTest, self).tearDown()
+
+    def run_engine(self, sets, commit=True, jobs=1):
+        """Process sets with a new engine and journal, return the engine stats."""
+        engine = DeletionEngine(commit=commit, jobs=jobs, journal=Journal(self.path('journal')))
+        for ds in sets:
+            engine.submit(ds)
+        engine.close()
+        return engine.stats
+
+    def test_resume_skips_done_sets(self):
+        keep = self.make_folder('keep', FILES)
+        copy = self.make_folder('copy', FILES)
+        stats = self.run_engine([make_set([('keep', keep), ('delete', copy)])])
+        self.assertEqual(stats.get('delete', 'sets'), 1)
+        self.assertEqual(stats.get('delete', 'folders deleted'), 1)
+        self.assertFalse(os.path.exists(copy))
+        stats = self.run_engine([make_set([('keep', keep), ('delete', copy)])])
+        self.assertEqual(stats.get('delete', 'sets'), 0)
+        self.assertEqual(stats.get('delete', 'sets skipped (journal)'), 1)
+
+    def test_changed_set_is_not_skipped(self):
+        keep = self.make_folder('keep', FILES)
+        copy = self.make_folder('copy', FILES)
+        self.run_engine([make_set([('keep', keep), ('keep', copy)])])
+        # same digest, other commands (e.g. a regenerated result file)
+        stats = self.run_engine([make_set([('keep', keep), ('delete', copy)])])
+        self.assertEqual(stats.get('delete', 'sets skipped (journal)'), 0)
+        self.assertFalse(os.path.exists(copy))
+
+    def test_resume_after_interruption(self):
+        keep = self.make_folder('keep', FILES)
+        copy1 = self.make_folder('copy1', FILES)
+        copy2 = self.make_folder('copy2', FILES)
+        # interrupted after the first folder of the set was deleted
+        journal = Journal(self.path('journal'))
+        os.rename(copy1, self.path('trash'))
+        journal.deleted(copy1)
+        journal.close()
+        ds = make_set([('keep', keep), ('delete', copy1), ('delete', copy2)])
+        stats = self.run_engine([ds])
+        self.assertEqual(stats.get('delete', 'sets'), 1)
+        self.assertEqual(stats.get('delete', 'folders deleted'), 1)
+        self.assertFalse(os.path.exists(copy2))
+        self.assertTrue(Journal(self.path('journal')).is_done(set_key(ds)))
+
+    def test_ignored_set_is_not_journaled(self):
+        keep = self.make_folder('keep', FILES)
+        copy = self.make_folder('copy', FILES)
+        ds = make_set([('keep', keep), ('delete', copy), ('delete', self.path('gone'))])
+        stats = self.run_engine([ds])
+        self.assertEqual(stats.get('delete', 'sets'), 0)
+        self.assertEqual(stats.get('delete', 'sets ignored'), 1)
+        self.assertFalse(Journal(self.path('journal')).is_done(set_key(ds)))
+        # the set is tried again once it is valid
+        os.mkdir(self.path('gone'))
+        stats = self.run_engine([make_set([('keep', keep), ('delete', copy), ('delete', self.path('gone'))])])
+        self.assertEqual(stats.get('delete', 'folders deleted'), 2)
+
+    def test_dry_run_is_not_journaled(self):
+        keep = self.make_folder('keep', FILES)
+        copy = self.make_folder('copy', FILES)
+        ds = make_set([('keep', keep), ('delete', copy)])
+        self.run_engine([ds], commit=False)
+        self.assertTrue(os.path.isdir(copy))
+        self.assertFalse(Journal(self.path('journal')).is_done(set_key(ds)))
+
+    def test_parallel_output_in_input_order(self):
+        sets = []
+        for idx in range(10):
+            keep = self.make_folder('keep%s' % idx, FILES)
+            copy = self.make_folder('copy%s' % idx, FILES)
+            sets.append(make_set([('keep', keep), ('delete', copy)], digest='d%s' % idx))
+        stats = self.run_engine(sets, jobs=3)
+        self.assertEqual(stats.get('delete', 'folders deleted'), 10)
+        output = sys.stdout.getvalue()
+        positions = [output.index('deleting %s\n' % self.path('copy%s' % idx)) for idx in range(10)]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_delete_files(self):
+        keep = self.make_file('keep.txt', b'data')
+        copy = self.make_file('copy.txt', b'data')
+        stats = self.run_engine([make_set([('keep', keep), ('delete', copy)], kind='file')])
+        self.assertEqual(stats.get('delete', 'files deleted'), 1)
+        self.assertEqual(stats.get('delete', 'bytes freed'), 9)
+        self.assertFalse(os.path.exists(copy))
+
+    def test_overlapping_sets_run_one_after_another(self):
+        # A keeps p and deletes x, B keeps x/y and deletes p/y and q/y: run
+        # at the same time, B could delete the copies of y while A deletes x
+        p = self.make_folder('p', {'y/f': b'data'})
+        x = self.make_folder('x', {'y/f': b'data'})
+        q = self.make_folder('q', {'y/f': b'data'})
+        a = SlowSet(2, 1, 'a', '4')
+        a.add('keep', p)
+        a.add('delete', x)
+        b = make_set([('keep', os.path.join(x, 'y')), ('delete', os.path.join(p, 'y')),
+                      ('delete', os.path.join(q, 'y'))], digest='b')
+        stats = self.run_engine([a, b], jobs=2)
+        self.assertEqual(stats.get('delete', 'sets ignored'), 1)
+        self.assertTrue(os.path.isfile(os.path.join(p, 'y', 'f')))
+        self.assertTrue(os.path.isfile(os.path.join(q, 'y', 'f')))
+        self.assertFalse(os.path.exists(x))
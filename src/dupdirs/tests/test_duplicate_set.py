@@ -0,0 +1,80 @@
+from collections import namedtuple
+import unittest
+
+from dupdirs.duplicate_set import DuplicateSet, eliminate_nested, is_inside
+from dupdirs.tests import TempDirTestCase
+
+Item = namedtuple('Item', 'path size num_files')
+
+
+def make_set(*paths):
+    ds = DuplicateSet()
+    for path in paths:
+        ds.add(Item(path, 10, 1))
+    return ds
+
+
+def paths(sets):
+    return [[item.path for item in ds.items] for ds in sets]
+
+
+class IsInsideTest(unittest.TestCase):
+
+    def test_is_inside(self):
+        self.assertTrue(is_inside('/a/foo', '/a/foo'))
+        self.assertTrue(is_inside('/a/foo/bar', '/a/foo'))
+        self.assertTrue(is_inside('/a/foo/', '/a/foo'))
+        self.assertFalse(is_inside('/a/foobar', '/a/foo'))
+        self.assertFalse(is_inside('/a', '/a/foo'))
+
+
+class EliminateNestedTest(unittest.TestCase):
+
+    def test_nested_set_is_dropped(self):
+        sets = [make_set('/a/foo', '/b/foo'), make_set('/a/foo/x', '/b/foo/x'), make_set('/c', '/d')]
+        self.assertEqual(paths(eliminate_nested(sets)), [['/a/foo', '/b/foo'], ['/c', '/d']])
+
+    def test_partly_nested_set_is_kept(self):
+        # only one copy is inside the outer set
+        sets = [make_set('/a/foo', '/b/foo'), make_set('/a/foo/x', '/c/x')]
+        self.assertEqual(len(list(eliminate_nested(sets))), 2)
+
+    def test_prefix_is_not_a_parent(self):
+        sets = [make_set('/a/foo', '/b/foo'), make_set('/a/foobar/x', '/b/foobar/x')]
+        self.assertEqual(len(list(eliminate_nested(sets))), 2)
+
+    def test_iterator(self):
+        sets = [make_set('/a/foo', '/b/foo'), make_set('/a/foo/x', '/b/foo/x'), make_set('/c', '/d')]
+        self.assertEqual(paths(eliminate_nested(iter(sets))), [['/a/foo', '/b/foo'], ['/c', '/d']])
+
+
+class Copy(object):
+    """Item of a set with a file list, like a Node."""
+
+    def __init__(self, path, files):
+        self.path = path
+        self.files = files
+        self.size = 10
+        self.num_files = 2
+
+
+class FilecmpTest(TempDirTestCase):
+
+    def test_identical(self):
+        a = self.make_folder('a', {'x': b'1', 'sub/y': b'2'})
+        b = self.make_folder('b', {'x': b'1', 'sub/y': b'2'})
+        ds = DuplicateSet()
+        ds.add(Copy(a, ['x', 'sub/y']))
+        ds.add(Copy(b, ['sub/y', 'x']))
+        self.assertTrue(ds.filecmp())
+
+    def test_different_file_lists(self):
+        # an extra file must not shift the pairs of the other files
+        a = self.make_folder('a', {'b': b'1', 'c': b'2'})
+        b = self.make_folder('b', {'a': b'0', 'b': b'1', 'c': b'2'})
+        ds = DuplicateSet()
+        ds.add(Copy(a, ['b', 'c']))
+        ds.add(Copy(b, ['a', 'b', 'c']))
+        self.assertFalse(ds.filecmp())
+        self.assertFalse([m for m in ds.messages if 'file mismatch' in m])
+        self.assertTrue(ds.messages[0].startswith('-->different files'))
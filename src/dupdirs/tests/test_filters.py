@@ -0,0 +1,70 @@
+import unittest
+
+from dupdirs.api import scan
+from dupdirs.filters import EXCLUDE, INCLUDE, FilterError, Filters, make_filters
+from dupdirs.stats import Stats
+from dupdirs.tests import TempDirTestCase
+
+
+class RuleTest(unittest.TestCase):
+
+    def accepts(self, rules, path, is_dir=False):
+        filters = make_filters(rules)
+        return filters.accept(path, path.rsplit('/', 1)[-1], is_dir)
+
+    def test_name_pattern(self):
+        self.assertFalse(self.accepts([(EXCLUDE, '*.tmp')], '/data/a.tmp'))
+        self.assertTrue(self.accepts([(EXCLUDE, '*.tmp')], '/data/a.tmpx'))
+
+    def test_directory_only(self):
+        self.assertFalse(self.accepts([(EXCLUDE, '.git/')], '/src/.git', is_dir=True))
+        self.assertTrue(self.accepts([(EXCLUDE, '.git/')], '/src/.git'))
+
+    def test_path_patterns(self):
+        self.assertFalse(self.accepts([(EXCLUDE, 'cache/thumbs')], '/home/cache/thumbs'))
+        self.assertTrue(self.accepts([(EXCLUDE, 'cache/thumbs')], '/home/xcache/thumbs'))
+        self.assertFalse(self.accepts([(EXCLUDE, '/data/scratch')], '/data/scratch'))
+        self.assertTrue(self.accepts([(EXCLUDE, '/data/scratch')], '/other/data/scratch'))
+
+    def test_regex(self):
+        self.assertFalse(self.accepts([(EXCLUDE, r're:\.v\d+$')], '/a/b.v12'))
+        self.assertTrue(self.accepts([(EXCLUDE, r're:\.v\d+$')], '/a/b.v12.txt'))
+
+    def test_first_match_decides(self):
+        rules = [(INCLUDE, '*.jpg'), (EXCLUDE, '*')]
+        self.assertTrue(self.accepts(rules, '/a/b.jpg'))
+        self.assertFalse(self.accepts(rules, '/a/b.png'))
+
+    def test_errors(self):
+        self.assertRaises(FilterError, Filters.parse, '* *.tmp')
+        self.assertRaises(FilterError, Filters.parse, '-')
+        self.assertRaises(FilterError, make_filters, [(EXCLUDE, 're:(')])
+
+
+class FilterFileTest(TempDirTestCase):
+
+    def test_read_file(self):
+        path = self.make_file('rules', b'# comment\n\n- *.tmp\n+ keep/\n')
+        filters = make_filters([('file', path)])
+        self.assertEqual([str(rule) for rule in filters.rules], ['- *.tmp', '+ keep/'])
+
+
+class ScanFilterTest(TempDirTestCase):
+
+    def test_excluded_entries_are_not_compared(self):
+        self.make_folder('x', {'a': b'1', 'sub/b': b'2', 'junk.tmp': b'333'})
+        self.make_folder('y', {'a': b'1', 'sub/b': b'2', 'cache/c': b'4'})
+        stats = Stats()
+        [ds] = scan([self.tmp], filters=[(EXCLUDE, '*.tmp'), (EXCLUDE, 'cache/')], stats=stats)
+        self.assertEqual([item.path for item in ds.items], [self.path('x'), self.path('y')])
+        self.assertEqual(stats.get('filter', 'files excluded'), 1)
+        self.assertEqual(stats.get('filter', 'directories excluded'), 1)
+        # cache was never read
+        self.assertEqual(stats.get('scan', 'scandir') + stats.get('scan', 'listdir'), 5)
+
+    def test_min_file_size(self):
+        self.make_folder('x', {'a': b'1', 'big': b'12345'})
+        self.make_folder('y', {'b': b'2', 'big': b'12345'})
+        self.assertEqual(list(scan([self.tmp])), [])
+        [ds] = scan([self.tmp], min_file_size=2)
+        self.assertEqual(ds.num_files, 1)
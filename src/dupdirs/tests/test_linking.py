@@ -0,0 +1,111 @@
+import os
+import stat
+
+from dupdirs.linking import TMP_SUFFIX, _copy_metadata, link_file, link_folder, reflink
+from dupdirs.tests import TempDirTestCase
+
+FILES = {'a.txt': b'alpha', 'sub/b.txt': b'beta' * 100}
+
+
+class LinkFolderTest(TempDirTestCase):
+
+    def test_hardlink(self):
+        source = self.make_folder('source', FILES)
+        target = self.make_folder('target', FILES)
+        linked, errors = link_folder(source, target, 'hardlink')
+        self.assertEqual((linked, errors), (2, []))
+        for name in FILES:
+            self.assertTrue(os.path.samefile(os.path.join(source, name), os.path.join(target, name)))
+        # no temporary files left
+        self.assertEqual(sorted(os.listdir(target)), ['a.txt', 'sub'])
+
+    def test_hardlink_again_links_nothing(self):
+        source = self.make_folder('source', FILES)
+        target = self.make_folder('target', FILES)
+        link_folder(source, target, 'hardlink')
+        self.assertEqual(link_folder(source, target, 'hardlink'), (0, []))
+
+    def test_different_file_is_left_alone(self):
+        source = self.make_folder('source', FILES)
+        target = self.make_folder('target', dict(FILES, **{'a.txt': b'ALPHA'}))
+        linked, errors = link_folder(source, target, 'hardlink')
+        self.assertEqual(linked, 1)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('file mismatch, not linked'))
+        self.assertFalse(os.path.samefile(os.path.join(source, 'a.txt'), os.path.join(target, 'a.txt')))
+        with open(os.path.join(target, 'a.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'ALPHA')
+
+    def test_different_files_link_nothing(self):
+        source = self.make_folder('source', FILES)
+        target = self.make_folder('target', {'a.txt': b'alpha'})
+        linked, errors = link_folder(source, target, 'hardlink')
+        self.assertEqual(linked, 0)
+        self.assertTrue(errors[0].startswith('folders do not contain the same files'))
+        self.assertFalse(os.path.samefile(os.path.join(source, 'a.txt'), os.path.join(target, 'a.txt')))
+
+
+class LinkFileTest(TempDirTestCase):
+
+    def test_hardlink(self):
+        source = self.make_file('a', b'data')
+        target = self.make_file('b', b'data')
+        self.assertEqual(link_file(source, target, 'hardlink'), (1, []))
+        self.assertTrue(os.path.samefile(source, target))
+        self.assertEqual(link_file(source, target, 'hardlink'), (0, []))
+
+    def test_mismatch(self):
+        source = self.make_file('a', b'data')
+        target = self.make_file('b', b'DATA')
+        linked, errors = link_file(source, target, 'hardlink')
+        self.assertEqual(linked, 0)
+        self.assertTrue(errors[0].startswith('file mismatch, not linked'))
+        self.assertFalse(os.path.samefile(source, target))
+
+
+class ReflinkTest(TempDirTestCase):
+
+    def reflink_supported(self):
+        probe = self.make_file('probe', b'data')
+        try:
+            reflink(probe, probe + '.clone')
+        except (IOError, OSError):
+            return False
+        return True
+
+    def test_metadata_of_replaced_file(self):
+        if not self.reflink_supported():
+            self.skipTest('no reflinks on this file system')
+        source = self.make_file('a', b'data')
+        target = self.make_file('b', b'data')
+        os.chmod(target, 0o600)
+        os.utime(target, (1000000000, 1000000000))
+        self.assertEqual(link_file(source, target, 'reflink'), (1, []))
+        st = os.stat(target)
+        self.assertFalse(os.path.samefile(source, target))
+        self.assertEqual(stat.S_IMODE(st.st_mode), 0o600)
+        self.assertEqual(int(st.st_mtime), 1000000000)
+
+    def test_unsupported_leaves_files_alone(self):
+        if self.reflink_supported():
+            self.skipTest('reflinks work on this file system')
+        source = self.make_folder('source', FILES)
+        target = self.make_folder('target', FILES)
+        linked, errors = link_folder(source, target, 'reflink')
+        self.assertEqual(linked, 0)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('reflink failed for'))
+        self.assertEqual(sorted(os.listdir(target)), ['a.txt', 'sub'])
+        self.assertFalse(any(name.endswith(TMP_SUFFIX) for name in os.listdir(os.path.join(target, 'sub'))))
+        with open(os.path.join(target, 'a.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'alpha')
+
+    def test_copy_metadata(self):
+        source = self.make_file('a', b'data')
+        target = self.make_file('b', b'data')
+        os.chmod(source, 0o640)
+        os.utime(source, (1000000000, 1000000000))
+        _copy_metadata(source, target)
+        st = os.stat(target)
+        self.assertEqual(stat.S_IMODE(st.st_mode), 0o640)
+        self.assertEqual(int(st.st_mtime), 1000000000)
@@ -0,0 +1,17 @@
+import os
+
+from dupdirs.dirtree import list_files
+from dupdirs.nodetable import NodeTable
+from dupdirs.tests import TempDirTestCase
+from dupdirs.walker import make_walker
+
+
+class ListFilesTest(TempDirTestCase):
+
+    def test_like_the_scan(self):
+        root = self.make_folder('root', {'a': b'1', 'sub/b': b'2', 'seen/c': b'3'})
+        table = NodeTable(make_walker())
+        # read under another path, e.g. a bind mount
+        st = os.stat(os.path.join(root, 'seen'))
+        table.dirs.visit(st.st_dev, st.st_ino, self.path('elsewhere'))
+        self.assertEqual(sorted(list_files(root, table)), ['a', os.path.join('sub', 'b')])
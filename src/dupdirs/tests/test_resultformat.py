@@ -0,0 +1,74 @@
+import json
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from dupdirs.api import scan
+from dupdirs.resultformat import ResultFormatError, dumps, header, read_events
+from dupdirs.tests import TempDirTestCase
+
+FILES = {'a': b'1', 'sub/b': b'22'}
+
+
+def events(text):
+    """Return the events of result text, without those of blank and other lines."""
+    return [event for event in read_events(StringIO(text)) if event[0] is not None]
+
+
+class RoundTripTest(TempDirTestCase):
+
+    def test_text_and_jsonl_give_the_same_events(self):
+        self.make_folder('x', FILES)
+        # quotes and brackets in a path
+        self.make_folder('y ("q")', FILES)
+        [ds] = scan([self.tmp])
+        ds.messages.append('-->file mismatch: a b')
+        text = str(ds) + '\n'
+        jsonl = header() + '\n' + dumps(ds.as_record()) + '\n'
+        self.assertEqual(events(jsonl), events(text))
+        self.assertEqual([event[0] for event in events(jsonl)],
+                         ['SET_START', 'DUPLICATE', 'DUPLICATE', 'ERROR', 'SET_END'])
+        self.assertEqual([event[1]['path'] for event in events(jsonl) if event[0] == 'DUPLICATE'],
+                         [self.path('x'), self.path('y ("q")')])
+
+    def test_path_that_is_not_utf8(self):
+        if bytes is not str:
+            self.skipTest('python 2 only, paths are bytes')
+        self.make_folder('x', FILES)
+        self.make_folder(b'\xff', FILES)
+        [ds] = scan([self.tmp])
+        line = dumps(ds.as_record())
+        self.assertIn('path_hex', line)
+        paths = [event[1]['path'] for event in events(header() + '\n' + line + '\n')
+                 if event[0] == 'DUPLICATE']
+        self.assertEqual(paths, [self.path('x'), self.path(b'\xff')])
+
+
+class ReadEventsTest(unittest.TestCase):
+
+    record = {'type': 'duplicate set', 'digest': 'd', 'num_duplicates': 2, 'size': 10,
+              'num_files': 1, 'messages': [],
+              'items': [{'cmd': 'keep', 'path': '/a'}, {'cmd': 'delete', 'path': '/b'}]}
+
+    def test_warnings_between_records_are_skipped(self):
+        result = events(header() + '\nWARNING, something\n' + json.dumps(self.record) + '\n')
+        self.assertEqual(len(result), 4)
+
+    def test_similarity_sets_have_no_events(self):
+        record = {'type': 'similarity set', 'kind': 'similar', 'score': 0.9, 'items': []}
+        self.assertEqual(events(header() + '\n' + json.dumps(record) + '\n'), [])
+
+    def test_truncated_record(self):
+        with self.assertRaises(ResultFormatError):
+            events(header() + '\n' + json.dumps(self.record)[:-5] + '\n')
+
+    def test_newer_version(self):
+        with self.assertRaises(ResultFormatError):
+            events('{"format": "dupdirs", "version": 99}\n')
+
+    def test_other_json(self):
+        with self.assertRaises(ResultFormatError):
+            events('{"something": "else"}\n')
@@ -0,0 +1,56 @@
+import os
+import shutil
+
+from dupdirs.api import scan
+from dupdirs.stats import Stats
+from dupdirs.tests import TempDirTestCase
+
+FILES = {'a': b'1', 'sub/b': b'22'}
+
+
+class ScanCacheTest(TempDirTestCase):
+
+    def setUp(self):
+        super(ScanCacheTest, self).setUp()
+        self.make_folder('root/x', FILES)
+        self.make_folder('root/y', FILES)
+        self.cache = self.path('cache.db')
+
+    def scan(self, **options):
+        """Scan root with the cache, return the paths of all sets and the stats."""
+        stats = Stats()
+        sets = scan([self.path('root')], cache=self.cache, stats=stats, **options)
+        return [[item.path for item in ds.items] for ds in sets], stats
+
+    def test_second_scan_hits(self):
+        first, stats = self.scan()
+        self.assertEqual(stats.get('cache', 'miss'), 5)
+        self.assertEqual(stats.get('cache', 'hit'), 0)
+        second, stats = self.scan()
+        self.assertEqual(second, first)
+        self.assertEqual(stats.get('cache', 'miss'), 0)
+        self.assertEqual(stats.get('cache', 'hit'), 5)
+        self.assertEqual(stats.get('cache', 'files skipped'), 4)
+
+    def test_changed_directory_is_read(self):
+        self.scan()
+        self.make_file('root/y/sub/c', b'3')
+        # the mtime may not change within its resolution
+        os.utime(self.path('root', 'y', 'sub'), (1000000000, 1000000000))
+        sets, stats = self.scan()
+        self.assertEqual(sets, [])
+        self.assertEqual(stats.get('cache', 'miss'), 1)
+
+    def test_removed_directory_is_pruned(self):
+        self.scan()
+        shutil.rmtree(self.path('root', 'y'))
+        _sets, stats = self.scan()
+        self.assertEqual(stats.get('cache', 'pruned'), 2)
+        # root changed, x and x/sub did not
+        self.assertEqual(stats.get('cache', 'miss'), 1)
+        self.assertEqual(stats.get('cache', 'hit'), 2)
+
+    def test_other_filters_drop_the_cache(self):
+        self.scan()
+        _sets, stats = self.scan(min_file_size=2)
+        self.assertEqual(stats.get('cache', 'hit'), 0)
@@ -0,0 +1,54 @@
+import socket
+
+from dupdirs.api import build_index, group
+from dupdirs.duplicate_set import eliminate_nested
+from dupdirs.snapshot import SnapshotError, export, merge
+from dupdirs.tests import TempDirTestCase
+
+FILES = {'a': b'1', 'sub/b': b'22', 'sub/c': b'333'}
+
+
+def paths(sets):
+    return [(ds.size, [item.path for item in ds.items]) for ds in eliminate_nested(sets)]
+
+
+class SnapshotTest(TempDirTestCase):
+
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        self.make_folder('r1/x', FILES)
+        self.make_folder('r1/y', {'a': b'1'})
+        self.make_folder('r2/x', FILES)
+        self.make_folder('r2/z', {'a': b'1'})
+
+    def export(self, root, **options):
+        """Scan root and export it, return the path of the snapshot."""
+        index = build_index([self.path(root)], **options)
+        snapshot = self.path(root + '.snapshot')
+        export(snapshot, index.factory.ordered_values(), [self.path(root)], index.digest_mode,
+               options.get('use_mtime', False), index.filters)
+        return snapshot
+
+    def test_merge_like_one_scan(self):
+        snapshots = [self.export('r1'), self.export('r2')]
+        expected = paths(group(build_index([self.path('r1'), self.path('r2')])))
+        self.assertEqual(paths(merge(snapshots)), expected)
+        self.assertEqual(expected[0][1], [self.path('r1', 'x'), self.path('r2', 'x')])
+
+    def test_other_host(self):
+        gethostname = socket.gethostname
+        socket.gethostname = lambda: 'elsewhere'
+        try:
+            other = self.export('r2')
+        finally:
+            socket.gethostname = gethostname
+        items = paths(merge([self.export('r1'), other]))[0][1]
+        self.assertEqual(items, [self.path('r1', 'x'), 'elsewhere:' + self.path('r2', 'x')])
+
+    def test_other_settings(self):
+        snapshots = [self.export('r1'), self.export('r2', digest_mode='merkle')]
+        self.assertRaises(SnapshotError, merge, snapshots)
+
+    def test_not_a_snapshot(self):
+        path = self.make_file('other', b'something else\n')
+        self.assertRaises(SnapshotError, merge, [path])
@@ -0,0 +1,29 @@
+import threading
+import unittest
+
+from dupdirs.stats import Stats
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_get_adds_nothing(self):
+        stats = Stats()
+        self.assertEqual(stats.get('scan', 'files'), 0)
+        self.assertEqual(stats.as_dict()['counters'], {})
+
+    def test_get_while_counting(self):
+        stats = Stats()
+
+        def count():
+            for _idx in range(10000):
+                stats.count('scan', 'files')
+
+        threads = [threading.Thread(target=count) for _idx in range(4)]
+        for thread in threads:
+            thread.start()
+        for idx in range(10000):
+            stats.get('phase%s' % (idx % 10), 'name')
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.get('scan', 'files'), 40000)
+        self.assertEqual(list(stats.as_dict()['counters']), ['scan'])
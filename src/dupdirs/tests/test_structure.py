@@ -0,0 +1,64 @@
+import os
+
+from dupdirs.api import build_index, group
+from dupdirs.dirtree import MerkleDirTree, scan
+from dupdirs.duplicate_set import eliminate_nested, group_duplicates
+from dupdirs.nodetable import NodeTable
+from dupdirs.structure import StructureVerifier
+from dupdirs.tests import TempDirTestCase
+from dupdirs.walker import make_walker
+
+FILES = {'a': b'1', 'sub/b': b'22'}
+
+
+class StructureVerifierTest(TempDirTestCase):
+
+    def check(self, **options):
+        """Scan self.tmp, return the messages of the only set and the verifier."""
+        index = build_index([self.tmp], **options)
+        [ds] = eliminate_nested(group(index))
+        verifier = StructureVerifier(factory=index.factory)
+        return verifier.check(ds.items), verifier
+
+    def test_identical(self):
+        self.make_folder('x', FILES)
+        self.make_folder('y', FILES)
+        messages, verifier = self.check()
+        self.assertEqual(messages, [])
+        self.assertEqual(verifier.stats.get('dircmp', 'listdir'), 0)
+        self.assertEqual(verifier.stats.get('dircmp', 'directories from the scan'), 4)
+
+    def test_not_scanned_is_listed(self):
+        self.make_folder('x', FILES)
+        self.make_folder('y', FILES)
+        messages, verifier = self.check(compact=True)
+        self.assertEqual(messages, [])
+        self.assertEqual(verifier.stats.get('dircmp', 'listdir'), 4)
+
+    def test_changed_since_scan(self):
+        self.make_folder('x', FILES)
+        self.make_folder('y', FILES)
+        index = build_index([self.tmp])
+        [ds] = eliminate_nested(group(index))
+        # added (the directory is listed again) and changed in place
+        self.make_file('y/sub/c', b'3')
+        self.make_file('x/a', b'11')
+        messages = StructureVerifier(factory=index.factory).check(ds.items)
+        self.assertIn('-->changed since the scan: %s (3 files, 4 bytes, scanned: 2 files, 3 bytes)'
+                      % self.path('y'), messages)
+        self.assertIn('-->changed since the scan: %s (2 files, 4 bytes, scanned: 2 files, 3 bytes)'
+                      % self.path('x'), messages)
+        self.assertIn('-->only in %s: %s' % (self.path('y'), os.path.join('sub', 'c')), messages)
+
+    def test_directory_skipped_by_the_scan(self):
+        self.make_folder('x', FILES)
+        self.make_folder('y', dict(FILES, **{'alias/c': b'3'}))
+        factory = NodeTable(make_walker())
+        factory.warn = lambda message: None
+        # as if y/alias was a bind mount of a directory read before
+        st = os.stat(self.path('y', 'alias'))
+        factory.dirs.visit(st.st_dev, st.st_ino, self.path('elsewhere'))
+        scan([self.tmp], factory, MerkleDirTree, False, False)
+        [ds] = eliminate_nested(group_duplicates(factory.ordered_values()))
+        self.assertEqual(StructureVerifier(factory=factory).check(ds.items), [])
+        self.assertNotEqual(StructureVerifier().check(ds.items), [])
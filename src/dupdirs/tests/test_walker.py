@@ -0,0 +1,37 @@
+import os
+
+from dupdirs.tests import TempDirTestCase
+from dupdirs.walker import DIRECTORY, FILE, SYMLINK, WALKERS, make_walker
+
+
+class WalkerTest(TempDirTestCase):
+
+    def setUp(self):
+        super(WalkerTest, self).setUp()
+        self.make_folder('root', {'b.txt': b'beta', 'a.txt': b'alpha', 'sub/c': b''})
+        os.symlink('a.txt', self.path('root', 'link'))
+
+    def test_all_walkers_agree(self):
+        expected = make_walker('listdir').entries(self.path('root'))
+        self.assertEqual([(e.name, e.kind, e.size) for e in expected],
+                         [('a.txt', FILE, 5), ('b.txt', FILE, 4), ('link', SYMLINK, None),
+                          ('sub', DIRECTORY, None)])
+        for name in WALKERS:
+            self.assertEqual(make_walker(name).entries(self.path('root')), expected, name)
+
+    def test_device_and_inode(self):
+        for name in WALKERS:
+            entries = dict((e.name, e) for e in make_walker(name).entries(self.path('root')))
+            for entry_name in ('a.txt', 'sub'):
+                st = os.lstat(self.path('root', entry_name))
+                entry = entries[entry_name]
+                self.assertEqual((entry.dev, entry.ino, entry.mtime), (st.st_dev, st.st_ino, st.st_mtime))
+            link = entries['link']
+            self.assertEqual((link.mtime, link.dev, link.ino), (None, None, None))
+
+    def test_lstat_counts(self):
+        walker = make_walker('lstat')
+        walker.entries(self.path('root'))
+        self.assertEqual(walker.stats.get('scan', 'listdir'), 1)
+        self.assertEqual(walker.stats.get('scan', 'lstat'), 4)
+        self.assertEqual(walker.stats.get('scan', 'stat'), 0)
@@ -0,0 +1,303 @@
+"""
+Content verification for duplicate sets.
+
+Instead of comparing the copies of a set pairwise with filecmp, the files
+at the same position in all copies are checked in stages:
+
+1. size (one stat per file)
+2. hash of the first and last PARTIAL_SIZE bytes
+3. full hash, only for files that still match and are larger than what
+   stage 2 already read
+
+Hashes are cached by (device, inode, size, mtime), so each physical file
+is read in full at most once, even if it is part of several sets or
+hardlinked into several copies. Stat and hashing run on a thread pool.
+Files are hashed with the backend hash_name (see hashing).
+
+The full hash reads files with one of READERS:
+
+- read: buffered reads of BLOCK_SIZE
+- mmap: files of at least MMAP_MIN_SIZE are memory-mapped and hashed in
+  windows of MMAP_WINDOW without copying, smaller files and files that
+  can't be mapped are read as above
+
+Both advise the kernel that the file is read sequentially (where python
+offers posix_fadvise/madvise). Bytes, seconds (summed over all threads)
+and MB/s of each reader in the full hash stage are counted in stats.
+
+partition() runs the same stages on groups of candidates of the same
+size and splits them into groups of identical files (--files).
+"""
+
+from __future__ import print_function
+
+from timeit import default_timer
+import os
+
+from hashing import DEFAULT_HASH, hexdigest, new as new_hash
+from stats import Stats
+
+PARTIAL_SIZE = 4 * 1024
+BLOCK_SIZE = 1024 * 1024
+READERS = ('read', 'mmap')
+DEFAULT_READER = 'read'
+MMAP_MIN_SIZE = 16 * 1024 * 1024
+MMAP_WINDOW = 16 * 1024 * 1024
+MB = 1024.0 * 1024
+
+try:
+    # python 2, mmap doesn't support memoryview
+    _buffer = buffer
+except NameError:
+    _buffer = None
+
+
+def _advise_sequential(f, mm=None):
+    """Only a hint, errors are ignored."""
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if mm is not None and hasattr(mm, 'madvise'):
+            import mmap
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+    except (EnvironmentError, ValueError):
+        pass
+
+
+def _hash_read(f, m):
+    """Update m with the rest of file f, return the number of bytes read."""
+    read = 0
+    while True:
+        block = f.read(BLOCK_SIZE)
+        if not block:
+            return read
+        m.update(block)
+        read += len(block)
+
+
+def _hash_mmap(f, m):
+    """Update m with the contents of file f (mapped), return the number of bytes."""
+    import mmap
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        _advise_sequential(f, mm)
+        size = len(mm)
+        if _buffer is not None:
+            for offset in range(0, size, MMAP_WINDOW):
+                m.update(_buffer(mm, offset, MMAP_WINDOW))
+        else:
+            view = memoryview(mm)
+            try:
+                for offset in range(0, size, MMAP_WINDOW):
+                    m.update(view[offset:offset + MMAP_WINDOW])
+            finally:
+                view.release()
+        return size
+    finally:
+        mm.close()
+
+
+class ContentVerifier(object):
+    """Verify that files are identical, counts work in stats (phase 'filecmp')."""
+
+    def __init__(self, jobs=1, stats=None, partial_size=PARTIAL_SIZE, hash_name=DEFAULT_HASH,
+                 reader=DEFAULT_READER):
+        if stats is None:
+            stats = Stats()
+        self.stats = stats
+        self.partial_size = partial_size
+        self.hash_name = hash_name
+        self.reader = reader
+        self.pool = None
+        if jobs > 1:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(jobs)
+        # (file key, stage) -> hex digest
+        self._hashes = {}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        counters = self.stats.values('filecmp')
+        for reader in READERS:
+            seconds = counters.get('seconds (%s)' % reader)
+            if seconds:
+                self.stats.set('filecmp', 'seconds (%s)' % reader, round(seconds, 3))
+                self.stats.set('filecmp', 'MB/s (%s)' % reader, round(
+                    counters['bytes hashed (%s)' % reader] / MB / seconds, 1))
+
+    def _map(self, func, items):
+        if self.pool is None:
+            return [func(item) for item in items]
+        return self.pool.map(func, items)
+
+    def _stat(self, path):
+        """Return (path, file key) or (path, None) if the file is not accessible."""
+        self.stats.count('filecmp', 'stat')
+        try:
+            st = os.stat(path)
+        except OSError:
+            return path, None
+        return path, (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+    def _hash(self, job):
+        """Return (key, hex digest or None) for job (stage, key, path)."""
+        stage, key, path = job
+        size = key[2]
+        m = new_hash(self.hash_name)
+        start = default_timer()
+        try:
+            with open(path, 'rb') as f:
+                reader = None
+                if stage == 'partial' and size > 2 * self.partial_size:
+                    m.update(f.read(self.partial_size))
+                    f.seek(-self.partial_size, os.SEEK_END)
+                    m.update(f.read(self.partial_size))
+                    read = 2 * self.partial_size
+                elif stage == 'partial':
+                    read = _hash_read(f, m)
+                else:
+                    reader, read = self._hash_file(f, size, m)
+        except (IOError, OSError):
+            return key, None
+        count = self.stats.count
+        count('filecmp', '%s hash' % stage)
+        count('filecmp', 'bytes hashed', read)
+        if reader is not None:
+            count('filecmp', 'bytes hashed (%s)' % reader, read)
+            count('filecmp', 'seconds (%s)' % reader, default_timer() - start)
+        return key, hexdigest(self.hash_name, m)
+
+    def _hash_file(self, f, size, m):
+        """Update m with all of file f, return (reader, bytes read)."""
+        if self.reader == 'mmap' and size >= MMAP_MIN_SIZE:
+            try:
+                return 'mmap', _hash_mmap(f, m)
+            except (EnvironmentError, ValueError):
+                # mmap.error, e.g. a file system without mmap, nothing
+                # was hashed yet
+                self.stats.count('filecmp', 'mmap failed')
+        _advise_sequential(f)
+        return 'read', _hash_read(f, m)
+
+    def _run_stage(self, stage, groups, keys):
+        """Hash all files of groups that are not cached yet."""
+        jobs = {}
+        for _idx, group in groups:
+            for path in group:
+                key = keys[path]
+                if (key, stage) not in self._hashes:
+                    jobs[key] = (stage, key, path)
+        for key, digest in self._map(self._hash, list(jobs.values())):
+            self._hashes[key, stage] = digest
+
+    def compare(self, groups):
+        """
+        groups is a list of sequences of paths, each with the same file
+        in all copies.
+
+        Return a list of (a, b) for all files b that differ from the first
+        file a of their group, in the order of groups.
+        """
+        groups = list(groups)
+        paths = set(path for group in groups for path in group)
+        keys = dict(self._map(self._stat, list(paths)))
+
+        def differs(a, b, stage):
+            if keys[a] is None or keys[b] is None:
+                return True
+            if stage == 'size':
+                return keys[a][2] != keys[b][2]
+            digest = self._hashes[keys[a], stage]
+            return digest is None or digest != self._hashes[keys[b], stage]
+
+        mismatches = []
+
+        def check(groups, stage):
+            """Return groups that still match after stage."""
+            matching = []
+            for idx, group in groups:
+                different = [b for b in group[1:] if differs(group[0], b, stage)]
+                if different:
+                    mismatches.extend((idx, group[0], b) for b in different)
+                else:
+                    matching.append((idx, group))
+            return matching
+
+        groups = check(enumerate(groups), 'size')
+        # groups of hardlinks are identical
+        groups = [(idx, group) for idx, group in groups
+                  if len(set(keys[path] for path in group)) > 1]
+        self._run_stage('partial', groups, keys)
+        groups = check(groups, 'partial')
+        # small files were hashed completely in the partial stage
+        groups = [(idx, group) for idx, group in groups
+                  if keys[group[0]][2] > 2 * self.partial_size]
+        self._run_stage('full', groups, keys)
+        check(groups, 'full')
+        mismatches.sort(key=lambda mismatch: mismatch[0])
+        return [(a, b) for _idx, a, b in mismatches]
+
+    def partition(self, groups):
+        """
+        groups is a list of sequences of paths of files with the same size.
+
+        Return (size, digest, paths) for each group of identical files with
+        more than one path, in the order of groups. Of several hardlinks to
+        one file only the first path is kept.
+        """
+        groups = list(groups)
+        paths = set(path for group in groups for path in group)
+        keys = dict(self._map(self._stat, list(paths)))
+
+        def split(groups, digest_of):
+            """Split groups by digest_of(path), keep the order of paths."""
+            result = []
+            for idx, group in groups:
+                by_digest = {}
+                order = []
+                for path in group:
+                    digest = digest_of(path)
+                    if digest is None:
+                        continue
+                    if digest not in by_digest:
+                        by_digest[digest] = []
+                        order.append(digest)
+                    by_digest[digest].append(path)
+                result.extend((idx, by_digest[digest]) for digest in order
+                              if len(by_digest[digest]) > 1)
+            return result
+
+        unique = []
+        for idx, group in enumerate(groups):
+            seen = set()
+            files = []
+            for path in group:
+                key = keys[path]
+                if key is None:
+                    continue
+                # without inode numbers every path is a file of its own
+                physical = key[:2] if key[1] else path
+                if physical in seen:
+                    self.stats.count('filecmp', 'hardlinks skipped')
+                    continue
+                seen.add(physical)
+                files.append(path)
+            unique.append((idx, files))
+        # sizes may have changed since the scan
+        groups = split(unique, lambda path: keys[path][2])
+        self._run_stage('partial', groups, keys)
+        groups = split(groups, lambda path: self._hashes[keys[path], 'partial'])
+        # small files were hashed completely in the partial stage
+        small = [(idx, group) for idx, group in groups
+                 if keys[group[0]][2] <= 2 * self.partial_size]
+        large = [(idx, group) for idx, group in groups
+                 if keys[group[0]][2] > 2 * self.partial_size]
+        self._run_stage('full', large, keys)
+        large = split(large, lambda path: self._hashes[keys[path], 'full'])
+        result = [(idx, self._hashes[keys[group[0]], 'partial'], group) for idx, group in small]
+        result.extend((idx, self._hashes[keys[group[0]], 'full'], group) for idx, group in large)
+        result.sort(key=lambda item: item[0])
+        return [(keys[group[0]][2], digest, group) for _idx, digest, group in result]
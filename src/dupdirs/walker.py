@@ -0,0 +1,182 @@
+"""
+Walker engines read the entries of a single directory for DirTree.
+
+All engines return the same list of entries (sorted by name), they only
+differ in the number of syscalls needed to get there:
+
+- listdir: the original implementation, listdir, then islink, isfile and stat
+  for every entry (3 stats per entry)
+- lstat: listdir and a single lstat per entry
+- scandir: the type of an entry comes from readdir, symlinks are not
+  stat'ed (on Windows the stat data comes for free with the listing)
+
+scandir is in the standard library from Python 3.5 on, for older versions
+the scandir package is used if it is installed.
+
+With filters (see filters.Filters) excluded entries are dropped as early
+as possible, excluded directories are never read.
+"""
+
+from __future__ import print_function
+
+from collections import namedtuple
+import os
+import stat
+
+from stats import Stats
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+FILE = 'file'
+DIRECTORY = 'directory'
+SYMLINK = 'symlink'
+
+#: size is only set for files, mtime, dev and ino for files and
+#: directories (ino may be 0 if the platform does not have inodes)
+Entry = namedtuple('Entry', 'name kind size mtime dev ino')
+
+
+class Walker(object):
+    """
+    Base class for all walker engines, counts syscalls in stats
+    (phase 'scan') and excluded entries (phase 'filter').
+    """
+    name = None
+
+    def __init__(self, stats=None, filters=None):
+        if stats is None:
+            stats = Stats()
+        self.stats = stats
+        self.filters = filters or None
+
+    def _excluded(self, path, name, is_dir):
+        """Return True if the entry name in path is excluded by the filters."""
+        if self.filters.accept(os.path.join(path, name), name, is_dir):
+            return False
+        self.stats.count('filter', 'directories excluded' if is_dir else 'files excluded')
+        return True
+
+    def _too_small(self, size):
+        if self.filters.accept_size(size):
+            return False
+        self.stats.count('filter', 'files excluded (size)')
+        return True
+
+    def entries(self, path):
+        """Return a list of Entry for path, sorted by name."""
+        raise NotImplementedError
+
+
+class ListdirWalker(Walker):
+    """The original engine, kept as a reference for syscall counts."""
+    name = 'listdir'
+
+    def entries(self, path):
+        count = self.stats.count
+        count('scan', 'listdir')
+        filters = self.filters
+        result = []
+        for name in sorted(os.listdir(path)):
+            fp = os.path.join(path, name)
+            count('scan', 'lstat')
+            if os.path.islink(fp):
+                if not (filters and self._excluded(path, name, False)):
+                    result.append(Entry(name, SYMLINK, None, None, None, None))
+                continue
+            count('scan', 'stat')
+            is_file = os.path.isfile(fp)
+            if filters and self._excluded(path, name, not is_file):
+                continue
+            if is_file:
+                count('scan', 'stat')
+                st = os.stat(fp)
+                if filters and self._too_small(st.st_size):
+                    continue
+                result.append(Entry(name, FILE, st.st_size, st.st_mtime, st.st_dev, st.st_ino))
+            else:
+                count('scan', 'stat')
+                st = os.stat(fp)
+                result.append(Entry(name, DIRECTORY, None, st.st_mtime, st.st_dev, st.st_ino))
+        return result
+
+
+class LstatWalker(Walker):
+    """listdir plus one lstat per entry, for Pythons without scandir."""
+    name = 'lstat'
+
+    def entries(self, path):
+        count = self.stats.count
+        count('scan', 'listdir')
+        filters = self.filters
+        result = []
+        for name in sorted(os.listdir(path)):
+            count('scan', 'lstat')
+            st = os.lstat(os.path.join(path, name))
+            if filters and (self._excluded(path, name, stat.S_ISDIR(st.st_mode)) or
+                            stat.S_ISREG(st.st_mode) and self._too_small(st.st_size)):
+                continue
+            if stat.S_ISLNK(st.st_mode):
+                result.append(Entry(name, SYMLINK, None, None, None, None))
+            elif stat.S_ISREG(st.st_mode):
+                result.append(Entry(name, FILE, st.st_size, st.st_mtime, st.st_dev, st.st_ino))
+            else:
+                result.append(Entry(name, DIRECTORY, None, st.st_mtime, st.st_dev, st.st_ino))
+        return result
+
+
+class ScandirWalker(Walker):
+    """
+    Use the DirEntry type information, only stat files and directories
+    (for their device).
+
+    If the file system does not report the entry type, is_symlink() and
+    is_file() need an additional lstat which is not counted.
+    """
+    name = 'scandir'
+
+    def entries(self, path):
+        count = self.stats.count
+        count('scan', 'scandir')
+        filters = self.filters
+        result = []
+        for entry in scandir(path):
+            if entry.is_symlink():
+                if not (filters and self._excluded(path, entry.name, False)):
+                    result.append(Entry(entry.name, SYMLINK, None, None, None, None))
+                continue
+            is_file = entry.is_file()
+            if filters and self._excluded(path, entry.name, not is_file):
+                continue
+            if os.name != 'nt':
+                count('scan', 'stat')
+            st = entry.stat()
+            if is_file and filters and self._too_small(st.st_size):
+                continue
+            if is_file:
+                result.append(Entry(entry.name, FILE, st.st_size, st.st_mtime, st.st_dev, st.st_ino))
+            else:
+                result.append(Entry(entry.name, DIRECTORY, None, st.st_mtime, st.st_dev, st.st_ino))
+        result.sort(key=lambda e: e.name)
+        return result
+
+
+#: all walkers available on this system
+WALKERS = dict((cls.name, cls) for cls in (ListdirWalker, LstatWalker))
+if scandir is not None:
+    WALKERS[ScandirWalker.name] = ScandirWalker
+
+DEFAULT_WALKER = 'scandir' if scandir is not None else 'lstat'
+
+
+def make_walker(name=None, stats=None, filters=None):
+    """Return a walker instance for name (default: the fastest available)."""
+    if name is None:
+        name = DEFAULT_WALKER
+    return WALKERS[name](stats, filters)
@@ -0,0 +1,272 @@
+"""
+Watch mode: keep the index of a scan up to date with inotify (Linux).
+
+Every directory of the scan is watched. Events are collected until the
+tree has been quiet for a moment (or a batch gets too old), then only
+the changed directories and their ancestors are read again
+(DirTree.refresh), the DirTrees of all other subdirectories are kept.
+After each batch the caller gets the updated Factory, e.g. to rewrite a
+report.
+
+Counters and timers go to stats (phase 'watch'): events, batches,
+directories refreshed, queue depth (events in the last batch and the
+maximum), update latency (first event of a batch until the trees are
+updated, before on_update runs; last and maximum).
+
+inotify is used through ctypes, there are no dependencies. When the
+kernel queue overflows, everything is read again.
+"""
+
+from __future__ import print_function
+
+from timeit import default_timer
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+
+from dirtree import DirIndex, SymlinkError
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_CLOEXEC = 0o2000000
+
+#: everything that changes entries, sizes or mtimes of a directory
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+EVENT = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+#: seconds without events before a batch is processed
+QUIET_TIME = 0.5
+#: a batch is processed after this many seconds, even if events keep coming
+MAX_DELAY = 5.0
+
+
+class WatchError(Exception):
+    """Raised when inotify is not available."""
+
+
+class Inotify(object):
+    """Minimal inotify binding, read() returns (wd, mask, cookie, name) tuples."""
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            fd = libc.inotify_init1(IN_CLOEXEC)
+        except (OSError, AttributeError):
+            raise WatchError('watch mode needs inotify (Linux)')
+        if fd < 0:
+            raise WatchError('inotify_init1: %s' % os.strerror(ctypes.get_errno()))
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = fd
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Return the watch descriptor for path, raise OSError if it can't be watched."""
+        if not isinstance(path, bytes):
+            path = os.fsencode(path)
+        wd = self._add_watch(self.fd, path, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """Return all events that are available within timeout seconds (None: wait)."""
+        try:
+            ready, _w, _x = select.select([self.fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        if not ready:
+            return []
+        data = os.read(self.fd, READ_SIZE)
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchDirIndex(DirIndex):
+    """
+    DirIndex that allows a directory under a new path when it is gone
+    from the old one (moved), bind mounts are still read only once.
+    """
+
+    def visit(self, dev, ino, path):
+        if not ino:
+            return True
+        with self._lock:
+            seen = self._paths.get((dev, ino))
+            if seen is not None and seen != path:
+                try:
+                    st = os.stat(seen)
+                    if (st.st_dev, st.st_ino) == (dev, ino):
+                        self._skipped.setdefault((dev, ino), []).append(path)
+                        return False
+                except OSError:
+                    pass
+            self._paths[dev, ino] = path
+            return True
+
+
+class Watcher(object):
+    """
+    Keep the DirTrees of a finished scan (trees, all in factory) up to
+    date. rescan() is called with no arguments when everything has to be
+    read again and returns the new trees.
+    """
+
+    def __init__(self, factory, trees, rescan, stats):
+        self.factory = factory
+        self.trees = trees
+        self.rescan = rescan
+        self.stats = stats
+        self.inotify = Inotify()
+        #: path by watch descriptor and the other way round
+        self._paths = {}
+        self._wds = {}
+        #: path of the parent by path
+        self._parents = {}
+        self._sync_watches()
+
+    def close(self):
+        self.inotify.close()
+
+    def _sync_watches(self):
+        """Watch all directories of the index, forget the ones that are gone."""
+        self._parents = {}
+        for item in self.factory.ordered_values():
+            for child in item.children:
+                self._parents[child.path] = item.path
+        current = set(self.factory.ordered_keys)
+        for path in list(self._wds):
+            if path not in current:
+                wd = self._wds.pop(path)
+                self._paths.pop(wd, None)
+                self.inotify.rm_watch(wd)
+        for path in self.factory.ordered_keys:
+            if path in self._wds:
+                continue
+            try:
+                wd = self.inotify.add_watch(path)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    # fs.inotify.max_user_watches
+                    self.stats.count('watch', 'directories not watched (limit)')
+                else:
+                    self.stats.count('watch', 'directories not watched')
+                continue
+            # a path replaced by another directory gets the same wd again
+            self._paths[wd] = path
+            self._wds[path] = wd
+        self.stats.set('watch', 'directories watched', len(self._wds))
+
+    def _collect(self, events, dirty):
+        """Add the directories changed by events to dirty, return False on overflow."""
+        count = self.stats.count
+        for wd, mask, _cookie, _name in events:
+            count('watch', 'events')
+            if mask & IN_Q_OVERFLOW:
+                count('watch', 'queue overflows')
+                return False
+            path = self._paths.get(wd)
+            if path is None:
+                continue
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                if self._wds.get(path) == wd:
+                    del self._wds[path]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # the parent gets an event as well, a new directory under
+                # this path is watched again after the update
+                self.inotify.rm_watch(wd)
+                self._paths.pop(wd, None)
+                if self._wds.get(path) == wd:
+                    del self._wds[path]
+                continue
+            dirty.add(path)
+        return True
+
+    def _update(self, dirty):
+        """Refresh dirty directories and their ancestors, deepest first."""
+        todo = set()
+        for path in dirty:
+            while path is not None and path not in todo:
+                todo.add(path)
+                path = self._parents.get(path)
+        for path in sorted(todo, key=lambda path: -path.count(os.sep)):
+            item = self.factory.get(path)
+            if item is None:
+                continue
+            try:
+                item.refresh()
+            except (OSError, IOError):
+                # removed, its parent is refreshed as well
+                continue
+            except SymlinkError as e:
+                self.factory.warn('WARNING, symlink found, directory not updated: %s' % e)
+                self.stats.count('watch', 'errors')
+                continue
+            self.stats.count('watch', 'directories refreshed')
+        self.factory.reorder(self.trees)
+
+    def run(self, on_update, quiet_time=QUIET_TIME, max_delay=MAX_DELAY):
+        """Process changes until interrupted, call on_update(factory) after each batch."""
+        stats = self.stats
+        while True:
+            events = self.inotify.read()
+            start = default_timer()
+            dirty = set()
+            complete = True
+            depth = 0
+            while events:
+                depth += len(events)
+                complete = self._collect(events, dirty) and complete
+                if default_timer() - start > max_delay:
+                    break
+                events = self.inotify.read(quiet_time)
+            stats.count('watch', 'batches')
+            stats.set('watch', 'queue depth', depth)
+            stats.set('watch', 'max queue depth', max(depth, stats.get('watch', 'max queue depth')))
+            if not complete:
+                self.trees = self.rescan()
+            elif dirty:
+                self._update(dirty)
+            else:
+                continue
+            self._sync_watches()
+            # before on_update, which writes the report and the stats file
+            latency = default_timer() - start
+            stats.set('watch', 'update latency (s)', round(latency, 3))
+            stats.set('watch', 'max update latency (s)',
+                      max(round(latency, 3), stats.get('watch', 'max update latency (s)')))
+            on_update(self.factory)
@@ -23,6 +23,7 @@ setup(
     entry_points = {
         'console_scripts': [
             'dupdirs = dupdirs.__main__:main',
+            'dupdirs-benchmark = dupdirs.benchmark:main',
         ],
     }
 